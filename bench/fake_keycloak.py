@@ -0,0 +1,143 @@
+"""
+Local HTTP stand-in for the Keycloak endpoints the server calls: the token
+endpoint (password / refresh_token grants, user realm and master realm), the
+realm JWKS and the admin user search / lookup. Tokens are real RS256 JWTs
+signed with a throwaway key, so verify_token runs its normal code path.
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+
+class FakeKeycloak:
+    def __init__(self, realm: str, client_id: str, db_attrs: Dict[str, str],
+                 token_ttl: int = 300, latency_ms: float = 2.0):
+        self.realm = realm
+        self.client_id = client_id
+        self.db_attrs = db_attrs
+        self.token_ttl = token_ttl
+        self.latency_ms = latency_ms
+        self.kid = "bench-key"
+        self.requests: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._users: Dict[str, str] = {}  # username -> id
+
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self._private_pem = key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        )
+        jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(key.public_key()))
+        jwk.update({"kid": self.kid, "use": "sig", "alg": "RS256"})
+        self._jwks = {"keys": [jwk]}
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _user_id(self, username: str) -> str:
+        with self._lock:
+            return self._users.setdefault(username, str(uuid.uuid4()))
+
+    def _tokens(self, username: str) -> Dict[str, Any]:
+        now = int(time.time())
+        claims = {
+            "sub": self._user_id(username),
+            "preferred_username": username,
+            "aud": self.client_id,
+            "iat": now,
+            "exp": now + self.token_ttl,
+            "jti": uuid.uuid4().hex,
+        }
+        access = jwt.encode(claims, self._private_pem, algorithm="RS256", headers={"kid": self.kid})
+        return {
+            "access_token": access,
+            "refresh_token": f"refresh:{username}:{uuid.uuid4().hex}",
+            "expires_in": self.token_ttl,
+            "refresh_expires_in": self.token_ttl * 6,
+            "token_type": "Bearer",
+        }
+
+    def _user(self, username: str) -> Dict[str, Any]:
+        return {
+            "id": self._user_id(username),
+            "username": username,
+            "attributes": {k: [v] for k, v in self.db_attrs.items()},
+        }
+
+    def handle(self, method: str, path: str, query: Dict[str, list], form: Dict[str, list]):
+        """Return (status, body) for one request."""
+        with self._lock:
+            route = path.rsplit("/", 1)[-1] if "/users/" not in path else "users/{id}"
+            self.requests[route] = self.requests.get(route, 0) + 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0 * random.uniform(0.9, 1.1))
+
+        if method == "POST" and path.endswith("/protocol/openid-connect/token"):
+            grant = (form.get("grant_type") or [""])[0]
+            if grant == "password":
+                return 200, self._tokens((form.get("username") or ["bench"])[0])
+            if grant == "refresh_token":
+                token = (form.get("refresh_token") or [""])[0]
+                if not token.startswith("refresh:"):
+                    return 400, {"error": "invalid_grant"}
+                return 200, self._tokens(token.split(":")[1])
+            return 400, {"error": "unsupported_grant_type"}
+        if method == "GET" and path == f"/realms/{self.realm}/protocol/openid-connect/certs":
+            return 200, self._jwks
+        if method == "GET" and path == f"/admin/realms/{self.realm}/users":
+            username = (query.get("username") or [""])[0]
+            return 200, [self._user(username)] if username else []
+        if method == "GET" and path.startswith(f"/admin/realms/{self.realm}/users/"):
+            user_id = path.rsplit("/", 1)[-1]
+            with self._lock:
+                names = [u for u, i in self._users.items() if i == user_id]
+            return (200, self._user(names[0])) if names else (404, {"error": "User not found"})
+        return 404, {"error": "not found"}
+
+    def start(self) -> "FakeKeycloak":
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like the real server
+
+            def _reply(self, status, body):
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                self._reply(*fake.handle("GET", parsed.path, parse_qs(parsed.query), {}))
+
+            def do_POST(self):
+                parsed = urlparse(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                form = parse_qs(self.rfile.read(length).decode("utf-8"))
+                self._reply(*fake.handle("POST", parsed.path, parse_qs(parsed.query), form))
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="fake-keycloak", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
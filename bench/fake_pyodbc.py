@@ -0,0 +1,280 @@
+"""
+Stand-in for the parts of pyodbc this server uses, with tunable latency.
+
+Installed as sys.modules["pyodbc"] by bench/run.py before anything imports db.py.
+Queries are routed by a few markers (sys.databases listing, catalog probes,
+DB_NAME() pings, USE); every other SELECT returns a synthetic result set whose size
+comes from CONFIG or an inline "/* rows=N */" comment.
+"""
+import datetime
+import decimal
+import random
+import re
+import threading
+import time
+from functools import lru_cache
+
+CONFIG = {
+    "connect_ms": 50.0,      # pyodbc.connect (TLS + login)
+    "execute_ms": 5.0,       # per execute / executemany round trip
+    "fetch_ms_per_1k": 2.0,  # per 1000 rows fetched
+    "rows": 100,             # default SELECT result size
+    "columns": 8,
+    "databases": 5,          # user databases reported by sys.databases
+    "tables": 20,            # tables per database in the catalog
+    "jitter": 0.1,           # +/- fraction applied to every latency
+}
+
+STATS = {"connects": 0, "executes": 0, "rows_fetched": 0}
+_STATS_LOCK = threading.Lock()
+
+SQL_ATTR_QUERY_TIMEOUT = 0
+
+
+class Error(Exception):
+    pass
+
+
+class DatabaseError(Error):
+    pass
+
+
+class OperationalError(DatabaseError):
+    pass
+
+
+class ProgrammingError(DatabaseError):
+    pass
+
+
+class InterfaceError(Error):
+    pass
+
+
+def _sleep(ms: float):
+    if ms > 0:
+        j = CONFIG["jitter"]
+        time.sleep(ms / 1000.0 * random.uniform(1 - j, 1 + j))
+
+
+def _count(key: str, n: int = 1):
+    with _STATS_LOCK:
+        STATS[key] += n
+
+
+def reset_stats():
+    with _STATS_LOCK:
+        for k in STATS:
+            STATS[k] = 0
+
+
+_COLUMN_TYPES = [
+    ("id", int, lambda i: i),
+    ("name", str, lambda i: f"name-{i}"),
+    ("amount", decimal.Decimal, lambda i: decimal.Decimal(i) / 100),
+    ("created", datetime.datetime, lambda i: datetime.datetime(2024, 1, 1) + datetime.timedelta(minutes=i)),
+    ("active", bool, lambda i: i % 2 == 0),
+    ("ratio", float, lambda i: i / 7.0),
+    ("payload", bytearray, lambda i: bytearray(b"\x00\x01" * 4)),
+    ("note", str, lambda i: None if i % 5 == 0 else "lorem ipsum dolor"),
+]
+
+
+@lru_cache(maxsize=32)
+def _synthetic(rows: int, columns: int):
+    cols = [_COLUMN_TYPES[c % len(_COLUMN_TYPES)] for c in range(columns)]
+    description = tuple(
+        (name if c < len(_COLUMN_TYPES) else f"{name}_{c}", typ, None, None, None, None, True)
+        for c, (name, typ, _) in enumerate(cols)
+    )
+    data = [tuple(gen(i) for _, _, gen in cols) for i in range(rows)]
+    return description, data
+
+
+def _desc(*names):
+    return tuple((n, str, None, None, None, None, True) for n in names)
+
+
+_MODIFIED = datetime.datetime(2024, 1, 1)
+
+
+def _route(sql: str):
+    """Return (description, rows) for a statement, or (None, None) for non-queries."""
+    s = " ".join(sql.split())
+    upper = s.upper()
+    if upper == "SELECT 1":
+        return _desc("x"), [(1,)]
+    if upper == "SELECT XACT_STATE()":
+        return _desc("state"), [(1,)]
+    if " INTO #" in upper:
+        return None, None
+    if "WHERE NOT EXISTS" in upper and "#MCP_STAGE" in upper:
+        return _desc("row_no"), []
+    if "FROM SYS.DATABASES" in upper and "DECLARE" not in upper:
+        names = ["master", "tempdb", "model", "msdb"] + [f"bench_db_{i}" for i in range(CONFIG["databases"])]
+        return _desc("name", "create_date"), [(n, _MODIFIED) for n in names]
+    if "MAX(MODIFY_DATE), COUNT(*)" in upper:
+        return _desc("modified", "objects"), [(_MODIFIED, CONFIG["tables"])]
+    if upper.startswith("SELECT OBJECT_ID, MODIFY_DATE"):
+        return _desc("object_id", "modify_date"), [(i, _MODIFIED) for i in range(CONFIG["tables"])]
+    if "O.OBJECT_ID, S.NAME, O.NAME" in upper:
+        rows = []
+        for t in range(CONFIG["tables"]):
+            for name, typ, _ in _COLUMN_TYPES:
+                rows.append((t, "dbo", f"table_{t}", _MODIFIED, name, typ.__name__, "YES", None))
+        return _desc("object_id", "schema", "name", "modify_date", "col", "type", "nullable", "default"), rows
+    if "SYS.DM_HADR_DATABASE_REPLICA_STATES" in upper:
+        return _desc("redo_queue_size", "redo_rate", "health"), [(0, 1000, "HEALTHY")]
+    if "FROM SYS.INDEXES" in upper:
+        rows = []
+        for t in range(CONFIG["tables"]):
+            rows.append((t, f"PK_table_{t}", "CLUSTERED", True, True, "id", 1, False, False))
+            rows.append((t, f"IX_table_{t}_name", "NONCLUSTERED", False, False, "name", 1, False, False))
+            rows.append((t, f"IX_table_{t}_name", "NONCLUSTERED", False, False, "amount", 0, True, False))
+        return _desc("object_id", "name", "type", "pk", "unique", "col", "ord", "incl", "desc"), rows
+    if "FROM SYS.FOREIGN_KEYS" in upper:
+        rows = [(t, f"FK_table_{t}_table_0", "dbo", "table_0", "id", "id", "NO_ACTION", "NO_ACTION")
+                for t in range(1, CONFIG["tables"])]
+        return _desc("object_id", "name", "ref_schema", "ref_table", "col", "ref_col", "del", "upd"), rows
+    if "FROM SYS.DM_DB_PARTITION_STATS" in upper:
+        return _desc("object_id", "rows", "kb"), [(t, 1000 * t, 72) for t in range(CONFIG["tables"])]
+    if upper.startswith("SELECT") or upper.startswith("WITH"):
+        m = re.search(r"rows=(\d+)", s)
+        n = int(m.group(1)) if m else CONFIG["rows"]
+        description, data = _synthetic(n, CONFIG["columns"])
+        return description, data
+    return None, None
+
+
+_SHOWPLAN = _desc("Microsoft SQL Server 2005 XML Showplan")
+_PLAN_XML = """<ShowPlanXML xmlns="http://schemas.microsoft.com/sqlserver/2004/07/showplan"><BatchSequence><Batch>
+<Statements><StmtSimple StatementSubTreeCost="0.5"><QueryPlan>
+<MissingIndexes><MissingIndexGroup Impact="87.5"><MissingIndex Database="[bench]" Schema="[dbo]" Table="[table_0]">
+<ColumnGroup Usage="EQUALITY"><Column Name="[name]"/></ColumnGroup><ColumnGroup Usage="INCLUDE"><Column Name="[amount]"/>
+</ColumnGroup></MissingIndex></MissingIndexGroup></MissingIndexes>
+<QueryTimeStats CpuTime="3" ElapsedTime="5"/>
+<RelOp NodeId="0" PhysicalOp="Nested Loops" LogicalOp="Inner Join" EstimateRows="100" EstimatedTotalSubtreeCost="0.5">
+<NestedLoops><RelOp NodeId="1" PhysicalOp="Clustered Index Scan" LogicalOp="Clustered Index Scan" EstimateRows="100"
+ EstimatedTotalSubtreeCost="0.4"><RunTimeInformation><RunTimeCountersPerThread Thread="0" ActualRows="100"
+ ActualLogicalReads="42" ActualElapsedms="4"/></RunTimeInformation><IndexScan><Object Schema="[dbo]" Table="[table_0]"
+ Index="[PK_table_0]"/></IndexScan></RelOp></NestedLoops></RelOp>
+</QueryPlan></StmtSimple></Statements></Batch></BatchSequence></ShowPlanXML>"""
+_STAT_MESSAGES = [
+    ("[01000] (3615)", "Table 'table_0'. Scan count 1, logical reads 42, physical reads 0, read-ahead reads 0."),
+    ("[01000] (3612)", "SQL Server Execution Times:\n   CPU time = 3 ms,  elapsed time = 5 ms."),
+]
+
+
+class Cursor:
+    def __init__(self, conn):
+        self.connection = conn
+        self.description = None
+        self.rowcount = -1
+        self.fast_executemany = False
+        self.messages = []
+        self._rows = []
+        self._pos = 0
+        self._sets = []
+
+    def execute(self, sql, *params):
+        _sleep(CONFIG["execute_ms"])
+        _count("executes")
+        self.messages, self._sets = [], []
+        upper = " ".join(sql.split()).upper()
+        if upper == "SELECT DB_NAME()":
+            self.description, rows = _desc("name"), [(self.connection.database,)]
+        elif upper.startswith("USE "):
+            self.connection.database = sql.split(None, 1)[1].strip().strip("[];")
+            self.description, rows = None, None
+        elif upper.startswith("SET STATISTICS") or upper.startswith("SET SHOWPLAN_XML"):
+            # SET options stick to the connection, as on SQL Server
+            if "STATISTICS XML" in upper:
+                self.connection.statistics = upper.endswith("ON")
+            if "SHOWPLAN_XML" in upper:
+                self.connection.showplan = upper.endswith("ON")
+            self.description, rows = None, None
+        elif self.connection.showplan:
+            self.description, rows = _SHOWPLAN, [(_PLAN_XML,)]
+        else:
+            self.description, rows = _route(sql)
+            if self.connection.statistics:
+                self.messages = list(_STAT_MESSAGES)
+                self._sets.append((_SHOWPLAN, [(_PLAN_XML,)]))
+        self._rows = rows or []
+        self._pos = 0
+        self.rowcount = -1 if self.description else 1
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        seq = list(seq_of_params)
+        _sleep(CONFIG["execute_ms"] + (0.01 * len(seq) if self.fast_executemany else CONFIG["execute_ms"] * (len(seq) - 1)))
+        _count("executes")
+        self.description = None
+        self._rows = []
+        self.rowcount = len(seq)
+
+    def _take(self, n):
+        chunk = self._rows[self._pos:self._pos + n]
+        self._pos += len(chunk)
+        if chunk:
+            _sleep(CONFIG["fetch_ms_per_1k"] * len(chunk) / 1000.0)
+            _count("rows_fetched", len(chunk))
+        return chunk
+
+    def fetchone(self):
+        chunk = self._take(1)
+        return chunk[0] if chunk else None
+
+    def fetchmany(self, size=1):
+        return self._take(size)
+
+    def fetchall(self):
+        return self._take(len(self._rows) - self._pos)
+
+    def nextset(self):
+        if not self._sets:
+            return False
+        self.description, self._rows = self._sets.pop(0)
+        self._pos = 0
+        self.messages = []
+        return True
+
+    def cancel(self):
+        pass
+
+    def close(self):
+        self._rows = []
+
+
+class Connection:
+    def __init__(self, autocommit=False, database="master"):
+        self.autocommit = autocommit
+        self.database = database
+        self.timeout = 0
+        self.closed = False
+        self.statistics = False
+        self.showplan = False
+
+    def cursor(self):
+        if self.closed:
+            raise InterfaceError("Connection is closed")
+        return Cursor(self)
+
+    def execute(self, sql, *params):
+        return self.cursor().execute(sql, *params)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def connect(conn_str, autocommit=False, timeout=0, **kwargs):
+    _sleep(CONFIG["connect_ms"])
+    _count("connects")
+    m = re.search(r"DATABASE=([^;]*);", conn_str)
+    return Connection(autocommit=autocommit, database=m.group(1) if m else "master")
@@ -0,0 +1,221 @@
+"""
+Offline latency / throughput benchmark for the MCP tools.
+
+    python -m bench.run --concurrency 16 --requests 400 --tools query,insert,schema
+
+SQL Server is replaced by bench/fake_pyodbc.py and Keycloak by a local
+FakeKeycloak, both with configurable latency, so the numbers reflect the
+server's own overhead (pooling, caching, auth, serialization) on any Linux box.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from bench import fake_pyodbc  # noqa: E402
+
+# Must be in place before db.py (via server.py) imports pyodbc
+sys.modules["pyodbc"] = fake_pyodbc
+
+from bench.fake_keycloak import FakeKeycloak  # noqa: E402
+
+BENCH_USER = "bench"
+BENCH_TABLE = "table_0"
+
+
+def _tool_calls(server, rows: int):
+    """name -> zero-arg coroutine factory for one call of that tool."""
+    return {
+        "query": lambda i: server.mssql_query_tool(query=f"SELECT * FROM {BENCH_TABLE} /* rows={rows} */"),
+        "query_columnar": lambda i: server.mssql_query_tool(
+            query=f"SELECT * FROM {BENCH_TABLE} /* rows={rows} */", format="columnar"
+        ),
+        "fanout": lambda i: server.mssql_fanout_query_tool(
+            query=f"SELECT * FROM {BENCH_TABLE} /* rows={rows} */", databases="bench_db_*"
+        ),
+        "insert": lambda i: server.mssql_insert_tool(table=BENCH_TABLE, data={"id": i, "name": f"row-{i}"}),
+        "bulk_insert": lambda i: server.mssql_bulk_insert_tool(
+            table=BENCH_TABLE, rows=[{"id": i * 100 + k, "name": "bulk"} for k in range(100)]
+        ),
+        "update": lambda i: server.mssql_update_tool(table=BENCH_TABLE, data={"name": "x"}, condition={"id": i}),
+        "delete": lambda i: server.mssql_delete_tool(table=BENCH_TABLE, condition={"id": i}),
+        "schema": lambda i: server.mssql_schema_tool(table_name=BENCH_TABLE),
+        "catalog": lambda i: server.mssql_catalog_tool(),
+        "bulk_update": lambda i: server.mssql_bulk_update_tool(
+            table=BENCH_TABLE, updates=[{"data": {"name": "bulk"}, "condition": {"id": i * 100 + k}} for k in range(100)]
+        ),
+        "bulk_delete": lambda i: server.mssql_bulk_delete_tool(
+            table=BENCH_TABLE, keys=[{"id": i * 100 + k} for k in range(100)]
+        ),
+        "batch": lambda i: server.mssql_batch_tool(operations=[
+            {"op": "insert", "table": BENCH_TABLE, "data": {"id": i, "name": "header"}},
+            *({"op": "insert", "table": BENCH_TABLE, "data": {"id": i * 100 + k, "name": "line"}} for k in range(20)),
+            {"op": "update", "table": BENCH_TABLE, "data": {"name": "total"}, "condition": {"id": i}},
+        ]),
+    }
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+async def _drive(factory, total: int, concurrency: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors = 0
+    wire_bytes = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors, wire_bytes
+        for i in counter:
+            start = time.perf_counter()
+            result = await factory(i)
+            # the MCP layer serializes every result; count it like the wire would
+            wire_bytes += len(json.dumps(result, default=str))
+            latencies.append((time.perf_counter() - start) * 1000.0)
+            if not isinstance(result, dict) or result.get("status") == "error" or "error" in result:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": total,
+        "errors": errors,
+        "ops_per_sec": round(total / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(_percentile(latencies, 50), 2),
+        "p95_ms": round(_percentile(latencies, 95), 2),
+        "p99_ms": round(_percentile(latencies, 99), 2),
+        "mean_ms": round(statistics.fmean(latencies), 2) if latencies else 0.0,
+        "bytes_per_call": wire_bytes // total if total else 0,
+    }
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tools", default="query,insert,update,delete,schema",
+                        help="comma separated: query, query_columnar, fanout, insert, bulk_insert, update, delete, schema, catalog, bulk_update, bulk_delete, batch")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=400, help="calls per tool")
+    parser.add_argument("--warmup", type=int, default=20, help="untimed calls per tool")
+    parser.add_argument("--rows", type=int, default=100, help="rows returned by each query")
+    parser.add_argument("--columns", type=int, default=8)
+    parser.add_argument("--connect-ms", type=float, default=50.0)
+    parser.add_argument("--execute-ms", type=float, default=5.0)
+    parser.add_argument("--fetch-ms", type=float, default=2.0, help="per 1000 rows")
+    parser.add_argument("--keycloak-ms", type=float, default=2.0)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    fake_pyodbc.CONFIG.update({
+        "connect_ms": args.connect_ms,
+        "execute_ms": args.execute_ms,
+        "fetch_ms_per_1k": args.fetch_ms,
+        "columns": args.columns,
+    })
+
+    # keep the catalog snapshots out of the working tree (read when snapshot.py is imported)
+    snapshot_dir = None
+    if "MSSQL_SNAPSHOT_DIR" not in os.environ:
+        snapshot_dir = os.environ["MSSQL_SNAPSHOT_DIR"] = tempfile.mkdtemp(prefix="mssql-bench-")
+
+    import keycloak_integration
+
+    kc = FakeKeycloak(
+        keycloak_integration.REALM,
+        keycloak_integration.CLIENT_ID,
+        {
+            "db_user": "bench",
+            "db_password": "bench",
+            "db_server": "fake-sql",
+            "db_port": "1433",
+            "db_driver": "ODBC Driver 18 for SQL Server",
+            "db_database": "bench_db_0",
+        },
+        latency_ms=args.keycloak_ms,
+    ).start()
+    keycloak_integration.KEYCLOAK_URL = kc.url
+    keycloak_integration._JWKS.url = f"{kc.url}/realms/{keycloak_integration.REALM}/protocol/openid-connect/certs"
+
+    import server
+    import state
+
+    # tool calls below carry no request identity: run them as the CLI login
+    state.ALLOW_CLI_FALLBACK = True
+
+    # keep per-call INFO logging out of the measurements
+    logging.getLogger().setLevel(logging.WARNING)
+
+    started = time.perf_counter()
+    server._startup_login(state.cli_session(), BENCH_USER, "bench")
+    login_ms = round((time.perf_counter() - started) * 1000.0, 2)
+    startup_ms = dict(server.STARTUP["phases_ms"])
+
+    calls = _tool_calls(server, args.rows)
+    selected = [t.strip() for t in args.tools.split(",") if t.strip()]
+    unknown = [t for t in selected if t not in calls]
+    if unknown:
+        parser.error(f"unknown tools: {unknown}")
+
+    report: Dict[str, Any] = {"config": {**vars(args), "login_ms": login_ms, "startup_ms": startup_ms}, "tools": {}}
+
+    async def run_all():
+        for name in selected:
+            if args.warmup:
+                await _drive(calls[name], args.warmup, min(args.concurrency, args.warmup))
+            fake_pyodbc.reset_stats()
+            result = await _drive(calls[name], args.requests, args.concurrency)
+            result["sql"] = dict(fake_pyodbc.STATS)
+            report["tools"][name] = result
+
+    asyncio.run(run_all())
+    report["keycloak_requests"] = dict(kc.requests)
+    report["peak_rss_mb"] = _peak_rss_mb()
+    kc.stop()
+    if snapshot_dir:
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+
+    print(f"login: {login_ms} ms   concurrency: {args.concurrency}   requests/tool: {args.requests}")
+    print("startup phases (ms):", ", ".join(f"{k}={v}" for k, v in report["config"]["startup_ms"].items()))
+    header = (f"{'tool':<16}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+              f"{'errors':>8}{'connects':>10}{'bytes/call':>12}")
+    print(header)
+    print("-" * len(header))
+    for name, r in report["tools"].items():
+        print(f"{name:<16}{r['ops_per_sec']:>10}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}"
+              f"{r['errors']:>8}{r['sql']['connects']:>10}{r['bytes_per_call']:>12}")
+    print(f"keycloak requests: {report['keycloak_requests']}")
+    print(f"peak RSS: {report['peak_rss_mb']} MiB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Consecutive connect failures that open a breaker
+BREAKER_FAILURES = int(os.getenv("MSSQL_BREAKER_FAILURES", "3"))
+# First open period in seconds; doubled after every failed half-open trial up to the maximum
+BREAKER_BACKOFF = float(os.getenv("MSSQL_BREAKER_BACKOFF", "2"))
+BREAKER_MAX_BACKOFF = float(os.getenv("MSSQL_BREAKER_MAX_BACKOFF", "60"))
+BREAKER_ENABLED = os.getenv("MSSQL_BREAKER", "1") != "0"
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# Error text that blames one database rather than the server (4060: cannot open database,
+# 911: database does not exist, 942/952: offline / in transition)
+_DATABASE_ERRORS = ("(4060)", "(911)", "(942)", "(952)", "Cannot open database")
+# Wrong credentials say nothing about availability
+_LOGIN_ERRORS = ("28000", "(18456)")
+
+
+class CircuitOpen(Exception):
+    """Raised instead of connecting while a breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure breaker for one connect target.
+
+    closed: connects go through; BREAKER_FAILURES failures in a row open it.
+    open: connects fail at once until the backoff has passed.
+    half_open: one trial connect is let through (others still fail fast); success
+    closes the breaker, failure reopens it with twice the backoff.
+    """
+
+    def __init__(self, scope: str, target: str):
+        self.scope = scope
+        self.target = target
+        self.state = CLOSED
+        self.failures = 0
+        self.backoff = BREAKER_BACKOFF
+        self.retry_at = 0.0
+        self.last_error: Optional[str] = None
+        self.opened = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def before(self):
+        """Raise CircuitOpen unless a connect may be attempted now."""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            now = time.monotonic()
+            if self.state == OPEN and now >= self.retry_at:
+                self.state = HALF_OPEN
+                logger.info("Circuit for %s %s half-open: trying one connect", self.scope, self.target)
+                return
+            self.rejected += 1
+            wait = max(self.retry_at - now, 0.0)
+        raise CircuitOpen(
+            f"{self.scope.capitalize()} {self.target} is unavailable (circuit open, retry in {wait:.1f}s): "
+            f"{self.last_error}"
+        )
+
+    def success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info("Circuit for %s %s closed", self.scope, self.target)
+            self.state = CLOSED
+            self.failures = 0
+            self.backoff = BREAKER_BACKOFF
+
+    def failure(self, error: Exception):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error)[:300]
+            if self.state == HALF_OPEN:
+                self.backoff = min(self.backoff * 2, BREAKER_MAX_BACKOFF)
+            elif self.state == CLOSED and self.failures < BREAKER_FAILURES:
+                return
+            self.state = OPEN
+            self.opened += 1
+            self.retry_at = time.monotonic() + self.backoff
+            logger.warning("Circuit for %s %s open for %.1fs after %d failures: %s",
+                           self.scope, self.target, self.backoff, self.failures, self.last_error)
+
+    def release_trial(self):
+        """A half-open trial that ended without a verdict (e.g. a credentials error) frees the slot."""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.state = OPEN
+                self.retry_at = time.monotonic()
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "scope": self.scope,
+                "target": self.target,
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "retry_in": round(max(self.retry_at - time.monotonic(), 0.0), 1) if self.state == OPEN else None,
+                "backoff": self.backoff,
+                "opened": self.opened,
+                "rejected": self.rejected,
+                "last_error": self.last_error,
+            }
+
+
+_BREAKERS: Dict[tuple, CircuitBreaker] = {}
+_BREAKERS_LOCK = threading.Lock()
+
+
+def _get(scope: str, target: str) -> CircuitBreaker:
+    key = (scope, target)
+    with _BREAKERS_LOCK:
+        b = _BREAKERS.get(key)
+        if b is None:
+            b = _BREAKERS[key] = CircuitBreaker(scope, target)
+        return b
+
+
+def _is_database_error(error: Exception) -> bool:
+    text = str(error)
+    return any(marker in text for marker in _DATABASE_ERRORS)
+
+
+def _is_login_error(error: Exception) -> bool:
+    text = str(error)
+    return any(marker in text for marker in _LOGIN_ERRORS) and not _is_database_error(error)
+
+
+def guarded_connect(db_server: str, db_port: Any, db_name: Optional[str], connect):
+    """
+    connect() behind the server breaker and, when db_name is set, that database's breaker.
+
+    Unreachable servers (network errors, login timeouts) count against the
+    server; errors naming the database (offline, missing, cannot open) only
+    against the database, so one bad database does not cut off the others.
+    """
+    if not BREAKER_ENABLED:
+        return connect()
+    server = _get("server", f"{db_server}:{db_port}")
+    database = _get("database", f"{db_server}:{db_port}/{db_name}") if db_name else None
+    server.before()
+    if database is not None:
+        try:
+            database.before()
+        except CircuitOpen:
+            # the server trial (if this was one) never ran
+            server.release_trial()
+            raise
+    try:
+        conn = connect()
+    except Exception as e:
+        if _is_login_error(e):
+            server.release_trial()
+            if database is not None:
+                database.release_trial()
+        elif database is not None and _is_database_error(e):
+            # the server answered
+            server.success()
+            database.failure(e)
+        else:
+            server.failure(e)
+            if database is not None:
+                database.release_trial()
+        raise
+    server.success()
+    if database is not None:
+        database.success()
+    return conn
+
+
+def breaker_targets(creds: Dict[str, Any]) -> List[str]:
+    """Targets of the server and database breakers a db_creds entry connects through."""
+    server = f"{creds.get('db_server')}:{creds.get('db_port')}"
+    return [server, f"{server}/{creds.get('db_database')}"] if creds.get("db_database") else [server]
+
+
+def breaker_states(only_tripped: bool = False, targets: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+    """Every breaker, or only those of the given targets (see breaker_targets)."""
+    with _BREAKERS_LOCK:
+        breakers = list(_BREAKERS.values())
+    if targets is not None:
+        targets = set(targets)
+        breakers = [b for b in breakers if b.target in targets]
+    states = [b.status() for b in breakers]
+    return [s for s in states if s["state"] != CLOSED or s["consecutive_failures"]] if only_tripped else states
+
+
+@metrics.register_collector
+def _breaker_gauges() -> List[str]:
+    states = breaker_states()
+    labels = [{"scope": s["scope"], "target": s["target"]} for s in states]
+    return metrics.gauge_lines(
+        "mssql_mcp_breaker_state", "Connect circuit breaker state (0 closed, 1 half-open, 2 open)",
+        ((l, _STATE_VALUES[s["state"]]) for l, s in zip(labels, states)),
+    ) + metrics.gauge_lines(
+        "mssql_mcp_breaker_rejected_total", "Connects failed fast by an open circuit breaker",
+        ((l, s["rejected"]) for l, s in zip(labels, states)), kind="counter",
+    )
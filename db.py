@@ -1,19 +1,30 @@
 import os
 import sys
 import logging
+import threading
+import time
 import pyodbc
-from typing import List, Optional
+from typing import Dict, List, Optional, Set
+
+import metrics
+from breaker import CircuitOpen, guarded_connect
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+# Login timeout of new connections (seconds); open circuit breakers fail faster still (see breaker.py)
+CONNECT_TIMEOUT = int(os.getenv("MSSQL_CONNECT_TIMEOUT", "30"))
+# For availability group listeners spanning subnets: connect to all listener IPs in parallel
+MULTI_SUBNET_FAILOVER = os.getenv("MSSQL_MULTI_SUBNET_FAILOVER", "0") == "1"
+
 def log_debug(msg):
     """Logs safely to stderr (so MCP JSON isn't broken)."""
     print(msg, file=sys.stderr, flush=True)
 
-def build_conn_str(db_driver: str, db_server: str, db_port: str, db_user: str, db_password: str, db_name: Optional[str] = None):
+def build_conn_str(db_driver: str, db_server: str, db_port: str, db_user: str, db_password: str, db_name: Optional[str] = None, read_only: bool = False):
     """
     Build ODBC connection string; include DATABASE only if db_name provided.
+    read_only adds ApplicationIntent=ReadOnly (routed to a readable secondary by an AG listener).
     """
     server_part = f"{db_server},{db_port}" if db_port else db_server
     parts = [
@@ -27,71 +38,202 @@ def build_conn_str(db_driver: str, db_server: str, db_port: str, db_user: str, d
         f"PWD={db_password}",
         "Encrypt=yes",
         "TrustServerCertificate=yes",
-        "Connection Timeout=30"
+        f"Connection Timeout={CONNECT_TIMEOUT}"
     ]
+    if read_only:
+        parts.append("ApplicationIntent=ReadOnly")
+    if MULTI_SUBNET_FAILOVER:
+        parts.append("MultiSubnetFailover=Yes")
     return ";".join(parts) + ";"
 
-def get_connection_from_credentials(db_user: str, db_password: str, db_server: str, db_port: str, db_driver: str, db_name: Optional[str] = None, autocommit: bool = False):
+def get_connection_from_credentials(db_user: str, db_password: str, db_server: str, db_port: str, db_driver: str, db_name: Optional[str] = None, autocommit: bool = False, read_only: bool = False):
     """
     Connect to MSSQL using provided credentials and an explicit db_name when supplied.
+    Guarded by per-server / per-database circuit breakers: while one is open the
+    call raises breaker.CircuitOpen at once instead of waiting for the login timeout.
     """
     if not all([db_user, db_password, db_server, db_port, db_driver]):
         raise ValueError("Missing DB connection pieces (user/password/server/port/driver).")
-    conn_str = build_conn_str(db_driver=db_driver, db_server=db_server, db_port=str(db_port), db_user=db_user, db_password=db_password, db_name=db_name)
+    conn_str = build_conn_str(db_driver=db_driver, db_server=db_server, db_port=str(db_port), db_user=db_user, db_password=db_password, db_name=db_name, read_only=read_only)
     safe_str = conn_str.replace(db_password, "***")
     log_debug(f"[DB] Connecting: {safe_str}")
     try:
-        conn = pyodbc.connect(conn_str, autocommit=autocommit)
+        with metrics.span("connect"):
+            conn = guarded_connect(db_server, db_port, db_name, lambda: pyodbc.connect(conn_str, autocommit=autocommit))
         logger.info("Connected to %s:%s (db=%s) as %s", db_server, db_port, db_name or "<none>", db_user)
         return conn
+    except CircuitOpen:
+        raise
     except Exception as e:
         logger.error("Failed to connect to DB %s:%s (db=%s): %s", db_server, db_port, db_name, e)
         raise
 
+# -------------------- TABLE INDEX ------------------------
+TABLE_INDEX_TTL = float(os.getenv("MSSQL_TABLE_INDEX_TTL", "300"))
+TABLE_INDEX_MISS_REFRESH = float(os.getenv("MSSQL_TABLE_INDEX_MISS_REFRESH", "5"))
+
+# Per-database branch templates; __DB__ / __DBNAME__ become QUOTENAME(name) / 'name' server-side
+_VERSION_BRANCH = (
+    "SELECT __DBNAME__ COLLATE DATABASE_DEFAULT AS db_name, MAX(modify_date) AS modified, COUNT(*) AS objects "
+    "FROM __DB__.sys.objects WHERE type IN ('U', 'V')"
+)
+_TABLES_BRANCH = (
+    "SELECT __DBNAME__ COLLATE DATABASE_DEFAULT AS db_name, name COLLATE DATABASE_DEFAULT AS table_name "
+    "FROM __DB__.sys.objects WHERE type IN ('U', 'V')"
+)
+
+
+def fanout_rows(cursor, branch: str, only: Optional[List[str]] = None) -> List[tuple]:
+    """
+    Run `branch` against every ONLINE database the login can access as one UNION ALL
+    batch (a single round trip). `only` restricts the fan-out to the named databases.
+    One failing database fails the whole batch; the databases are then queried one
+    by one and those that still fail are skipped.
+    """
+    try:
+        return _fanout_batch(cursor, branch, only)
+    except Exception as e:
+        logger.warning("Batched database scan failed, scanning one database at a time: %s", e)
+        return _fanout_each(cursor, branch, only)
+
+
+def _fanout_each(cursor, branch: str, only: Optional[List[str]] = None) -> List[tuple]:
+    cursor.execute("SELECT name FROM sys.databases WHERE state_desc = 'ONLINE' AND HAS_DBACCESS(name) = 1")
+    names = [row[0] for row in cursor.fetchall()]
+    if only:
+        wanted = set(only)
+        names = [n for n in names if n in wanted]
+    rows: List[tuple] = []
+    for name in names:
+        sql = branch.replace("__DBNAME__", "'" + name.replace("'", "''") + "'")
+        sql = sql.replace("__DB__", "[" + name.replace("]", "]]") + "]")
+        try:
+            cursor.execute(sql)
+            rows += cursor.fetchall()
+        except Exception as e:
+            # offline, restoring or no longer accessible since the listing
+            log_debug(f"[DB] Skipping database {name}: {e}")
+    return rows
+
+
+def _fanout_batch(cursor, branch: str, only: Optional[List[str]] = None) -> List[tuple]:
+    db_filter = ""
+    params: List[str] = [branch]
+    if only:
+        db_filter = " AND name IN (" + ", ".join(["?" for _ in only]) + ")"
+        params += list(only)
+    sql = (
+        "SET NOCOUNT ON; "
+        "DECLARE @branch nvarchar(max) = ?; "
+        "DECLARE @sql nvarchar(max) = N''; "
+        "SELECT @sql = @sql + CASE WHEN @sql = N'' THEN N'' ELSE N' UNION ALL ' END "
+        "+ REPLACE(REPLACE(@branch, N'__DBNAME__', QUOTENAME(name, '''')), N'__DB__', QUOTENAME(name)) "
+        "FROM sys.databases WHERE state_desc = 'ONLINE' AND HAS_DBACCESS(name) = 1" + db_filter + "; "
+        "IF @sql <> N'' EXEC sp_executesql @sql;"
+    )
+    cursor.execute(sql, params)
+    return cursor.fetchall() if cursor.description else []
+
+
+class TableIndex:
+    """
+    table name (lower-case) -> databases containing it, for one server/login.
+
+    Refreshes are incremental: one batched probe of MAX(modify_date)/COUNT(*)
+    per database, then one batched table listing for the databases that changed.
+    """
+
+    def __init__(self):
+        self.db_tables: Dict[str, Set[str]] = {}
+        self.versions: Dict[str, tuple] = {}
+        self.tables: Dict[str, List[str]] = {}
+        self.refreshed_at = 0.0
+        self.lock = threading.Lock()
+
+    def refresh(self, cursor):
+        versions = {row[0]: (row[1], row[2]) for row in fanout_rows(cursor, _VERSION_BRANCH)}
+        for db in [db for db in self.db_tables if db not in versions]:
+            del self.db_tables[db]
+        changed = [db for db, v in versions.items() if self.versions.get(db) != v or db not in self.db_tables]
+        if changed:
+            # sp_executesql caps parameters at 2100; list everything when too many changed
+            only = changed if len(changed) < 2000 else None
+            fresh: Dict[str, Set[str]] = {db: set() for db in changed}
+            for db, table in fanout_rows(cursor, _TABLES_BRANCH, only):
+                fresh.setdefault(db, set()).add(table.lower())
+            self.db_tables.update(fresh)
+        self.versions = versions
+
+        index: Dict[str, List[str]] = {}
+        for db, tables in self.db_tables.items():
+            for t in tables:
+                index.setdefault(t, []).append(db)
+        self.tables = index
+        self.refreshed_at = time.monotonic()
+        log_debug(f"[DB] Table index refreshed: {len(versions)} databases, {len(changed)} reloaded")
+
+    def lookup(self, table_name: str) -> List[str]:
+        return sorted(self.tables.get(table_name.lower(), []))
+
+
+_TABLE_INDEXES: Dict[tuple, TableIndex] = {}
+_TABLE_INDEXES_LOCK = threading.Lock()
+
+
+def get_table_index(db_user: str, db_password: str, db_server: str, db_port: str, db_driver: str,
+                    max_age: float = TABLE_INDEX_TTL) -> TableIndex:
+    """
+    Return the table index for this server/login, refreshing it if older than max_age.
+    """
+    key = (db_server, str(db_port), db_user)
+    with _TABLE_INDEXES_LOCK:
+        index = _TABLE_INDEXES.setdefault(key, TableIndex())
+    with index.lock:
+        if not index.refreshed_at or time.monotonic() - index.refreshed_at >= max_age:
+            conn = get_connection_from_credentials(db_user, db_password, db_server, db_port, db_driver, db_name=None, autocommit=True)
+            cursor = conn.cursor()
+            try:
+                index.refresh(cursor)
+            finally:
+                try:
+                    cursor.close()
+                    conn.close()
+                except:
+                    pass
+    return index
+
+
 def resolve_database_for_table(db_user: str, db_password: str, db_server: str, db_port: str, db_driver: str, table_name: str) -> str:
     """
-    Scan all user databases and return the single database that contains table_name.
+    Return the single database that contains table_name, using the in-memory table index.
     If multiple databases contain the table, raise Exception with list of candidates.
     If none found, raise Exception.
     """
-    # Connect without database to run queries across DBs
-    conn = get_connection_from_credentials(db_user, db_password, db_server, db_port, db_driver, db_name=None, autocommit=True)
-    cursor = conn.cursor()
-    try:
-        # get list of database names (exclude system dbs except master if desired)
-        cursor.execute("SELECT name FROM sys.databases WHERE state_desc = 'ONLINE'")
-        dbs = [row[0] for row in cursor.fetchall()]
-        matches: List[str] = []
-        for db in dbs:
-            try:
-                # Query INFORMATION_SCHEMA.TABLES in target database using three-part name
-                sql = f"SELECT 1 FROM [{db}].INFORMATION_SCHEMA.TABLES WHERE TABLE_NAME = ?"
-                c2 = conn.cursor()
-                c2.execute(sql, (table_name,))
-                row = c2.fetchone()
-                c2.close()
-                if row:
-                    matches.append(db)
-            except Exception:
-                # ignore DBs we can't access
-                continue
-        if not matches:
-            raise Exception(f"Database not found for table '{table_name}'")
-        if len(matches) > 1:
-            raise Exception(f"Table '{table_name}' exists in multiple databases: {matches}")
-        return matches[0]
-    finally:
-        try:
-            cursor.close()
-            conn.close()
-        except:
-            pass
+    index = get_table_index(db_user, db_password, db_server, db_port, db_driver)
+    matches = index.lookup(table_name)
+    if not matches:
+        # The table may be newer than the index: refresh once (rate limited) and retry
+        index = get_table_index(db_user, db_password, db_server, db_port, db_driver, max_age=TABLE_INDEX_MISS_REFRESH)
+        matches = index.lookup(table_name)
+    if not matches:
+        raise Exception(f"Database not found for table '{table_name}'")
+    if len(matches) > 1:
+        raise Exception(f"Table '{table_name}' exists in multiple databases: {matches}")
+    return matches[0]
 
 def list_all_databases(db_user: str, db_password: str, db_server: str, db_port: str, db_driver: str) -> List[str]:
     """
     Return a list of all ONLINE user-accessible SQL Server databases.
     Exclude system DBs: master, tempdb, model, msdb.
     """
+    return [name for name, _ in list_databases(db_user, db_password, db_server, db_port, db_driver)]
+
+
+def list_databases(db_user: str, db_password: str, db_server: str, db_port: str, db_driver: str) -> List[tuple]:
+    """
+    Like list_all_databases, as (name, create_date) pairs; a changed create_date
+    means the database was dropped and re-created.
+    """
     conn = get_connection_from_credentials(
         db_user=db_user,
         db_password=db_password,
@@ -103,8 +245,8 @@ def list_all_databases(db_user: str, db_password: str, db_server: str, db_port:
     )
     cursor = conn.cursor()
     try:
-        cursor.execute("SELECT name FROM sys.databases WHERE state_desc = 'ONLINE'")
-        names = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT name, create_date FROM sys.databases WHERE state_desc = 'ONLINE' ORDER BY database_id")
+        rows = [(row[0], row[1]) for row in cursor.fetchall()]
     finally:
         try:
             cursor.close()
@@ -116,4 +258,4 @@ def list_all_databases(db_user: str, db_password: str, db_server: str, db_port:
             pass
 
     # exclude system DBs
-    return [n for n in names if n.lower() not in ('master', 'tempdb', 'model', 'msdb')]
+    return [r for r in rows if r[0].lower() not in ('master', 'tempdb', 'model', 'msdb')]
@@ -0,0 +1,418 @@
+import atexit
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional
+
+import metrics
+from db import get_connection_from_credentials, log_debug
+
+logger = logging.getLogger(__name__)
+
+# Pool sizing / behaviour (overridable through the environment)
+POOL_MIN_SIZE = int(os.getenv("MSSQL_POOL_MIN_SIZE", "1"))
+POOL_MAX_SIZE = int(os.getenv("MSSQL_POOL_MAX_SIZE", "10"))
+POOL_IDLE_TIMEOUT = float(os.getenv("MSSQL_POOL_IDLE_TIMEOUT", "300"))
+POOL_ACQUIRE_TIMEOUT = float(os.getenv("MSSQL_POOL_ACQUIRE_TIMEOUT", "30"))
+POOL_VALIDATE_ON_BORROW = os.getenv("MSSQL_POOL_VALIDATE_ON_BORROW", "1") != "0"
+
+# Statements whose effect outlives the borrow (besides USE, caught by the DB_NAME() check)
+_SESSION_STATE_RE = re.compile(
+    r"(?:^|;)\s*SET\s+(?:NOCOUNT|ANSI_\w+|ARITHABORT|XACT_ABORT|LANGUAGE|DATEFORMAT|DATEFIRST|LOCK_TIMEOUT"
+    r"|DEADLOCK_PRIORITY|TRANSACTION\s+ISOLATION|QUOTED_IDENTIFIER|CONCAT_NULL_YIELDS_NULL|NUMERIC_ROUNDABORT"
+    r"|IDENTITY_INSERT|ROWCOUNT|TEXTSIZE|CONTEXT_INFO|IMPLICIT_TRANSACTIONS|NOEXEC|FMTONLY|PARSEONLY|FORCEPLAN"
+    r"|CURSOR_CLOSE_ON_COMMIT|STATISTICS|SHOWPLAN_\w+)\b"
+    r"|(?:CREATE\s+TABLE|INTO)\s+#"
+    r"|\bsp_set_session_context\b",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+# Credential fields that identify a distinct pool
+_KEY_FIELDS = ("db_driver", "db_server", "db_port", "db_user", "db_password", "db_database", "db_read_only")
+
+
+class PoolExhausted(Exception):
+    """Raised when no connection could be borrowed within the acquire timeout."""
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of pyodbc connections for a single DB_CREDS entry.
+
+    Idle connections are reused LIFO (the warmest one first), idle ones past
+    idle_timeout are closed down to min_size (down to none once the pool itself
+    has not been used for idle_timeout), borrowed connections are pinged
+    before being handed out and rolled back / reset when they come back. A
+    connection no longer in the pool's database (a USE in a query) is closed
+    instead of reused.
+    """
+
+    def __init__(
+        self,
+        creds: Dict[str, Any],
+        min_size: int = POOL_MIN_SIZE,
+        max_size: int = POOL_MAX_SIZE,
+        idle_timeout: float = POOL_IDLE_TIMEOUT,
+        acquire_timeout: float = POOL_ACQUIRE_TIMEOUT,
+        validate_on_borrow: bool = POOL_VALIDATE_ON_BORROW,
+    ):
+        self.creds = dict(creds)
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size, self.min_size)
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self.validate_on_borrow = validate_on_borrow
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (conn, last_used); oldest on the left
+        self._size = 0        # idle + in use + being opened
+        self._in_use = 0
+        self._closed = False
+        self._last_acquired = time.monotonic()
+
+        self._created = 0
+        self._reused = 0
+        self._validation_failures = 0
+        self._evicted = 0
+        self._discarded = 0
+        self._waits = 0
+        self._timeouts = 0
+
+    @property
+    def label(self) -> str:
+        return pool_label(self.creds)
+
+    # ---------------------------------------------------
+    def _connect(self):
+        c = self.creds
+        return get_connection_from_credentials(
+            db_user=c["db_user"],
+            db_password=c["db_password"],
+            db_server=c["db_server"],
+            db_port=c["db_port"],
+            db_driver=c["db_driver"],
+            db_name=c.get("db_database"),
+            read_only=bool(c.get("db_read_only")),
+        )
+
+    def _ping(self, conn) -> bool:
+        """True if conn answers and is still in the pool's database."""
+        cur = None
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT DB_NAME()")
+            row = cur.fetchone()
+            expected = self.creds.get("db_database")
+            return not expected or (row is not None and str(row[0]).lower() == str(expected).lower())
+        except Exception:
+            return False
+        finally:
+            try:
+                if cur:
+                    cur.close()
+            except Exception:
+                pass
+
+    def _reset(self, conn) -> bool:
+        """
+        Discard any open transaction and restore the session defaults. The
+        database context is checked here only when borrows are not validated
+        (_ping checks it then).
+        """
+        try:
+            conn.rollback()
+            conn.autocommit = False
+            conn.timeout = 0
+        except Exception:
+            return False
+        return self.validate_on_borrow or self._ping(conn)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _evict_idle_locked(self) -> List[Any]:
+        """
+        Pop idle connections past idle_timeout: never below min_size, unless the
+        pool has not been borrowed from for idle_timeout. Caller holds the lock.
+        """
+        stale = []
+        cutoff = time.monotonic() - self.idle_timeout
+        floor = self.min_size if self._last_acquired >= cutoff else 0
+        while self._idle and self._size > floor and self._idle[0][1] < cutoff:
+            conn, _ = self._idle.popleft()
+            self._size -= 1
+            self._evicted += 1
+            stale.append(conn)
+        return stale
+
+    # ---------------------------------------------------
+    def acquire(self):
+        """Borrow a connection, opening a new one if the pool is below max_size."""
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            conn = None
+            stale = []
+            with self._cond:
+                self._last_acquired = time.monotonic()
+                while True:
+                    if self._closed:
+                        raise PoolExhausted(f"Pool {self.label} is closed")
+                    stale += self._evict_idle_locked()
+                    if self._idle:
+                        conn, _ = self._idle.pop()
+                        self._in_use += 1
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        self._in_use += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolExhausted(
+                            f"No connection available in pool {self.label} after {self.acquire_timeout}s "
+                            f"(max_size={self.max_size})"
+                        )
+                    self._waits += 1
+                    self._cond.wait(remaining)
+            for s in stale:
+                self._close_quietly(s)
+
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._in_use -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._created += 1
+                return conn
+
+            if self.validate_on_borrow and not self._ping(conn):
+                log_debug(f"[POOL] Stale connection dropped from {self.label}")
+                with self._cond:
+                    self._validation_failures += 1
+                self.release(conn, discard=True)
+                continue
+
+            with self._cond:
+                self._reused += 1
+            return conn
+
+    def release(self, conn, discard: bool = False):
+        """Return a borrowed connection; broken or discarded ones are closed instead."""
+        if not discard and not self._reset(conn):
+            discard = True
+        with self._cond:
+            self._in_use -= 1
+            if discard or self._closed:
+                self._size -= 1
+                self._discarded += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+                conn = None
+            self._cond.notify()
+        if conn is not None:
+            self._close_quietly(conn)
+
+    def warm(self, count: Optional[int] = None) -> int:
+        """Open idle connections until the pool holds `count` (default min_size). Returns how many were opened."""
+        target = min(self.max_size, self.min_size if count is None else count)
+        opened = 0
+        while True:
+            with self._cond:
+                if self._closed or self._size >= target:
+                    return opened
+                self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._created += 1
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+            opened += 1
+
+    def evict_idle(self) -> int:
+        with self._cond:
+            stale = self._evict_idle_locked()
+        for conn in stale:
+            self._close_quietly(conn)
+        return len(stale)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            self._close_quietly(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "pool": self.label,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "created": self._created,
+                "reused": self._reused,
+                "validation_failures": self._validation_failures,
+                "evicted": self._evicted,
+                "discarded": self._discarded,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+            }
+
+
+# -------------------- REGISTRY ------------------------
+_POOLS: Dict[tuple, ConnectionPool] = {}
+_BORROWED: Dict[int, ConnectionPool] = {}
+_REGISTRY_LOCK = threading.Lock()
+_sweeper = None
+
+
+def changes_session(sql: str) -> bool:
+    """True if sql sets session options or creates temp tables, i.e. its connection should not be reused."""
+    return bool(_SESSION_STATE_RE.search(sql or ""))
+
+
+def pool_key(creds: Dict[str, Any]) -> tuple:
+    return tuple(str(creds.get(k) or "") for k in _KEY_FIELDS)
+
+
+def pool_label(creds: Dict[str, Any]) -> str:
+    """user@server:port/database, safe to log or report (no password)."""
+    label = f"{creds.get('db_user')}@{creds.get('db_server')}:{creds.get('db_port')}/{creds.get('db_database') or '<none>'}"
+    return label + " (read-only)" if creds.get("db_read_only") else label
+
+
+def get_pool(creds: Dict[str, Any]) -> ConnectionPool:
+    key = pool_key(creds)
+    with _REGISTRY_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            pool = ConnectionPool(creds)
+            _POOLS[key] = pool
+            logger.info("Created connection pool for %s", pool.label)
+            _start_sweeper()
+        return pool
+
+
+def evict_idle() -> int:
+    """Close idle connections past their pool's idle timeout in every pool. Returns how many."""
+    with _REGISTRY_LOCK:
+        pools = list(_POOLS.values())
+    return sum(p.evict_idle() for p in pools)
+
+
+def _sweep_loop():
+    # Pools of ended sessions and unused replicas are never acquired from again
+    while True:
+        time.sleep(max(5.0, POOL_IDLE_TIMEOUT / 4))
+        try:
+            evict_idle()
+        except Exception:
+            logger.exception("Pool sweep failed")
+
+
+def _start_sweeper():
+    """Caller holds _REGISTRY_LOCK."""
+    global _sweeper
+    if _sweeper is None:
+        _sweeper = threading.Thread(target=_sweep_loop, name="pool-sweeper", daemon=True)
+        _sweeper.start()
+
+
+def acquire(creds: Dict[str, Any]):
+    """Borrow a connection for the given DB_CREDS entry."""
+    pool = get_pool(creds)
+    with metrics.span("pool_acquire"):
+        conn = pool.acquire()
+    with _REGISTRY_LOCK:
+        _BORROWED[id(conn)] = pool
+    return conn
+
+
+def pool_of(conn) -> Optional[ConnectionPool]:
+    """The pool a borrowed connection came from (None if it is not pooled)."""
+    with _REGISTRY_LOCK:
+        return _BORROWED.get(id(conn))
+
+
+def from_replica(conn) -> bool:
+    """Whether a borrowed connection goes to a readable secondary (see replicas.py)."""
+    pool = pool_of(conn)
+    return bool(pool is not None and pool.creds.get("db_read_only"))
+
+
+def release(conn, discard: bool = False):
+    """Give a connection obtained through acquire() back to its pool."""
+    if conn is None:
+        return
+    with _REGISTRY_LOCK:
+        pool = _BORROWED.pop(id(conn), None)
+    if pool is None:
+        # Not pooled (or already released): just close it
+        try:
+            conn.close()
+        except Exception:
+            pass
+        return
+    pool.release(conn, discard=discard)
+
+
+def pool_stats(keys: Optional[Iterable[tuple]] = None) -> List[Dict[str, Any]]:
+    """Stats of every pool, or only of the pools with the given pool_key()s."""
+    with _REGISTRY_LOCK:
+        if keys is None:
+            pools = list(_POOLS.values())
+        else:
+            pools = [_POOLS[k] for k in dict.fromkeys(keys) if k in _POOLS]
+    return [p.stats() for p in pools]
+
+
+def close_all():
+    with _REGISTRY_LOCK:
+        pools = list(_POOLS.values())
+        _POOLS.clear()
+    for p in pools:
+        p.close()
+
+
+@metrics.register_collector
+def _pool_gauges() -> List[str]:
+    stats = pool_stats()
+    lines: List[str] = []
+    for field in ("size", "idle", "in_use"):
+        lines += metrics.gauge_lines(
+            f"mssql_mcp_pool_{field}", f"Connections {field.replace('_', ' ')} per pool",
+            (({"pool": s["pool"]}, s[field]) for s in stats),
+        )
+    for field in ("created", "waits", "timeouts"):
+        lines += metrics.gauge_lines(
+            f"mssql_mcp_pool_{field}_total", f"Pool connection {field}",
+            (({"pool": s["pool"]}, s[field]) for s in stats), kind="counter",
+        )
+    return lines
+
+
+atexit.register(close_all)
@@ -0,0 +1,151 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+# Blocking pyodbc / Keycloak work runs here, never on the event loop
+TOOL_WORKERS = int(os.getenv("MSSQL_TOOL_WORKERS", "32"))
+PER_DB_CONCURRENCY = int(os.getenv("MSSQL_PER_DB_CONCURRENCY", "8"))
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="mssql-tool")
+_LIMITS_LOCK = threading.Lock()
+
+
+class _Limit:
+    """
+    PER_DB_CONCURRENCY slots of one database, shared by tool calls (waiting on
+    the event loop) and fan-out workers (waiting on their thread). A released
+    slot is handed straight to the oldest waiter. Guarded by _LIMITS_LOCK.
+    """
+
+    def __init__(self, label: str):
+        self.label = label
+        self.users = 0    # running + waiting; the entry is dropped at 0
+        self.running = 0  # slots taken
+        self.waiters = deque()  # (loop, future) for tool calls, (None, threading.Event) for threads
+
+    def take(self) -> bool:
+        if self.running < PER_DB_CONCURRENCY:
+            self.running += 1
+            return True
+        return False
+
+    def give_back(self):
+        while self.waiters:
+            loop, waiter = self.waiters.popleft()
+            if loop is None:
+                waiter.set()
+                return
+            try:
+                # A waiter cancelled meanwhile finds itself out of the queue and gives the slot back
+                loop.call_soon_threadsafe(_wake, waiter)
+                return
+            except RuntimeError:  # its event loop is gone
+                continue
+        self.running -= 1
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+# db_pool.pool_key(creds) -> _Limit; only keys of databases a session resolved
+_LIMITS: Dict[tuple, _Limit] = {}
+
+
+def _enter(key: tuple, label: str) -> _Limit:
+    """Caller holds _LIMITS_LOCK."""
+    entry = _LIMITS.get(key)
+    if entry is None:
+        entry = _LIMITS[key] = _Limit(label)
+    entry.users += 1
+    return entry
+
+
+def _leave(key: tuple, entry: _Limit, held: bool):
+    with _LIMITS_LOCK:
+        if held:
+            entry.give_back()
+        entry.users -= 1
+        if not entry.users:
+            del _LIMITS[key]
+
+
+async def _acquire_async(entry: _Limit):
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    with _LIMITS_LOCK:
+        if entry.take():
+            return
+        entry.waiters.append((loop, future))
+    try:
+        await future
+    except asyncio.CancelledError:
+        with _LIMITS_LOCK:
+            try:
+                entry.waiters.remove((loop, future))
+            except ValueError:
+                # the slot was already handed over
+                entry.give_back()
+        raise
+
+
+async def run_blocking(fn: Callable[..., Any], *args, limit: Optional[Tuple[tuple, str]] = None, **kwargs) -> Any:
+    """
+    Run fn(*args, **kwargs) on the tool thread pool (with the caller's contextvars).
+    When limit=(db_pool.pool_key(creds), label) is given, at most PER_DB_CONCURRENCY
+    calls per database run at once (fan-out workers included, see db_slot); the
+    rest wait on the event loop without occupying a worker thread.
+    """
+    loop = asyncio.get_running_loop()
+    call = functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+    if limit is None:
+        return await loop.run_in_executor(_EXECUTOR, call)
+
+    key, label = limit
+    with _LIMITS_LOCK:
+        entry = _enter(key, label)
+    held = False
+    try:
+        await _acquire_async(entry)
+        held = True
+        return await loop.run_in_executor(_EXECUTOR, call)
+    finally:
+        _leave(key, entry, held)
+
+
+@contextmanager
+def db_slot(key: tuple, label: str):
+    """Hold one of the database's PER_DB_CONCURRENCY slots on this (worker) thread."""
+    event = threading.Event()
+    with _LIMITS_LOCK:
+        entry = _enter(key, label)
+        if entry.take():
+            event.set()
+        else:
+            entry.waiters.append((None, event))
+    event.wait()
+    try:
+        yield
+    finally:
+        _leave(key, entry, True)
+
+
+def executor_stats(keys: Optional[Iterable[tuple]] = None) -> Dict[str, Any]:
+    """Worker settings plus running / waiting calls per database, or only for the given pool keys."""
+    with _LIMITS_LOCK:
+        entries = list(_LIMITS.values()) if keys is None else [_LIMITS[k] for k in set(keys) if k in _LIMITS]
+        in_flight = {e.label: e.running for e in entries if e.running}
+        waiting = {e.label: len(e.waiters) for e in entries if e.waiters}
+    return {
+        "workers": TOOL_WORKERS,
+        "per_db_concurrency": PER_DB_CONCURRENCY,
+        "in_flight": in_flight,
+        "waiting": waiting,
+    }
@@ -1,6 +1,14 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import quote
+
 import requests
+from requests.adapters import HTTPAdapter
 import jwt
-from jwt import PyJWKClient
+from jwt import PyJWKSet
 import logging
 
 logger = logging.getLogger(__name__)
@@ -16,6 +24,22 @@ KEYCLOAK_ADMIN_USER = "admin"
 KEYCLOAK_ADMIN_PASS = "admin"
 KEYCLOAK_ADMIN_CLIENT = "admin-cli"
 
+# Verification caches
+JWKS_CACHE_TTL = int(os.getenv("KEYCLOAK_JWKS_TTL", "300"))
+JWKS_MIN_REFETCH_INTERVAL = 10  # seconds between unknown-kid re-fetches
+VERIFIED_TOKEN_CACHE_SIZE = int(os.getenv("KEYCLOAK_VERIFIED_TOKEN_CACHE_SIZE", "256"))
+
+# Shared HTTP client
+HTTP_TIMEOUT = float(os.getenv("KEYCLOAK_HTTP_TIMEOUT", "10"))
+HTTP_POOL_SIZE = int(os.getenv("KEYCLOAK_HTTP_POOL_SIZE", "16"))
+ADMIN_TOKEN_EXPIRY_MARGIN = 15  # seconds before exp the cached admin token is replaced
+USER_ATTRS_TTL = float(os.getenv("KEYCLOAK_USER_ATTRS_TTL", "60"))
+
+# One keep-alive session for every Keycloak call
+_HTTP = requests.Session()
+_HTTP.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE))
+_HTTP.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE))
+
 
 # ------------------ USER TOKEN -------------------------
 def get_token(username, password):
@@ -35,7 +59,7 @@ def get_token(username, password):
         "username": username,
         "password": password,
     }
-    resp = requests.post(url, data=data)
+    resp = _HTTP.post(url, data=data, timeout=HTTP_TIMEOUT)
     resp.raise_for_status()
     body = resp.json()
     logger.info("🟩 Access & refresh tokens obtained")
@@ -63,7 +87,7 @@ def refresh_access_token(refresh_token: str):
         "client_secret": CLIENT_SECRET,
         "refresh_token": refresh_token,
     }
-    resp = requests.post(url, data=data)
+    resp = _HTTP.post(url, data=data, timeout=HTTP_TIMEOUT)
     resp.raise_for_status()
     body = resp.json()
     logger.info("🟩 Access token refreshed")
@@ -76,53 +100,205 @@ def refresh_access_token(refresh_token: str):
 
 
 # ------------------ JWT VERIFY -------------------------
+class JwksCache:
+    """
+    Process-wide copy of the realm's signing keys.
+
+    Keys are refreshed by a daemon thread shortly before the TTL runs out, and
+    re-fetched on demand when a token names a kid we have not seen (rate
+    limited so garbage tokens cannot hammer Keycloak).
+    """
+
+    def __init__(self, url: str, ttl: int = JWKS_CACHE_TTL):
+        self.url = url
+        self.ttl = ttl
+        self._keys = {}
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._refresher = None
+        self.fetches = 0
+
+    def _fetch(self):
+        resp = _HTTP.get(self.url, timeout=HTTP_TIMEOUT)
+        resp.raise_for_status()
+        jwk_set = PyJWKSet.from_dict(resp.json())
+        self._keys = {k.key_id: k for k in jwk_set.keys}
+        self._fetched_at = time.monotonic()
+        self.fetches += 1
+        logger.info("🟩 JWKS refreshed (%d keys)", len(self._keys))
+
+    def refresh(self, min_age: float = 0.0):
+        """Fetch the key set unless another thread fetched it less than min_age seconds ago."""
+        with self._lock:
+            if not self._keys or time.monotonic() - self._fetched_at >= min_age:
+                self._fetch()
+        self._start_refresher()
+
+    def _start_refresher(self):
+        if self._refresher is not None:
+            return
+        with self._lock:
+            if self._refresher is not None:
+                return
+            self._refresher = threading.Thread(target=self._refresh_loop, name="jwks-refresh", daemon=True)
+            self._refresher.start()
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(max(1.0, self.ttl * 0.8))
+            try:
+                with self._lock:
+                    self._fetch()
+            except Exception as e:
+                logger.warning("JWKS background refresh failed: %s", e)
+
+    def get_signing_key(self, kid: str):
+        if not self._keys or time.monotonic() - self._fetched_at >= self.ttl:
+            self.refresh(min_age=self.ttl)
+        key = self._keys.get(kid)
+        if key is None:
+            # Keycloak rotated its keys: fetch once more before giving up
+            self.refresh(min_age=JWKS_MIN_REFETCH_INTERVAL)
+            key = self._keys.get(kid)
+        if key is None:
+            raise jwt.InvalidTokenError(f"Unknown signing key id: {kid}")
+        return key
+
+
+_JWKS = JwksCache(f"{KEYCLOAK_URL}/realms/{REALM}/protocol/openid-connect/certs")
+
+
+def prefetch_jwks():
+    """Load the signing keys ahead of the first token check (no-op if already fresh)."""
+    _JWKS.refresh(min_age=_JWKS.ttl)
+
+# sha256(token) -> decoded claims, kept until the token's exp
+_VERIFIED = OrderedDict()
+_VERIFIED_LOCK = threading.Lock()
+_verify_hits = 0
+_verify_misses = 0
+
+
+def _cached_claims(digest: str):
+    global _verify_hits
+    with _VERIFIED_LOCK:
+        claims = _VERIFIED.get(digest)
+        if claims is None:
+            return None
+        if claims.get("exp", 0) <= time.time():
+            del _VERIFIED[digest]
+            return None
+        _VERIFIED.move_to_end(digest)
+        _verify_hits += 1
+        return dict(claims)
+
+
+def _remember_claims(digest: str, claims: dict):
+    if "exp" not in claims:
+        return
+    with _VERIFIED_LOCK:
+        _VERIFIED[digest] = dict(claims)
+        _VERIFIED.move_to_end(digest)
+        while len(_VERIFIED) > VERIFIED_TOKEN_CACHE_SIZE:
+            _VERIFIED.popitem(last=False)
+
+
 def verify_token(token: str):
-    jwks_url = f"{KEYCLOAK_URL}/realms/{REALM}/protocol/openid-connect/certs"
-    jwks_client = PyJWKClient(jwks_url)
-    signing_key = jwks_client.get_signing_key_from_jwt(token)
+    global _verify_misses
+    digest = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    cached = _cached_claims(digest)
+    if cached is not None:
+        return cached
+
+    header = jwt.get_unverified_header(token)
+    signing_key = _JWKS.get_signing_key(header.get("kid"))
     decoded = jwt.decode(
         token,
         signing_key.key,
         algorithms=["RS256"],
         audience=CLIENT_ID
     )
+    with _VERIFIED_LOCK:
+        _verify_misses += 1
+    _remember_claims(digest, decoded)
     logger.info("🟩 JWT verified")
     return decoded
 
 
+def auth_cache_stats():
+    with _VERIFIED_LOCK:
+        return {
+            "verified_tokens": len(_VERIFIED),
+            "hits": _verify_hits,
+            "misses": _verify_misses,
+            "jwks_keys": len(_JWKS._keys),
+            "jwks_fetches": _JWKS.fetches,
+        }
+
+
 # ------------------ ADMIN TOKEN ------------------------
-def get_admin_token() -> str:
-    url = f"{KEYCLOAK_URL}/realms/master/protocol/openid-connect/token"
-    data = {
-        "grant_type": "password",
-        "client_id": KEYCLOAK_ADMIN_CLIENT,
-        "username": KEYCLOAK_ADMIN_USER,
-        "password": KEYCLOAK_ADMIN_PASS
-    }
-    resp = requests.post(url, data=data)
+_admin_token = None
+_admin_token_expires_at = 0.0
+_ADMIN_LOCK = threading.Lock()
+
+
+def get_admin_token(force: bool = False) -> str:
+    """
+    Return a master-realm admin token, reusing the cached one until shortly before it expires.
+    """
+    global _admin_token, _admin_token_expires_at
+    with _ADMIN_LOCK:
+        if not force and _admin_token and time.monotonic() < _admin_token_expires_at:
+            return _admin_token
+
+        url = f"{KEYCLOAK_URL}/realms/master/protocol/openid-connect/token"
+        data = {
+            "grant_type": "password",
+            "client_id": KEYCLOAK_ADMIN_CLIENT,
+            "username": KEYCLOAK_ADMIN_USER,
+            "password": KEYCLOAK_ADMIN_PASS
+        }
+        resp = _HTTP.post(url, data=data, timeout=HTTP_TIMEOUT)
+        resp.raise_for_status()
+        body = resp.json()
+        _admin_token = body["access_token"]
+        _admin_token_expires_at = time.monotonic() + int(body.get("expires_in", 60)) - ADMIN_TOKEN_EXPIRY_MARGIN
+        return _admin_token
+
+
+def _admin_get(url: str):
+    """GET an admin API URL; a 401 (token revoked / expired early) re-issues the admin token once."""
+    resp = _HTTP.get(url, headers={"Authorization": f"Bearer {get_admin_token()}"}, timeout=HTTP_TIMEOUT)
+    if resp.status_code == 401:
+        resp = _HTTP.get(url, headers={"Authorization": f"Bearer {get_admin_token(force=True)}"}, timeout=HTTP_TIMEOUT)
     resp.raise_for_status()
-    return resp.json()["access_token"]
+    return resp.json()
 
 
 # ------------------ USER DB ATTRIBUTES -----------------------
-def get_user_db_attrs(username: str):
-    token = get_admin_token()
+_ATTRS_CACHE = {}
+_ATTRS_LOCK = threading.Lock()
 
-    url = f"{KEYCLOAK_URL}/admin/realms/{REALM}/users?username={username}"
-    resp = requests.get(url, headers={"Authorization": f"Bearer {token}"})
-    resp.raise_for_status()
 
-    users = resp.json()
+def get_user_db_attrs(username: str, use_cache: bool = True):
+    if use_cache:
+        with _ATTRS_LOCK:
+            hit = _ATTRS_CACHE.get(username)
+        if hit and hit[0] > time.monotonic():
+            return dict(hit[1])
+
+    # Full representation includes the attributes, saving the per-id lookup
+    users = _admin_get(
+        f"{KEYCLOAK_URL}/admin/realms/{REALM}/users"
+        f"?username={quote(username)}&exact=true&briefRepresentation=false"
+    )
     if not users:
         raise Exception(f"No user: {username}")
 
-    user_id = users[0]["id"]
-
-    url = f"{KEYCLOAK_URL}/admin/realms/{REALM}/users/{user_id}"
-    resp = requests.get(url, headers={"Authorization": f"Bearer {token}"})
-    resp.raise_for_status()
-
-    udata = resp.json()
+    udata = users[0]
+    if "attributes" not in udata:
+        # Older Keycloak: search results carry no attributes
+        udata = _admin_get(f"{KEYCLOAK_URL}/admin/realms/{REALM}/users/{udata['id']}")
     attrs = udata.get("attributes", {}) or {}
 
     # Required
@@ -143,4 +319,11 @@ def get_user_db_attrs(username: str):
             fixed["db_database"] = v[0] if isinstance(v, list) else v
             break
 
-    return fixed
\ No newline at end of file
+    # Optional readable secondaries ("host:port,host:port"), see replicas.py
+    if "db_read_servers" in attrs:
+        v = attrs["db_read_servers"]
+        fixed["db_read_servers"] = ",".join(v) if isinstance(v, list) else v
+
+    with _ATTRS_LOCK:
+        _ATTRS_CACHE[username] = (time.monotonic() + USER_ATTRS_TTL, dict(fixed))
+    return fixed
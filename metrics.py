@@ -0,0 +1,252 @@
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Calls slower than this are logged (with their phase breakdown and SQL) at the given sample rate
+SLOW_CALL_MS = float(os.getenv("MSSQL_SLOW_CALL_MS", "1000"))
+SLOW_CALL_SAMPLE = float(os.getenv("MSSQL_SLOW_CALL_SAMPLE", "1.0"))
+SLOW_CALL_SQL_CHARS = 500
+SLOW_CALLS_KEPT = 50
+# Serializing results to count bytes costs a json.dumps per call, so it is opt-in
+COUNT_RESULT_BYTES = os.getenv("MSSQL_METRICS_BYTES", "0") == "1"
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[Any, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, *labelvalues):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        for values, v in items:
+            lines.append(f"{self.name}{_labels(self.labelnames, values)} {v:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[tuple, list] = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues):
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._series.items()]
+        for values, series in items:
+            for bound, count in zip(self.buckets, series):
+                le = 'le="%g"' % bound
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, values, le)} {count}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, values, le)} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, values)} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, values)} {series[-1]}")
+        return lines
+
+
+TOOL_SECONDS = Histogram("mssql_mcp_tool_seconds", "MCP tool call latency", ("tool", "db_name", "outcome"))
+PHASE_SECONDS = Histogram("mssql_mcp_phase_seconds", "Latency of one phase of a tool call", ("tool", "db_name", "phase"))
+ROWS_RETURNED = Counter("mssql_mcp_rows_returned_total", "Rows returned by tool calls", ("tool", "db_name"))
+BYTES_RETURNED = Counter("mssql_mcp_bytes_returned_total", "Serialized result bytes", ("tool", "db_name"))
+SLOW_CALLS_TOTAL = Counter("mssql_mcp_slow_calls_total", "Tool calls slower than MSSQL_SLOW_CALL_MS", ("tool",))
+
+_METRICS = [TOOL_SECONDS, PHASE_SECONDS, ROWS_RETURNED, BYTES_RETURNED, SLOW_CALLS_TOTAL]
+_COLLECTORS: List[Callable[[], List[str]]] = []
+SLOW_CALLS = deque(maxlen=SLOW_CALLS_KEPT)
+
+
+def register(metric):
+    _METRICS.append(metric)
+    return metric
+
+
+def register_collector(fn: Callable[[], List[str]]):
+    """fn() returns ready-made exposition lines (e.g. gauges read from pool stats) at scrape time."""
+    _COLLECTORS.append(fn)
+    return fn
+
+
+def gauge_lines(name: str, help_text: str, samples: Iterable[Tuple[Dict[str, Any], float]],
+                kind: str = "gauge") -> List[str]:
+    """Exposition lines for values read at scrape time; kind="counter" for monotonic ones."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        names = tuple(labels.keys())
+        lines.append(f"{name}{_labels(names, tuple(labels.values()))} {value:g}")
+    return lines
+
+
+def render() -> str:
+    """Prometheus text exposition of every metric and collector."""
+    lines: List[str] = []
+    for metric in list(_METRICS):
+        lines += metric.render()
+    for collect in list(_COLLECTORS):
+        try:
+            lines += collect()
+        except Exception:
+            logger.exception("Metrics collector failed")
+    return "\n".join(lines) + "\n"
+
+
+# -------------------- CALL TRACKING ------------------------
+class _Call:
+    def __init__(self, tool: str, db_name: str):
+        self.tool = tool
+        self.db_name = db_name
+        self.user: Optional[str] = None
+        self.phases: Dict[str, float] = {}
+        self.sql: Optional[str] = None
+        self.rows = 0
+
+
+_CALL: ContextVar[Optional[_Call]] = ContextVar("mssql_tool_call", default=None)
+
+
+@contextmanager
+def span(phase: str):
+    """Time one phase of the current tool call (labelled tool="-" outside a call)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        call = _CALL.get()
+        if call is None:
+            PHASE_SECONDS.observe(elapsed, "-", "-", phase)
+        else:
+            call.phases[phase] = call.phases.get(phase, 0.0) + elapsed
+            PHASE_SECONDS.observe(elapsed, call.tool, call.db_name, phase)
+
+
+def note_sql(sql: str):
+    """Remember the statement of the current call for the slow-call log."""
+    call = _CALL.get()
+    if call is not None:
+        call.sql = sql
+
+
+def label_db(db_name: str):
+    """Set the db_name label of the current call once it is known to be valid."""
+    call = _CALL.get()
+    if call is not None:
+        call.db_name = db_name
+
+
+def label_user(username: Optional[str]):
+    """Record who made the current call, so its slow-call entry is only shown to them."""
+    call = _CALL.get()
+    if call is not None:
+        call.user = username
+
+
+def note_rows(rows: int):
+    call = _CALL.get()
+    if call is not None:
+        call.rows += rows
+
+
+def _outcome(result: Any) -> str:
+    if isinstance(result, dict) and (result.get("status") == "error" or "error" in result):
+        return "error"
+    return "success"
+
+
+@contextmanager
+def tool_call(tool: str, db_name: str):
+    """
+    Track one tool call. Yields a dict the caller fills with "result" (and
+    optionally "bytes"); on exit records the latency histogram, rows/bytes
+    counters and, when slow, a sampled log entry.
+    """
+    call = _Call(tool, db_name)
+    token = _CALL.set(call)
+    holder: Dict[str, Any] = {}
+    start = time.perf_counter()
+    try:
+        yield holder
+    except Exception:
+        holder["outcome"] = "exception"
+        raise
+    finally:
+        _CALL.reset(token)
+        elapsed = time.perf_counter() - start
+        db_name = call.db_name
+        result = holder.get("result")
+        outcome = holder.get("outcome") or _outcome(result)
+        TOOL_SECONDS.observe(elapsed, tool, db_name, outcome)
+        if call.rows:
+            ROWS_RETURNED.inc(call.rows, tool, db_name)
+        if holder.get("bytes"):
+            BYTES_RETURNED.inc(holder["bytes"], tool, db_name)
+        if elapsed * 1000.0 >= SLOW_CALL_MS:
+            SLOW_CALLS_TOTAL.inc(1, tool)
+            if random.random() < SLOW_CALL_SAMPLE:
+                entry = {
+                    "at": int(time.time()),
+                    "tool": tool,
+                    "db_name": db_name,
+                    "user": call.user,
+                    "outcome": outcome,
+                    "ms": round(elapsed * 1000.0, 1),
+                    "phases_ms": {k: round(v * 1000.0, 1) for k, v in call.phases.items()},
+                    "rows": call.rows,
+                    "sql": (call.sql or "")[:SLOW_CALL_SQL_CHARS] or None,
+                }
+                SLOW_CALLS.append(entry)
+                logger.warning("Slow tool call: %s", entry)
+
+
+_EVERYONE = object()
+
+
+def recent_slow_calls(limit: int = 20, user: Any = _EVERYONE) -> List[Dict[str, Any]]:
+    """The latest sampled slow calls: everyone's, or only those made by user."""
+    entries = list(SLOW_CALLS)
+    if user is not _EVERYONE:
+        entries = [e for e in entries if e["user"] == user]
+    return entries[-limit:]
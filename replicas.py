@@ -0,0 +1,208 @@
+import itertools
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import db_pool
+
+logger = logging.getLogger(__name__)
+
+# Readable secondaries for every login without a db_read_servers Keycloak attribute
+READ_SERVERS = os.getenv("MSSQL_READ_SERVERS", "")
+# "round_robin" or "least_loaded" (fewest borrowed connections)
+READ_ROUTING = os.getenv("MSSQL_READ_ROUTING", "round_robin")
+# Replicas further behind the primary than this (seconds) get no reads
+REPLICA_MAX_LAG = float(os.getenv("MSSQL_REPLICA_MAX_LAG", "30"))
+REPLICA_CHECK_INTERVAL = float(os.getenv("MSSQL_REPLICA_CHECK_INTERVAL", "15"))
+
+# Redo backlog of the local copy of the current database; no row outside an availability group
+_LAG_SQL = """
+    SELECT TOP 1 redo_queue_size, redo_rate, synchronization_health_desc
+    FROM sys.dm_hadr_database_replica_states
+    WHERE is_local = 1 AND database_id = DB_ID()
+"""
+# The DMV needs VIEW SERVER STATE (VIEW DATABASE STATE on Azure SQL)
+_NO_PERMISSION = re.compile(r"VIEW (?:SERVER|DATABASE) STATE|permission was denied", re.IGNORECASE)
+
+# Health checks after the first one run here, off the tool call's path
+_CHECKS = ThreadPoolExecutor(max_workers=2, thread_name_prefix="replica-check")
+
+
+def parse_servers(spec: Optional[str], default_port: Any) -> List[Tuple[str, str]]:
+    """Parse "host1:1433, host2" into [(host, port)]; the primary's port is used when none is given."""
+    servers = []
+    for item in re.split(r"[,;\s]+", spec or ""):
+        if not item:
+            continue
+        host, sep, port = item.rpartition(":")
+        servers.append((host, port) if sep and port.isdigit() else (item, str(default_port)))
+    return servers
+
+
+class Replica:
+    """One readable secondary of a database, with its last health check."""
+
+    def __init__(self, creds: Dict[str, Any]):
+        self.creds = creds
+        self.healthy = True
+        self.lag: Optional[float] = None
+        self.sync_health: Optional[str] = None
+        self.error: Optional[str] = None
+        self.lag_unknown = False
+        self.checked_at = 0.0
+        self.checking = False
+        self.picks = 0
+
+    @property
+    def label(self) -> str:
+        return f"{self.creds['db_server']}:{self.creds['db_port']}/{self.creds.get('db_database')}"
+
+    def check(self):
+        """Connect (through the pool) and read the redo backlog; mark the replica up or down."""
+        conn = None
+        cur = None
+        try:
+            conn = db_pool.acquire(self.creds)
+            cur = conn.cursor()
+            try:
+                cur.execute(_LAG_SQL)
+                row = cur.fetchone()
+            except Exception as e:
+                if not _NO_PERMISSION.search(str(e)):
+                    raise
+                # Reachable but the lag cannot be read: keep it in rotation rather than out forever
+                if not self.lag_unknown:
+                    logger.warning(
+                        "Replica %s: cannot read its lag, grant VIEW SERVER STATE to %s; "
+                        "serving reads with lag unknown (%s)", self.label, self.creds.get("db_user"), e,
+                    )
+                self.lag_unknown = True
+                row = None
+            else:
+                self.lag_unknown = False
+            lag = None
+            if row is not None:
+                queue_kb, rate_kb, health = row
+                self.sync_health = health
+                if queue_kb:
+                    # No redo progress with a backlog: treat as beyond any lag limit
+                    lag = float(queue_kb) / float(rate_kb) if rate_kb else float("inf")
+                else:
+                    lag = 0.0
+            self.lag = lag
+            self.error = None
+            was = self.healthy
+            self.healthy = lag is None or lag <= REPLICA_MAX_LAG
+            if was != self.healthy:
+                logger.warning("Replica %s is %s (lag %s s)", self.label, "back" if self.healthy else "lagging", lag)
+        except Exception as e:
+            self.failed(e)
+        finally:
+            self.checked_at = time.monotonic()
+            self.checking = False
+            try:
+                if cur:
+                    cur.close()
+            except Exception:
+                pass
+            try:
+                if conn:
+                    db_pool.release(conn)
+            except Exception:
+                pass
+
+    def failed(self, error: Exception):
+        if self.healthy:
+            logger.warning("Replica %s taken out of read rotation: %s", self.label, error)
+        self.healthy = False
+        self.error = str(error)[:300]
+        self.checked_at = time.monotonic()
+
+    def in_use(self) -> int:
+        return db_pool.get_pool(self.creds).stats()["in_use"]
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "replica": self.label,
+            "healthy": self.healthy,
+            "lag_seconds": None if self.lag is None else round(self.lag, 2),
+            "synchronization_health": self.sync_health,
+            "lag_unknown": self.lag_unknown,
+            "checked_ago": round(time.monotonic() - self.checked_at, 1) if self.checked_at else None,
+            "picks": self.picks,
+            "error": self.error,
+        }
+
+
+class ReplicaSet:
+    """The readable secondaries of one primary database and the read routing between them."""
+
+    def __init__(self, replicas: List[Replica]):
+        self.replicas = replicas
+        self._rr = itertools.count()
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        now = time.monotonic()
+        first = []
+        with self._lock:
+            for r in self.replicas:
+                if r.checking or now - r.checked_at < REPLICA_CHECK_INTERVAL:
+                    continue
+                r.checking = True
+                if r.checked_at:
+                    _CHECKS.submit(r.check)
+                else:
+                    first.append(r)
+        # Never checked: wait for it once, so the first reads do not go to a dead replica
+        for r in first:
+            r.check()
+
+    def pick(self) -> Optional[Replica]:
+        self._refresh()
+        healthy = [r for r in self.replicas if r.healthy]
+        if not healthy:
+            return None
+        if READ_ROUTING == "least_loaded" and len(healthy) > 1:
+            loads = [(r.in_use(), i) for i, r in enumerate(healthy)]
+            lowest = min(load for load, _ in loads)
+            healthy = [healthy[i] for load, i in loads if load == lowest]
+        replica = healthy[next(self._rr) % len(healthy)]
+        replica.picks += 1
+        return replica
+
+
+_SETS: Dict[tuple, ReplicaSet] = {}
+_SETS_LOCK = threading.Lock()
+
+
+def replica_set(creds: Dict[str, Any]) -> Optional[ReplicaSet]:
+    """Replicas configured for a db_creds entry (db_read_servers, else MSSQL_READ_SERVERS), or None."""
+    spec = creds.get("db_read_servers") or READ_SERVERS
+    if not spec:
+        return None
+    key = db_pool.pool_key(creds) + (spec,)
+    with _SETS_LOCK:
+        rs = _SETS.get(key)
+        if rs is None:
+            replicas = [
+                Replica({**creds, "db_server": host, "db_port": port, "db_read_only": True})
+                for host, port in parse_servers(spec, creds.get("db_port"))
+            ]
+            rs = _SETS[key] = ReplicaSet(replicas)
+        return rs
+
+
+def replica_states(keys: Optional[Iterable[tuple]] = None) -> List[Dict[str, Any]]:
+    """Replicas of every primary, or only of the primaries with the given db_pool.pool_key()s."""
+    with _SETS_LOCK:
+        if keys is None:
+            sets = list(_SETS.values())
+        else:
+            keys = set(keys)
+            sets = [rs for key, rs in _SETS.items() if key[:-1] in keys]
+    return [r.status() for rs in sets for r in rs.replicas]
@@ -0,0 +1,189 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set
+
+import metrics
+import state
+
+# Opt-in read-through cache for SELECT results
+RESULT_CACHE_DEFAULT = os.getenv("MSSQL_RESULT_CACHE", "0") == "1"
+RESULT_CACHE_TTL = float(os.getenv("MSSQL_RESULT_CACHE_TTL", "60"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("MSSQL_RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESULT_CACHE_MAX_ENTRY_BYTES = int(os.getenv("MSSQL_RESULT_CACHE_MAX_ENTRY_BYTES", str(4 * 1024 * 1024)))
+
+_STRING_LITERAL = re.compile(r"(N?'(?:[^']|'')*')")
+_IDENT = r"(?:\[[^\]]+\]|\"[^\"]+\"|[\w#@$]+)"
+_QUALIFIED = rf"{_IDENT}(?:\s*\.\s*{_IDENT})*"
+_TABLE_REF = re.compile(rf"\b(?:FROM|JOIN|UPDATE|INTO|APPLY)\s+({_QUALIFIED})", re.IGNORECASE)
+_COMMA_REF = re.compile(rf"\bFROM\s+{_QUALIFIED}(?:\s+(?:AS\s+)?\w+)?((?:\s*,\s*{_QUALIFIED}(?:\s+(?:AS\s+)?\w+)?)+)", re.IGNORECASE)
+_PROC_CALL = re.compile(r"\b(?:EXEC|EXECUTE|sp_executesql)\b", re.IGNORECASE)
+_WRITE_WORDS = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE|INTO|EXEC|EXECUTE|CREATE|ALTER|DROP|TRUNCATE|GRANT|REVOKE|DENY)\b", re.IGNORECASE)
+
+
+def normalize_query(query: str) -> str:
+    """Collapse whitespace outside string literals and drop a trailing semicolon."""
+    parts = _STRING_LITERAL.split(query.strip())
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r"\s+", " ", parts[i])
+    return "".join(parts).rstrip(";").strip()
+
+
+def _table_name(ref: str) -> str:
+    last = re.split(r"\s*\.\s*", ref.strip())[-1]
+    return last.strip("[]\"").lower()
+
+
+def referenced_tables(query: str) -> Set[str]:
+    """Best-effort list of tables a statement reads or writes (last name part, lower-case)."""
+    code = "".join(_STRING_LITERAL.split(query)[0::2])
+    tables = {_table_name(m.group(1)) for m in _TABLE_REF.finditer(code)}
+    for m in _COMMA_REF.finditer(code):
+        for piece in m.group(1).split(","):
+            piece = piece.strip()
+            if piece:
+                tables.add(_table_name(re.match(_QUALIFIED, piece).group(0)))
+    return {t for t in tables if t and not t.startswith("@")}
+
+
+def is_read_only(query: str) -> bool:
+    """SELECT / WITH statements without any write keyword outside string literals."""
+    code = "".join(_STRING_LITERAL.split(query)[0::2]).lstrip().upper()
+    if not (code.startswith("SELECT") or code.startswith("WITH")):
+        return False
+    return not _WRITE_WORDS.search(code)
+
+
+def is_cacheable(query: str) -> bool:
+    return is_read_only(query) and bool(referenced_tables(query))
+
+
+def _db_key(db_name: str) -> str:
+    creds = state.current().db_creds.get(db_name) or {}
+    return f"{creds.get('db_server')}:{creds.get('db_port')}/{creds.get('db_database') or db_name}"
+
+
+class ResultCache:
+    """
+    LRU of query results bounded by TTL and total (JSON-estimated) size.
+    Entries remember the tables they read so writes can drop them.
+    """
+
+    def __init__(self, ttl: float = RESULT_CACHE_TTL, max_bytes: int = RESULT_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(db_name: str, query: str, params: Optional[List[Any]], extra: Any = None) -> tuple:
+        return (
+            _db_key(db_name),
+            normalize_query(query),
+            json.dumps(params or [], default=str),
+            state.current().username,
+            extra,
+        )
+
+    def _drop_locked(self, key: tuple):
+        entry = self._entries.pop(key)
+        self._bytes -= entry["size"]
+
+    def get(self, key: tuple) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["expires"] <= time.monotonic():
+                self._drop_locked(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry["result"]
+
+    def put(self, key: tuple, result: Dict[str, Any], tables: Set[str]):
+        size = len(json.dumps(result, default=str))
+        if size > RESULT_CACHE_MAX_ENTRY_BYTES:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop_locked(key)
+            self._entries[key] = {
+                "result": result,
+                "tables": tables,
+                "size": size,
+                "expires": time.monotonic() + self.ttl,
+            }
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                self._drop_locked(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, db_name: str, tables: Optional[Set[str]]):
+        """Drop the entries of db_name that read any of tables (all of its entries when tables is None)."""
+        db = _db_key(db_name)
+        tables = None if tables is None else {t.lower() for t in tables}
+        with self._lock:
+            stale = [k for k, e in self._entries.items() if k[0] == db and (tables is None or e["tables"] & tables)]
+            for k in stale:
+                self._drop_locked(k)
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+RESULT_CACHE = ResultCache()
+
+
+@metrics.register_collector
+def _cache_metrics() -> List[str]:
+    stats = RESULT_CACHE.stats()
+    lines = metrics.gauge_lines("mssql_mcp_result_cache_entries", "Cached results", [({}, stats["entries"])])
+    lines += metrics.gauge_lines("mssql_mcp_result_cache_bytes", "Approximate size of cached results", [({}, stats["bytes"])])
+    for field in ("hits", "misses", "evictions", "invalidations"):
+        lines += metrics.gauge_lines(
+            f"mssql_mcp_result_cache_{field}_total", f"Result cache {field}", [({}, stats[field])], kind="counter",
+        )
+    return lines
+
+
+def invalidate_tables(db_name: str, *statements_or_tables: str):
+    """
+    Drop cached results that read any table named directly or referenced by the given statements.
+    A statement that calls a procedure, or whose tables cannot be told, drops every entry of db_name.
+    """
+    tables: Set[str] = set()
+    for item in statements_or_tables:
+        code = "".join(_STRING_LITERAL.split(item)[0::2])
+        found = referenced_tables(item)
+        if _PROC_CALL.search(code) or (not found and not re.fullmatch(rf"\s*{_QUALIFIED}\s*", code)):
+            RESULT_CACHE.invalidate(db_name, None)
+            return
+        tables |= found if found else {_table_name(item)}
+    if tables:
+        RESULT_CACHE.invalidate(db_name, tables)
@@ -1,27 +1,46 @@
 import json
 import logging
 import time
+from concurrent.futures import ThreadPoolExecutor
 from getpass import getpass
+from typing import Any, Dict, List, Optional, Tuple
 
-from mcp.server.fastmcp import FastMCP
+from mcp.server.fastmcp import Context, FastMCP
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, Response
 
 from keycloak_integration import (
     get_token,
-    refresh_access_token,
     verify_token,
     get_user_db_attrs,
+    auth_cache_stats,
+    prefetch_jwks,
 )
-from db import list_all_databases, get_connection_from_credentials
-
-# SHARED GLOBAL STATE
+from db import list_databases
+import db_pool
+import replicas
+from breaker import breaker_states, breaker_targets
+import metrics
+import snapshot
+from executor import run_blocking, executor_stats
+from token_refresher import REFRESHER, apply_tokens
+
+# Per-session credentials / tokens
 import state
 
 # Tools
-from tools.mssql_query import run_query
-from tools.mssql_insert import insert_row
+from tools.mssql_query import ADMIN_USERS, run_query, fetch_page, close_cursor, list_queries, cancel_query
+from tools.mssql_insert import insert_row, bulk_insert_rows
 from tools.mssql_update import update_row
 from tools.mssql_delete import delete_row
-from tools.mssql_schema import get_table_schema
+from tools.mssql_batch import run_batch
+from tools.mssql_profile import list_profiles
+from tools.mssql_fanout import run_fanout
+from tools.mssql_export import run_export, read_export, list_exports, delete_export
+from tools.mssql_bulk import bulk_update_rows, bulk_delete_rows
+from tools.mssql_schema import get_table_schema, refresh_schema_cache, schema_cache_stats
+from tools.mssql_catalog import describe_database
+from result_cache import RESULT_CACHE
 
 
 logging.basicConfig(level=logging.INFO)
@@ -29,58 +48,182 @@ logger = logging.getLogger("MSSQL-MCP")
 
 mcp = FastMCP("MSSQL MCP Server")
 
-
-# ---------------------------------------------------
-def get_conn(db_name: str):
-    if db_name not in state.DB_CREDS:
-        raise Exception(f"Invalid database name '{db_name}'. Available: {list(state.DB_CREDS.keys())}")
-    creds = state.DB_CREDS[db_name]
-    return get_connection_from_credentials(
-        db_user=creds["db_user"],
-        db_password=creds["db_password"],
-        db_server=creds["db_server"],
-        db_port=creds["db_port"],
-        db_driver=creds["db_driver"],
-        db_name=creds.get("db_database"),
-    )
+# Longest a tool call waits on a token refresh it could not avoid
+TOKEN_REFRESH_WAIT = 15
 
 
-def ensure_fresh_token():
+# ---------------------------------------------------
+def get_conn(db_name: str, read_only: bool = False):
+    """
+    Borrow a connection for db_name (hand it back with release_conn()). With
+    read_only=True it comes from a healthy readable secondary when the login has
+    any (see replicas.py), else from the primary.
     """
-    Ensure the access token is valid, refreshing it if needed.
+    db_creds = state.current().db_creds
+    if db_name not in db_creds:
+        raise Exception(f"Invalid database name '{db_name}'. Available: {list(db_creds.keys())}")
+    creds = db_creds[db_name]
+    if read_only:
+        rs = replicas.replica_set(creds)
+        replica = rs.pick() if rs is not None else None
+        if replica is not None:
+            try:
+                return db_pool.acquire(replica.creds)
+            except Exception as e:
+                replica.failed(e)
+                logger.warning("Read for %s falls back to the primary: %s", db_name, e)
+    return db_pool.acquire(creds)
+
+
+def release_conn(conn, discard: bool = False):
+    db_pool.release(conn, discard=discard)
+
+
+def ensure_fresh_token(session: Optional[state.Session] = None):
+    """
+    Ensure the session's access token is valid, refreshing it if needed.
     Returns None on success, or an error dict if re-login is required.
     """
+    session = session or state.current()
     now = int(time.time())
 
+    # Bearer sessions: the client owns the token and its refresh
+    if not session.refresh_token:
+        if now >= session.access_expires_at:
+            return {"error": "Token expired, please login again"}
+        return None
+
     # Refresh token expired: force login
-    if now >= state.REFRESH_TOKEN_EXPIRES_AT:
+    if now >= session.refresh_expires_at:
         return {"error": "Token expired, please login again"}
 
-    # Access token expired: try to refresh
-    if now >= state.ACCESS_TOKEN_EXPIRES_AT:
+    # Access token expired (the background refresher normally renews it first):
+    # join the single in-flight refresh
+    if now >= session.access_expires_at:
         try:
-            tokens = refresh_access_token(state.REFRESH_TOKEN)
+            REFRESHER.refresh_now(session).result(timeout=TOKEN_REFRESH_WAIT)
         except Exception:
             return {"error": "Token expired, please login again"}
 
-        state.ACCESS_TOKEN = tokens["access_token"]
-        state.REFRESH_TOKEN = tokens["refresh_token"]
-        state.ACCESS_TOKEN_EXPIRES_AT = now + int(tokens.get("expires_in", 300))
-        state.REFRESH_TOKEN_EXPIRES_AT = now + int(tokens.get("refresh_expires_in", 1800))
-
     return None
 
 
-def require_auth():
-    if not state.logged_in_user or not state.ACCESS_TOKEN:
+def require_auth(session: Optional[state.Session] = None):
+    session = session or state.current()
+    if not session.username or not session.access_token:
         return {"status": "error", "message": "Login required"}
     try:
-        verify_token(state.ACCESS_TOKEN)
+        verify_token(session.access_token)
         return None
     except Exception:
         return {"status": "error", "message": "Invalid or expired token"}
 
 
+def _server_creds(raw: Dict[str, Any]) -> Dict[str, Any]:
+    creds = {
+        "db_user": raw["db_user"],
+        "db_password": raw["db_password"],
+        "db_server": raw["db_server"],
+        "db_port": raw["db_port"],
+        "db_driver": raw["db_driver"],
+    }
+    if raw.get("db_read_servers"):
+        creds["db_read_servers"] = raw["db_read_servers"]
+    return creds
+
+
+def _snapshot(creds: Dict[str, Any]) -> Optional[snapshot.Snapshot]:
+    return snapshot.for_login(creds["db_server"], creds["db_port"], creds["db_user"])
+
+
+def _list_databases(creds: Dict[str, Any]) -> List[str]:
+    """Discover the databases and record them (with create_date) in the login's snapshot."""
+    found = list_databases(
+        creds["db_user"],
+        creds["db_password"],
+        creds["db_server"],
+        creds["db_port"],
+        creds["db_driver"],
+    )
+    snap = _snapshot(creds)
+    if snap is not None:
+        try:
+            snap.save_databases(found)
+        except Exception as e:
+            logger.warning("Could not update the database snapshot: %s", e)
+    return [name for name, _ in found]
+
+
+def discover_db_creds(raw: Dict[str, Any]) -> Tuple[Dict[str, Dict[str, Any]], List[str]]:
+    """
+    Build the db_name -> credentials map (plus "default") from Keycloak DB attributes.
+    Returns (db_creds, discovered database names).
+    """
+    creds = _server_creds(raw)
+    dbs = _list_databases(creds)
+    return _build_db_creds(creds, dbs, raw.get("db_database")), dbs
+
+
+def _build_db_creds(creds: Dict[str, Any], dbs: List[str], preferred: Optional[str]) -> Dict[str, Dict[str, Any]]:
+    db_creds = {}
+
+    # default if provided
+    if preferred:
+        db_creds[preferred] = {**creds, "db_database": preferred}
+
+    for d in dbs:
+        db_creds[d] = {**creds, "db_database": d}
+
+    # Set default
+    if preferred:
+        db_creds["default"] = db_creds[preferred]
+    else:
+        db_creds["default"] = db_creds[dbs[0]]
+
+    return db_creds
+
+
+def _session_for_bearer(token: str) -> state.Session:
+    """One session per Keycloak subject; the latest bearer token it presented is kept on it."""
+    claims = verify_token(token)
+    key = f"sub:{claims['sub']}"
+    session = state.STORE.get(key)
+    if session is None:
+        username = claims.get("preferred_username") or claims["sub"]
+        session = state.Session(key, username)
+        session.db_creds, _ = discover_db_creds(get_user_db_attrs(username))
+        state.STORE.put(session)
+    with session.lock:
+        session.access_token = token
+        session.access_expires_at = int(claims.get("exp", 0))
+    return session
+
+
+def resolve_session(bearer: Optional[str], mcp_session_id: Optional[str]) -> Optional[state.Session]:
+    """
+    Bearer token first, then a session opened with mssql_login_tool. The CLI login
+    is used only when MSSQL_ALLOW_CLI_FALLBACK=1; otherwise returns None.
+    """
+    if bearer:
+        return _session_for_bearer(bearer)
+    if mcp_session_id:
+        session = state.STORE.get(f"mcp:{mcp_session_id}")
+        if session is not None:
+            return session
+    return state.cli_session() if state.ALLOW_CLI_FALLBACK else None
+
+
+def _request_identity(ctx: Optional[Context]) -> Tuple[Optional[str], Optional[str]]:
+    """(bearer token, MCP session id) of the HTTP request behind a tool call, if any."""
+    try:
+        headers = ctx.request_context.request.headers
+    except Exception:
+        return None, None
+    auth = headers.get("authorization") or ""
+    bearer = auth[7:].strip() if auth.lower().startswith("bearer ") else None
+    return bearer or None, headers.get("mcp-session-id")
+
+
 def _normalize_params(params):
     if isinstance(params, str):
         try:
@@ -93,88 +236,444 @@ def _normalize_params(params):
     return params if isinstance(params, list) else [params]
 
 
+def _guarded(tool: str, identity, fn, *args, **kwargs):
+    """
+    Session lookup + token freshness + auth check + error wrapping around one tool body,
+    timed per phase under the tool's name (see metrics.tool_call).
+    Runs on a worker thread (see executor.run_blocking).
+    """
+    with metrics.tool_call(tool, "-") as call:
+        call["result"] = result = _guarded_body(identity, fn, *args, **kwargs)
+        if metrics.COUNT_RESULT_BYTES:
+            with metrics.span("serialize"):
+                call["bytes"] = len(json.dumps(result, default=str))
+        return result
+
+
+def _guarded_body(identity, fn, *args, **kwargs):
+    try:
+        with metrics.span("session"):
+            session = resolve_session(*identity)
+    except Exception:
+        return {"status": "error", "message": "Invalid or expired token"}
+    if session is None:
+        return {"status": "error", "message": "Login required: send a bearer token or call mssql_login_tool"}
+    metrics.label_user(session.username)
+    db_name = kwargs.get("db_name")
+    if db_name is not None:
+        # Unknown names would make the label set unbounded
+        metrics.label_db(db_name if db_name in session.db_creds else "invalid")
+
+    with state.use_session(session):
+        with metrics.span("ensure_fresh_token"):
+            freshness = ensure_fresh_token(session)
+        if freshness:
+            return freshness
+
+        with metrics.span("verify_token"):
+            auth = require_auth(session)
+        if auth:
+            return auth
+
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            return {"status": "error", "reason": str(e)}
+
+
+def _db_limit(identity, db_name: str) -> Optional[Tuple[tuple, str]]:
+    """
+    Limiter key (see executor.run_blocking) of db_name in the caller's session, or
+    None when the caller or the name is not valid (the call then fails on its own).
+    """
+    try:
+        session = resolve_session(*identity)
+    except Exception:
+        return None
+    creds = session.db_creds.get(db_name) if session is not None else None
+    if creds is None:
+        return None
+    return db_pool.pool_key(creds), db_pool.pool_label(creds)
+
+
+async def _call(tool: str, ctx: Optional[Context], fn, *args, limit_db=None, **kwargs):
+    identity = _request_identity(ctx)
+    # "default" and the database it names share one limiter, keyed by server/login/database
+    limit = await run_blocking(_db_limit, identity, limit_db) if limit_db is not None else None
+    return await run_blocking(_guarded, tool, identity, fn, *args, limit=limit, **kwargs)
+
+
 # -------------------- TOOLS ------------------------
 @mcp.tool()
-def mssql_query_tool(query: str, params=None, db_name="default"):
-    freshness = ensure_fresh_token()
-    if freshness:
-        return freshness
+async def mssql_query_tool(
+    query: str, params=None, db_name="default", page_size=None, max_bytes=None, cache=None, format="rows",
+    timeout=None, max_rows=None, max_result_bytes=None, query_id=None, profile=None, primary=None,
+    ctx: Context = None,
+):
+    return await _call(
+        "mssql_query_tool", ctx, run_query, query, _normalize_params(params),
+        db_name=db_name, page_size=page_size, max_bytes=max_bytes, cache=cache, fmt=format,
+        timeout=timeout, max_rows=max_rows, max_result_bytes=max_result_bytes, query_id=query_id,
+        profile=profile, primary=primary, limit_db=db_name,
+    )
 
-    auth = require_auth()
-    if auth:
-        return auth
 
-    try:
-        return run_query(query, _normalize_params(params), db_name=db_name)
-    except Exception as e:
-        return {"status": "error", "reason": str(e)}
+@mcp.tool()
+async def mssql_fanout_query_tool(
+    query: str, params=None, databases=None, concurrency=None, timeout=None, aggregate="concat",
+    format="rows", max_rows=None, query_id=None, ctx: Context = None,
+):
+    """
+    Run one query against several databases in parallel (databases: names or glob patterns,
+    default all) and merge the results: aggregate="concat" tags each row with its database,
+    "sum" adds up numeric columns across databases, "count" returns row counts only.
+    """
+    return await _call(
+        "mssql_fanout_query_tool", ctx, run_fanout, query, _normalize_params(params),
+        databases=databases, concurrency=concurrency, timeout=timeout, aggregate=aggregate, fmt=format,
+        max_rows=max_rows, query_id=query_id,
+    )
 
 
 @mcp.tool()
-def mssql_insert_tool(table: str, data, db_name="default"):
-    freshness = ensure_fresh_token()
-    if freshness:
-        return freshness
+async def mssql_fetch_tool(cursor_id: str, page_size=None, max_bytes=None, ctx: Context = None):
+    return await _call(
+        "mssql_fetch_tool", ctx, fetch_page, cursor_id, page_size=page_size, max_bytes=max_bytes
+    )
 
-    auth = require_auth()
-    if auth:
-        return auth
 
-    try:
-        return insert_row(table, data, db_name=db_name)
-    except Exception as e:
-        return {"status": "error", "reason": str(e)}
+@mcp.tool()
+async def mssql_close_cursor_tool(cursor_id: str, ctx: Context = None):
+    return await _call("mssql_close_cursor_tool", ctx, close_cursor, cursor_id)
 
 
 @mcp.tool()
-def mssql_update_tool(table: str, data, condition, db_name="default"):
-    freshness = ensure_fresh_token()
-    if freshness:
-        return freshness
+async def mssql_running_queries_tool(ctx: Context = None):
+    return await _call("mssql_running_queries_tool", ctx, list_queries)
 
-    auth = require_auth()
-    if auth:
-        return auth
 
-    try:
-        return update_row(table, data, condition, db_name=db_name)
-    except Exception as e:
-        return {"status": "error", "reason": str(e)}
+@mcp.tool()
+async def mssql_cancel_query_tool(query_id: str, ctx: Context = None):
+    return await _call("mssql_cancel_query_tool", ctx, cancel_query, query_id)
 
 
 @mcp.tool()
-def mssql_delete_tool(table: str, condition, db_name="default"):
-    freshness = ensure_fresh_token()
-    if freshness:
-        return freshness
+async def mssql_profiles_tool(profile_id=None, limit=20, ctx: Context = None):
+    """Recent query profiles (requested with profile=true or captured for slow calls), or one with its plan XML."""
+    return await _call("mssql_profiles_tool", ctx, list_profiles, profile_id=profile_id, limit=limit)
 
-    auth = require_auth()
-    if auth:
-        return auth
 
-    try:
-        return delete_row(table, condition, db_name=db_name)
-    except Exception as e:
-        return {"status": "error", "reason": str(e)}
+@mcp.tool()
+async def mssql_export_tool(
+    query: str, params=None, db_name="default", format="csv", batch_rows=None, query_id=None,
+    ctx: Context = None,
+):
+    """Stream a query result to a gzip CSV (default) or Parquet file on the server instead of returning it inline."""
+    return await _call(
+        "mssql_export_tool", ctx, run_export, query, _normalize_params(params),
+        db_name=db_name, fmt=format, batch_rows=batch_rows, query_id=query_id, limit_db=db_name,
+    )
 
 
 @mcp.tool()
-def mssql_schema_tool(table_name: str, db_name="default"):
-    freshness = ensure_fresh_token()
-    if freshness:
-        return freshness
+async def mssql_export_read_tool(export_id: str, offset=0, limit=None, format="rows", ctx: Context = None):
+    return await _call("mssql_export_read_tool", ctx, read_export, export_id, offset=offset, limit=limit, fmt=format)
 
-    auth = require_auth()
-    if auth:
-        return auth
 
-    try:
-        return get_table_schema(table_name, db_name=db_name)
-    except Exception as e:
-        return {"status": "error", "reason": str(e)}
+@mcp.tool()
+async def mssql_export_list_tool(ctx: Context = None):
+    return await _call("mssql_export_list_tool", ctx, list_exports)
+
+
+@mcp.tool()
+async def mssql_export_delete_tool(export_id: str, ctx: Context = None):
+    return await _call("mssql_export_delete_tool", ctx, delete_export, export_id)
+
+
+@mcp.tool()
+async def mssql_insert_tool(table: str, data, db_name="default", ctx: Context = None):
+    return await _call(
+        "mssql_insert_tool", ctx, insert_row, table, data, db_name=db_name, limit_db=db_name
+    )
+
+
+@mcp.tool()
+async def mssql_bulk_insert_tool(
+    table: str, rows, db_name="default", format=None, batch_size=None, commit="batch", ctx: Context = None
+):
+    return await _call(
+        "mssql_bulk_insert_tool", ctx, bulk_insert_rows, table, rows,
+        db_name=db_name, fmt=format, batch_size=batch_size, commit=commit, limit_db=db_name,
+    )
+
+
+@mcp.tool()
+async def mssql_update_tool(table: str, data, condition, db_name="default", ctx: Context = None):
+    return await _call(
+        "mssql_update_tool", ctx, update_row, table, data, condition, db_name=db_name, limit_db=db_name
+    )
+
+
+@mcp.tool()
+async def mssql_delete_tool(table: str, condition, db_name="default", ctx: Context = None):
+    return await _call(
+        "mssql_delete_tool", ctx, delete_row, table, condition, db_name=db_name, limit_db=db_name
+    )
+
+
+@mcp.tool()
+async def mssql_bulk_update_tool(
+    table: str, updates, db_name="default", batch_size=None, commit="batch", ctx: Context = None
+):
+    return await _call(
+        "mssql_bulk_update_tool", ctx, bulk_update_rows, table, updates,
+        db_name=db_name, batch_size=batch_size, commit=commit, limit_db=db_name,
+    )
+
+
+@mcp.tool()
+async def mssql_bulk_delete_tool(
+    table: str, keys, db_name="default", format=None, batch_size=None, commit="batch", ctx: Context = None
+):
+    return await _call(
+        "mssql_bulk_delete_tool", ctx, bulk_delete_rows, table, keys,
+        db_name=db_name, fmt=format, batch_size=batch_size, commit=commit, limit_db=db_name,
+    )
+
+
+@mcp.tool()
+async def mssql_batch_tool(operations, db_name="default", mode="atomic", format="rows", ctx: Context = None):
+    """
+    Run insert/update/delete/query operations in order on one connection and one transaction.
+    mode="atomic" rolls everything back on the first failure; mode="continue" keeps going and
+    commits the operations that succeeded.
+    """
+    return await _call(
+        "mssql_batch_tool", ctx, run_batch, operations, db_name=db_name, mode=mode, fmt=format, limit_db=db_name
+    )
+
+
+@mcp.tool()
+async def mssql_schema_tool(table_name: str, db_name="default", ctx: Context = None):
+    return await _call(
+        "mssql_schema_tool", ctx, get_table_schema, table_name, db_name=db_name, limit_db=db_name
+    )
+
+
+@mcp.tool()
+async def mssql_catalog_tool(db_name="default", schema=None, name=None, include=None, ctx: Context = None):
+    """
+    Describe all tables of a database at once: columns, primary/foreign keys, indexes and
+    approximate row counts. schema and name are glob patterns; include picks sections
+    (columns, keys, indexes, rows).
+    """
+    return await _call(
+        "mssql_catalog_tool", ctx, describe_database,
+        db_name=db_name, schema=schema, name=name, include=include, limit_db=db_name,
+    )
+
+
+@mcp.tool()
+async def mssql_schema_refresh_tool(db_name=None, ctx: Context = None):
+    return await _call("mssql_schema_refresh_tool", ctx, refresh_schema_cache, db_name=db_name, limit_db=db_name)
+
+
+def _pool_stats(keys: List[tuple]) -> Dict[str, Any]:
+    return {"status": "success", "pools": db_pool.pool_stats(keys), "executor": executor_stats(keys)}
+
+
+@mcp.tool()
+async def mssql_pool_stats_tool(ctx: Context = None):
+    return await _call(
+        "mssql_pool_stats_tool", ctx,
+        lambda: _pool_stats([db_pool.pool_key(c) for c in state.current().db_creds.values()]),
+    )
+
+
+@mcp.tool()
+async def mssql_cache_stats_tool(ctx: Context = None):
+    return await _call(
+        "mssql_cache_stats_tool", ctx, lambda: {
+            "status": "success",
+            "results": RESULT_CACHE.stats(),
+            "schema": schema_cache_stats(),
+            "auth": auth_cache_stats(),
+        }
+    )
+
+
+def _health() -> Dict[str, Any]:
+    """Health report; slow calls, breakers and replicas are the caller's own unless MSSQL_ADMIN_USERS."""
+    session = state.current()
+    result = {
+        "status": "success",
+        "token_refresh": REFRESHER.status(session),
+        "sessions": state.STORE.stats(),
+        "startup": STARTUP,
+    }
+    if session.username in ADMIN_USERS:
+        return {
+            **result,
+            "slow_calls": metrics.recent_slow_calls(),
+            "breakers": breaker_states(),
+            "replicas": replicas.replica_states(),
+        }
+    creds = list(session.db_creds.values())
+    return {
+        **result,
+        "slow_calls": metrics.recent_slow_calls(user=session.username),
+        "breakers": breaker_states(targets=[t for c in creds for t in breaker_targets(c)]),
+        "replicas": replicas.replica_states([db_pool.pool_key(c) for c in creds]),
+    }
+
+
+@mcp.tool()
+async def mssql_health_tool(ctx: Context = None):
+    return await _call("mssql_health_tool", ctx, _health)
+
+
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics_endpoint(request: Request) -> Response:
+    """Prometheus scrape endpoint (no auth; expose it on a trusted network only)."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 # -------------------- LOGIN ------------------------
+def _login_session(session: state.Session, username: str, password: str) -> List[str]:
+    """Authenticate against Keycloak and load the user's tokens and databases into session."""
+    tokens = get_token(username, password)
+    apply_tokens(session, tokens)
+    session.username = username
+    session.db_creds, dbs = discover_db_creds(get_user_db_attrs(username))
+    REFRESHER.reschedule()
+    return dbs
+
+
+@mcp.tool()
+async def mssql_login_tool(username: str, password: str, ctx: Context = None):
+    """
+    Open a session for this MCP connection with the user's own Keycloak credentials.
+
+    The session is found again by the Mcp-Session-Id header alone, so whoever
+    holds that id acts as this user until logout or idle expiry, and the password
+    travels as a tool argument: use this only over TLS on a trusted transport,
+    and prefer bearer tokens otherwise.
+    """
+    _, mcp_session_id = _request_identity(ctx)
+    if not mcp_session_id:
+        return {"status": "error", "message": "Login requires an MCP session (streamable-http transport)"}
+
+    def login():
+        session = state.Session(f"mcp:{mcp_session_id}")
+        try:
+            dbs = _login_session(session, username, password)
+        except Exception as e:
+            return {"status": "error", "message": f"Login failed: {e}"}
+        state.STORE.put(session)
+        return {"status": "success", "user": username, "databases": dbs}
+
+    return await run_blocking(login)
+
+
+@mcp.tool()
+async def mssql_logout_tool(ctx: Context = None):
+    _, mcp_session_id = _request_identity(ctx)
+    removed = state.STORE.remove(f"mcp:{mcp_session_id}") if mcp_session_id else None
+    if removed is None:
+        return {"status": "error", "message": "No session to log out"}
+    return {"status": "success", "message": f"Logged out {removed.username}"}
+
+
+# Per-phase startup timings (ms), also reported by mssql_health_tool
+STARTUP: Dict[str, Any] = {"phases_ms": {}, "discovery": "pending"}
+
+
+def _timed(phase: str, fn, *args):
+    start = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        STARTUP["phases_ms"][phase] = round((time.perf_counter() - start) * 1000.0, 1)
+
+
+def _print_databases(dbs: List[str]):
+    print(f"\n🗄 Databases available ({len(dbs)}):")
+    for d in dbs:
+        print(" •", d)
+    print("Default =", "default")
+
+
+def _startup_login(session: state.Session, username: str, password: str) -> Optional[List[str]]:
+    """
+    _login_session for the CLI, with the independent steps overlapped.
+
+    The password grant, the admin attribute lookup and the JWKS prefetch run
+    at once. When the user has a preferred database or a fresh snapshot of
+    the database list exists (see snapshot.py), only the default pool is
+    warmed before returning and sys.databases discovery finishes in the
+    background (returns None); otherwise discovery is waited for (returns
+    the names).
+    """
+    started = time.perf_counter()
+    workers = ThreadPoolExecutor(max_workers=4, thread_name_prefix="startup")
+    try:
+        tokens_f = workers.submit(_timed, "token", get_token, username, password)
+        attrs_f = workers.submit(_timed, "user_attrs", get_user_db_attrs, username)
+        jwks_f = workers.submit(_timed, "jwks_prefetch", prefetch_jwks)
+
+        def jwks_done(f):
+            if f.exception() is not None:
+                logger.warning("JWKS prefetch failed: %s", f.exception())
+
+        jwks_f.add_done_callback(jwks_done)
+
+        apply_tokens(session, tokens_f.result())
+        session.username = username
+        raw = attrs_f.result()
+        creds = _server_creds(raw)
+        preferred = raw.get("db_database")
+        discovery_f = workers.submit(_timed, "discovery", _list_databases, creds)
+        snap = None if snapshot.SNAPSHOT_FORCE_REFRESH else _snapshot(creds)
+        known = _timed("snapshot_load", snap.databases) if snap is not None else None
+
+        dbs = None
+        if preferred or known:
+            # Serve from the preferred database and/or the snapshot; discovery reconciles below
+            session.db_creds = _build_db_creds(creds, known or [], preferred)
+
+            def merge(f):
+                try:
+                    found = f.result()
+                except Exception as e:
+                    STARTUP["discovery"] = f"failed: {e}"
+                    logger.warning("Database discovery failed; keeping %d known databases: %s",
+                                   len(session.db_creds) - 1, e)
+                    return
+                if not found and not preferred:
+                    logger.warning("Database discovery found no databases; keeping the snapshot")
+                    return
+                # Swapped in whole: readers never see a half-built map
+                session.db_creds = _build_db_creds(creds, found, preferred)
+                STARTUP["discovery"] = "done"
+                logger.info("Database discovery finished: %d databases", len(found))
+
+            discovery_f.add_done_callback(merge)
+        else:
+            dbs = discovery_f.result()
+            session.db_creds = _build_db_creds(creds, dbs, None)
+            STARTUP["discovery"] = "done"
+
+        try:
+            _timed("pool_warm", db_pool.get_pool(session.db_creds["default"]).warm)
+        except Exception as e:
+            logger.warning("Could not warm the default database pool: %s", e)
+        REFRESHER.reschedule()
+        return dbs
+    finally:
+        workers.shutdown(wait=False)
+        STARTUP["phases_ms"]["ready"] = round((time.perf_counter() - started) * 1000.0, 1)
+
+
 def cli_login():
     print("🔐 Keycloak Login")
 
@@ -183,59 +682,17 @@ def cli_login():
         password = getpass("Password: ")
 
         try:
-            tokens = get_token(username, password)
-            now = int(time.time())
-
-            state.ACCESS_TOKEN = tokens["access_token"]
-            state.REFRESH_TOKEN = tokens["refresh_token"]
-            state.ACCESS_TOKEN_EXPIRES_AT = now + int(tokens.get("expires_in", 300))
-            state.REFRESH_TOKEN_EXPIRES_AT = now + int(tokens.get("refresh_expires_in", 1800))
-            state.logged_in_user = username
+            session = state.cli_session()
+            dbs = _startup_login(session, username, password)
 
             print("\n🔑 Access Token:")
-            print(state.ACCESS_TOKEN)
-
-            # Fetch DB attrs from Keycloak
-            raw = get_user_db_attrs(username)
-
-            creds = {
-                "db_user": raw["db_user"],
-                "db_password": raw["db_password"],
-                "db_server": raw["db_server"],
-                "db_port": raw["db_port"],
-                "db_driver": raw["db_driver"],
-            }
-
-            # Discover DBs
-            dbs = list_all_databases(
-                creds["db_user"],
-                creds["db_password"],
-                creds["db_server"],
-                creds["db_port"],
-                creds["db_driver"],
-            )
-
-            state.DB_CREDS = {}
-
-            # default if provided
-            preferred = raw.get("db_database")
-
-            if preferred:
-                state.DB_CREDS[preferred] = {**creds, "db_database": preferred}
-
-            for d in dbs:
-                state.DB_CREDS[d] = {**creds, "db_database": d}
-
-            # Set default
-            if preferred:
-                state.DB_CREDS["default"] = state.DB_CREDS[preferred]
-            else:
-                state.DB_CREDS["default"] = state.DB_CREDS[dbs[0]]
+            print(session.access_token)
 
-            print(f"\n🗄 Databases available ({len(dbs)}):")
-            for d in dbs:
-                print(" •", d)
-            print("Default =", "default")
+            if dbs is not None:
+                _print_databases(dbs)
+            else:
+                print("\n🗄 Default =", session.db_creds["default"]["db_database"], "(discovering the rest in the background)")
+            logger.info("Startup phases (ms): %s", STARTUP["phases_ms"])
 
             break
 
@@ -246,5 +703,6 @@ def cli_login():
 # -------------------- MAIN ------------------------
 if __name__ == "__main__":
     cli_login()
+    REFRESHER.start()
     logger.info("🚀 Starting MSSQL MCP Server")
     mcp.run(transport="streamable-http")
\ No newline at end of file
@@ -0,0 +1,185 @@
+import datetime
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# On-disk copy of the discovered databases and column catalogs, one SQLite file
+# per server/login. Loaded at startup instead of waiting on SQL Server, then
+# reconciled incrementally (sys.databases.create_date, sys.objects.modify_date).
+SNAPSHOT_ENABLED = os.getenv("MSSQL_SNAPSHOT", "1") != "0"
+SNAPSHOT_DIR = os.getenv("MSSQL_SNAPSHOT_DIR", os.path.join(os.getcwd(), "snapshots"))
+# Snapshots older than this are ignored (and rebuilt) instead of trusted at startup
+SNAPSHOT_MAX_AGE = float(os.getenv("MSSQL_SNAPSHOT_MAX_AGE", str(7 * 24 * 3600)))
+# MSSQL_SNAPSHOT_REFRESH=1 ignores existing snapshots once (forced rediscovery at startup)
+SNAPSHOT_FORCE_REFRESH = os.getenv("MSSQL_SNAPSHOT_REFRESH", "0") == "1"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS databases (
+    name TEXT PRIMARY KEY, position INTEGER, create_date TEXT, saved_at REAL
+);
+CREATE TABLE IF NOT EXISTS catalogs (
+    db TEXT PRIMARY KEY, modified TEXT, objects INTEGER, saved_at REAL
+);
+CREATE TABLE IF NOT EXISTS tables (
+    db TEXT, object_id INTEGER, schema_name TEXT, name TEXT, modify_date TEXT,
+    PRIMARY KEY (db, object_id)
+);
+CREATE TABLE IF NOT EXISTS columns (
+    db TEXT, object_id INTEGER, ordinal INTEGER, name TEXT, data_type TEXT, nullable TEXT, default_def TEXT,
+    PRIMARY KEY (db, object_id, ordinal)
+);
+"""
+
+
+def _dt(value) -> Optional[str]:
+    return value.isoformat() if isinstance(value, (datetime.datetime, datetime.date)) else value
+
+
+def _parse_dt(value: Optional[str]):
+    return datetime.datetime.fromisoformat(value) if value else None
+
+
+class Snapshot:
+    """Databases and column catalogs of one server/login, persisted in a SQLite file."""
+
+    def __init__(self, path: str, max_age: float = SNAPSHOT_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self._lock = threading.Lock()  # one writer at a time; readers use their own connections
+        with closing(self._connect()) as db:
+            db.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, timeout=10)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def _fresh(self, saved_at: Optional[float]) -> bool:
+        return saved_at is not None and time.time() - saved_at < self.max_age
+
+    # ---------------------------------------------------
+    def databases(self) -> Optional[List[str]]:
+        """Database names in discovery order, or None when missing or older than max_age."""
+        with closing(self._connect()) as db:
+            rows = db.execute("SELECT name, saved_at FROM databases ORDER BY position").fetchall()
+        if not rows or not self._fresh(min(r[1] for r in rows)):
+            return None
+        return [r[0] for r in rows]
+
+    def save_databases(self, found: List[Tuple[str, Any]]) -> List[str]:
+        """
+        Store a fresh (name, create_date) listing. Catalogs of databases that were
+        dropped or re-created since the last listing are discarded; returns their names.
+        """
+        now = time.time()
+        with self._lock, closing(self._connect()) as db, db:
+            known = dict(db.execute("SELECT name, create_date FROM databases").fetchall())
+            current = {name: _dt(created) for name, created in found}
+            stale = [n for n, created in known.items() if current.get(n) != created]
+            for name in stale:
+                self._drop_catalog(db, name)
+            db.execute("DELETE FROM databases")
+            db.executemany(
+                "INSERT INTO databases (name, position, create_date, saved_at) VALUES (?, ?, ?, ?)",
+                [(name, i, current[name], now) for i, (name, _) in enumerate(found)],
+            )
+        if stale:
+            logger.info("Snapshot %s: dropped catalogs of %d changed databases", self.path, len(stale))
+        return stale
+
+    # ---------------------------------------------------
+    def load_catalog(self, database: str) -> Optional[Tuple[tuple, Dict[int, Dict[str, Any]]]]:
+        """(version, tables) in the SchemaCatalog layout, or None when missing or stale."""
+        with closing(self._connect()) as db:
+            head = db.execute("SELECT modified, objects, saved_at FROM catalogs WHERE db = ?", (database,)).fetchone()
+            if head is None or not self._fresh(head[2]):
+                return None
+            tables: Dict[int, Dict[str, Any]] = {}
+            for oid, schema, name, modified in db.execute(
+                "SELECT object_id, schema_name, name, modify_date FROM tables WHERE db = ?", (database,)
+            ):
+                tables[oid] = {"schema": schema, "name": name, "modify_date": _parse_dt(modified), "columns": []}
+            for oid, col, dtype, nullable, default in db.execute(
+                "SELECT object_id, name, data_type, nullable, default_def FROM columns WHERE db = ? "
+                "ORDER BY object_id, ordinal", (database,)
+            ):
+                if oid in tables:
+                    tables[oid]["columns"].append(
+                        {"COLUMN_NAME": col, "DATA_TYPE": dtype, "IS_NULLABLE": nullable, "COLUMN_DEFAULT": default}
+                    )
+        return (_parse_dt(head[0]), head[1]), tables
+
+    def save_catalog(self, database: str, version: tuple, tables: Dict[int, Dict[str, Any]]):
+        table_rows = [(database, oid, t["schema"], t["name"], _dt(t["modify_date"])) for oid, t in tables.items()]
+        column_rows = [
+            (database, oid, i, c["COLUMN_NAME"], c["DATA_TYPE"], c["IS_NULLABLE"], c["COLUMN_DEFAULT"])
+            for oid, t in tables.items() for i, c in enumerate(t["columns"])
+        ]
+        with self._lock, closing(self._connect()) as db, db:
+            self._drop_catalog(db, database)
+            db.executemany("INSERT INTO tables VALUES (?, ?, ?, ?, ?)", table_rows)
+            db.executemany("INSERT INTO columns VALUES (?, ?, ?, ?, ?, ?, ?)", column_rows)
+            db.execute(
+                "INSERT INTO catalogs (db, modified, objects, saved_at) VALUES (?, ?, ?, ?)",
+                (database, _dt(version[0]), version[1], time.time()),
+            )
+
+    @staticmethod
+    def _drop_catalog(db: sqlite3.Connection, database: Optional[str]):
+        for table in ("catalogs", "tables", "columns"):
+            if database is None:
+                db.execute(f"DELETE FROM {table}")
+            else:
+                db.execute(f"DELETE FROM {table} WHERE db = ?", (database,))
+
+    def drop_catalogs(self, database: Optional[str] = None):
+        """Forget the catalog of one database (or all of them); the next lookup reloads from SQL Server."""
+        with self._lock, closing(self._connect()) as db, db:
+            self._drop_catalog(db, database)
+
+    def stats(self) -> Dict[str, Any]:
+        with closing(self._connect()) as db:
+            dbs, listed_at = db.execute("SELECT COUNT(*), MIN(saved_at) FROM databases").fetchone()
+            catalogs, tables = db.execute(
+                "SELECT COUNT(*), (SELECT COUNT(*) FROM tables) FROM catalogs"
+            ).fetchone()
+        return {
+            "path": self.path,
+            "bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+            "databases": dbs,
+            "databases_age": int(time.time() - listed_at) if listed_at else None,
+            "catalogs": catalogs,
+            "tables": tables,
+        }
+
+
+_SNAPSHOTS: Dict[tuple, Snapshot] = {}
+_SNAPSHOTS_LOCK = threading.Lock()
+
+
+def for_login(db_server: str, db_port: Any, db_user: str) -> Optional[Snapshot]:
+    """The snapshot of a server/login, or None when snapshots are disabled or unusable."""
+    if not SNAPSHOT_ENABLED:
+        return None
+    key = (str(db_server), str(db_port), str(db_user))
+    with _SNAPSHOTS_LOCK:
+        snap = _SNAPSHOTS.get(key)
+        if snap is None:
+            # Hashed name: no server/user names in the file system
+            name = hashlib.sha256("|".join(key).encode("utf-8")).hexdigest()[:24]
+            try:
+                os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+                snap = _SNAPSHOTS[key] = Snapshot(os.path.join(SNAPSHOT_DIR, f"{name}.sqlite"))
+            except Exception as e:
+                logger.warning("Snapshot disabled for %s@%s: %s", db_user, db_server, e)
+                return None
+        return snap
+
@@ -1,6 +1,177 @@
-logged_in_user = None
-ACCESS_TOKEN = None
-REFRESH_TOKEN = None
-ACCESS_TOKEN_EXPIRES_AT = 0
-REFRESH_TOKEN_EXPIRES_AT = 0
-DB_CREDS = {}
\ No newline at end of file
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+import metrics
+
+# Per-session credentials and tokens. A tool call resolves its Session (from the
+# bearer token or MCP session id of the request) and binds it with use_session();
+# code running for that call reads it through current().
+SESSION_IDLE_TIMEOUT = float(os.getenv("MSSQL_SESSION_IDLE_TIMEOUT", "3600"))
+MAX_SESSIONS = int(os.getenv("MSSQL_MAX_SESSIONS", "1000"))
+SESSION_STRIPES = 16
+SWEEP_INTERVAL = 60
+CLI_SESSION_KEY = "cli"
+# Let requests without a bearer token or MCP session act as the CLI login (trusted setups only)
+ALLOW_CLI_FALLBACK = os.getenv("MSSQL_ALLOW_CLI_FALLBACK", "0") == "1"
+
+
+class Session:
+    def __init__(self, key: str, username: Optional[str] = None, pinned: bool = False):
+        self.key = key
+        self.username = username
+        self.access_token: Optional[str] = None
+        self.refresh_token: Optional[str] = None
+        self.access_expires_at = 0
+        self.refresh_expires_at = 0
+        self.refresh_due_at = 0.0
+        self.refresh_failures = 0
+        self.db_creds: Dict[str, Dict[str, Any]] = {}
+        self.pinned = pinned
+        self.last_seen = time.monotonic()
+        self.lock = threading.Lock()
+
+    def describe(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            "session": self.key if self.pinned else self.key[:12],
+            "user": self.username,
+            "databases": len([k for k in self.db_creds if k != "default"]),
+            "access_expires_in": max(0, int(self.access_expires_at - now)),
+            "refresh_expires_in": max(0, int(self.refresh_expires_at - now)),
+            "idle_seconds": int(time.monotonic() - self.last_seen),
+        }
+
+
+class SessionStore:
+    """
+    Lock-striped map of session key -> Session.
+
+    Sessions idle for longer than idle_timeout are dropped by a rate-limited
+    sweep, and the least recently seen ones are evicted once max_sessions is
+    exceeded. Pinned sessions (the CLI login) are never evicted.
+    """
+
+    def __init__(self, stripes: int = SESSION_STRIPES, idle_timeout: float = SESSION_IDLE_TIMEOUT,
+                 max_sessions: int = MAX_SESSIONS):
+        self._stripes = [({}, threading.Lock()) for _ in range(stripes)]
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self._count = 0
+        self._count_lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+        self.evicted = 0
+
+    def _stripe(self, key: str):
+        return self._stripes[hash(key) % len(self._stripes)]
+
+    def get(self, key: str) -> Optional[Session]:
+        sessions, lock = self._stripe(key)
+        with lock:
+            session = sessions.get(key)
+        if session is not None:
+            session.last_seen = time.monotonic()
+        self.evict_idle()
+        return session
+
+    def put(self, session: Session) -> Session:
+        sessions, lock = self._stripe(session.key)
+        with lock:
+            added = session.key not in sessions
+            sessions[session.key] = session
+        if added:
+            with self._count_lock:
+                self._count += 1
+                over = self._count - self.max_sessions
+            if over > 0:
+                self._evict_lru(over)
+        return session
+
+    def remove(self, key: str) -> Optional[Session]:
+        sessions, lock = self._stripe(key)
+        with lock:
+            session = sessions.pop(key, None)
+        if session is not None:
+            with self._count_lock:
+                self._count -= 1
+        return session
+
+    def sessions(self) -> List[Session]:
+        out: List[Session] = []
+        for sessions, lock in self._stripes:
+            with lock:
+                out.extend(sessions.values())
+        return out
+
+    def _evict_lru(self, count: int):
+        victims = sorted((s for s in self.sessions() if not s.pinned), key=lambda s: s.last_seen)[:count]
+        for s in victims:
+            if self.remove(s.key) is not None:
+                self.evicted += 1
+
+    def evict_idle(self, force: bool = False) -> int:
+        now = time.monotonic()
+        if not force and now - self._last_sweep < SWEEP_INTERVAL:
+            return 0
+        self._last_sweep = now
+        cutoff = now - self.idle_timeout
+        dropped = 0
+        for s in self.sessions():
+            if not s.pinned and s.last_seen < cutoff and self.remove(s.key) is not None:
+                dropped += 1
+        self.evicted += dropped
+        return dropped
+
+    def stats(self) -> Dict[str, Any]:
+        with self._count_lock:
+            count = self._count
+        return {
+            "sessions": count,
+            "max_sessions": self.max_sessions,
+            "idle_timeout": self.idle_timeout,
+            "evicted": self.evicted,
+        }
+
+
+STORE = SessionStore()
+
+
+@metrics.register_collector
+def _session_metrics() -> List[str]:
+    stats = STORE.stats()
+    return (
+        metrics.gauge_lines("mssql_mcp_sessions", "Live sessions", [({}, stats["sessions"])])
+        + metrics.gauge_lines("mssql_mcp_sessions_evicted_total", "Evicted sessions", [({}, stats["evicted"])], kind="counter")
+    )
+_CURRENT: ContextVar[Optional[Session]] = ContextVar("mssql_session", default=None)
+_CLI_LOCK = threading.Lock()
+
+
+def cli_session() -> Session:
+    """The session created by the interactive login; used when a request carries no identity."""
+    session = STORE.get(CLI_SESSION_KEY)
+    if session is None:
+        with _CLI_LOCK:
+            session = STORE.get(CLI_SESSION_KEY) or STORE.put(Session(CLI_SESSION_KEY, pinned=True))
+    return session
+
+
+def current() -> Session:
+    session = _CURRENT.get()
+    if session is not None:
+        return session
+    if ALLOW_CLI_FALLBACK:
+        return cli_session()
+    raise RuntimeError("No session bound to this call")
+
+
+@contextmanager
+def use_session(session: Session):
+    token = _CURRENT.set(session)
+    try:
+        yield session
+    finally:
+        _CURRENT.reset(token)
@@ -0,0 +1,146 @@
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, Optional
+
+import state
+from keycloak_integration import refresh_access_token
+
+logger = logging.getLogger(__name__)
+
+# Renew this many seconds (plus jitter) before the access token expires
+TOKEN_REFRESH_LEAD = float(os.getenv("KEYCLOAK_TOKEN_REFRESH_LEAD", "30"))
+TOKEN_REFRESH_JITTER = float(os.getenv("KEYCLOAK_TOKEN_REFRESH_JITTER", "10"))
+# A failed refresh is retried after RETRY, 2*RETRY, 4*RETRY ... seconds (capped, with jitter)
+TOKEN_REFRESH_RETRY = float(os.getenv("KEYCLOAK_TOKEN_REFRESH_RETRY", "5"))
+TOKEN_REFRESH_MAX_RETRY = float(os.getenv("KEYCLOAK_TOKEN_REFRESH_MAX_RETRY", "300"))
+# Upper bound on how long the scheduler sleeps, so new sessions are picked up
+MAX_IDLE_WAIT = 60
+
+
+def apply_tokens(session: state.Session, tokens: Dict[str, Any], now: Optional[int] = None):
+    """Store a token response from get_token/refresh_access_token in the session."""
+    now = int(time.time()) if now is None else now
+    expires_in = int(tokens.get("expires_in", 300))
+    with session.lock:
+        session.access_token = tokens["access_token"]
+        session.refresh_token = tokens.get("refresh_token")
+        session.access_expires_at = now + expires_in
+        session.refresh_expires_at = now + int(tokens.get("refresh_expires_in", 1800))
+        lead = min(TOKEN_REFRESH_LEAD + random.uniform(0, TOKEN_REFRESH_JITTER), expires_in / 2)
+        session.refresh_due_at = session.access_expires_at - lead
+        session.refresh_failures = 0
+
+
+def retry_delay(failures: int) -> float:
+    """Seconds before the next attempt after the given number of consecutive failures."""
+    backoff = min(TOKEN_REFRESH_RETRY * 2 ** min(failures - 1, 30), TOKEN_REFRESH_MAX_RETRY)
+    # jitter over the upper half, so sessions that failed together do not retry in lockstep
+    return random.uniform(backoff / 2, backoff)
+
+
+class TokenRefresher:
+    """
+    Renews access tokens of every session ahead of expiry on one daemon thread.
+
+    All refreshes (scheduled or requested by a tool call that found its token
+    expired) go through refresh_now(), which shares one in-flight Future per
+    session so Keycloak sees a single refresh_token grant at a time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._in_flight: Dict[str, Future] = {}
+        self._thread: Optional[threading.Thread] = None
+        self.next_refresh_at = 0.0
+        self.last_refresh_at = 0.0
+        self.refreshes = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="token-refresher", daemon=True)
+            self._thread.start()
+
+    def reschedule(self):
+        """Call after a session's tokens changed outside the refresher (e.g. a new login)."""
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            now = time.time()
+            refreshable = [
+                s for s in state.STORE.sessions()
+                if s.refresh_token and now < s.refresh_expires_at
+            ]
+            due = [s for s in refreshable if s.refresh_due_at <= now]
+            for s in due:
+                self.refresh_now(s)
+            pending = [s.refresh_due_at for s in refreshable if s.refresh_due_at > now]
+            self.next_refresh_at = min(pending) if pending else 0.0
+            delay = min(self.next_refresh_at - now, MAX_IDLE_WAIT) if pending else MAX_IDLE_WAIT
+            if due:
+                # refreshes still in flight: look again once they finish (see _do_refresh)
+                delay = min(delay, TOKEN_REFRESH_RETRY)
+            self._wake.wait(max(delay, 0.1))
+            self._wake.clear()
+
+    def _do_refresh(self, session: state.Session, future: Future):
+        try:
+            tokens = refresh_access_token(session.refresh_token)
+            apply_tokens(session, tokens)
+            self.last_refresh_at = time.time()
+            self.refreshes += 1
+            self.last_error = None
+            future.set_result(True)
+        except Exception as e:
+            self.failures += 1
+            self.last_error = str(e)
+            with session.lock:
+                session.refresh_failures += 1
+                retry_in = retry_delay(session.refresh_failures)
+                session.refresh_due_at = time.time() + retry_in
+            logger.warning(
+                "Access token refresh failed for %s (attempt %d, retry in %.0f s): %s",
+                session.username, session.refresh_failures, retry_in, e,
+            )
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._in_flight.pop(session.key, None)
+            self._wake.set()
+
+    def refresh_now(self, session: state.Session) -> Future:
+        """Start a refresh of the session's token, or join the one already running."""
+        with self._lock:
+            future = self._in_flight.get(session.key)
+            if future is not None:
+                return future
+            future = self._in_flight[session.key] = Future()
+        threading.Thread(target=self._do_refresh, args=(session, future), name="token-refresh", daemon=True).start()
+        return future
+
+    def status(self, session: Optional[state.Session] = None) -> Dict[str, Any]:
+        now = time.time()
+        out = {
+            "running": self._thread is not None,
+            "in_flight": len(self._in_flight),
+            "next_refresh_in": max(0, int(self.next_refresh_at - now)) if self.next_refresh_at else None,
+            "last_refresh_at": int(self.last_refresh_at) or None,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+        if session is not None:
+            out["session"] = session.describe()
+        return out
+
+
+REFRESHER = TokenRefresher()
@@ -0,0 +1,203 @@
+import logging
+import os
+from typing import Dict, Any, List, Optional, Tuple, Union
+
+import db_pool
+import metrics
+from result_cache import invalidate_tables, is_read_only
+from tools.mssql_insert import smart_parse_json
+from tools.mssql_query import QUERY_MAX_BYTES, QUERY_MAX_ROWS, QUERY_TIMEOUT, RESULT_FORMATS, _ResultShape, \
+    _cancel_quietly, _fetch_limited
+
+logger = logging.getLogger(__name__)
+
+BATCH_MAX_OPS = int(os.getenv("MSSQL_BATCH_MAX_OPS", "500"))
+
+# mode="atomic": one transaction, rolled back on the first failure (later ops are skipped)
+# mode="continue": one transaction, a failed statement is rolled back by SQL Server and
+#                  the rest still run and commit together (unless the failure doomed it)
+BATCH_MODES = ("atomic", "continue")
+
+OPERATIONS = ("insert", "update", "delete", "query")
+
+
+def _object(op: Dict[str, Any], key: str) -> Dict[str, Any]:
+    value = smart_parse_json(op.get(key))
+    if not isinstance(value, dict) or not value:
+        raise ValueError(f"'{key}' must be a non-empty JSON object")
+    return value
+
+
+def _statement(op: Dict[str, Any]) -> Tuple[str, List[Any], Optional[str]]:
+    """(sql, params, written table) for one operation; built like the single-row tools do."""
+    kind = op.get("op")
+    if kind not in OPERATIONS:
+        raise ValueError(f"Unknown op '{kind}'. Use one of {list(OPERATIONS)}")
+    if kind == "query":
+        query = op.get("query")
+        if not isinstance(query, str) or not query.strip():
+            raise ValueError("'query' must be a SQL string")
+        params = smart_parse_json(op.get("params"))
+        if params is None:
+            params = []
+        elif not isinstance(params, list):
+            params = [params]
+        return query, params, None
+
+    table = op.get("table")
+    if not isinstance(table, str) or not table.strip():
+        raise ValueError("'table' is required")
+    if kind == "insert":
+        data = _object(op, "data")
+        columns = ", ".join([f"[{k}]" for k in data.keys()])
+        placeholders = ", ".join(["?" for _ in data])
+        return f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", list(data.values()), table
+    if kind == "update":
+        data = _object(op, "data")
+        condition = _object(op, "condition")
+        set_clause = ", ".join([f"[{k}] = ?" for k in data.keys()])
+        where_clause = " AND ".join([f"[{k}] = ?" for k in condition.keys()])
+        sql = f"UPDATE {table} SET {set_clause} WHERE {where_clause}"
+        return sql, list(data.values()) + list(condition.values()), table
+    condition = _object(op, "condition")
+    where_clause = " AND ".join([f"[{k}] = ?" for k in condition.keys()])
+    return f"DELETE FROM {table} WHERE {where_clause}", list(condition.values()), table
+
+
+def _xact_state(cur) -> int:
+    """1 = transaction open and committable, -1 = doomed, 0 = none (rolled back by the server)."""
+    cur.execute("SELECT XACT_STATE()")
+    row = cur.fetchone()
+    return int(row[0]) if row else 0
+
+
+def run_batch(
+    operations: Union[str, List[Dict[str, Any]]],
+    db_name: str = "default",
+    mode: str = "atomic",
+    fmt: str = "rows",
+) -> Dict[str, Any]:
+    """
+    Run an ordered list of insert/update/delete/query operations on one
+    connection inside one transaction, committed once at the end.
+
+    Each operation is a JSON object with "op" plus the arguments of the
+    matching tool: {"op": "insert", "table", "data"}, {"op": "update",
+    "table", "data", "condition"}, {"op": "delete", "table", "condition"},
+    {"op": "query", "query", "params"}. See BATCH_MODES for error handling.
+
+    Statements run under MSSQL_QUERY_TIMEOUT, and each query result is capped
+    by MSSQL_QUERY_MAX_ROWS / MSSQL_QUERY_MAX_BYTES like run_query (the
+    operation's result then has "truncated" and "limit_hit").
+    """
+    from server import get_conn, release_conn
+
+    operations = smart_parse_json(operations)
+    if isinstance(operations, dict):
+        operations = [operations]
+    if not isinstance(operations, list) or not all(isinstance(o, dict) for o in operations):
+        return {"status": "error", "reason": "'operations' must be a list of JSON objects"}
+    if not operations:
+        return {"status": "error", "reason": "'operations' is empty"}
+    if len(operations) > BATCH_MAX_OPS:
+        return {"status": "error", "reason": f"At most {BATCH_MAX_OPS} operations per batch"}
+    if mode not in BATCH_MODES:
+        return {"status": "error", "reason": f"Unknown mode '{mode}'. Use one of {list(BATCH_MODES)}"}
+    fmt = fmt or "rows"
+    if fmt not in RESULT_FORMATS:
+        return {"status": "error", "reason": f"Unknown format '{fmt}'. Use one of {list(RESULT_FORMATS)}"}
+
+    conn = None
+    cur = None
+    try:
+        conn = get_conn(db_name)
+        # Statement timeout for every operation; reset on release
+        conn.timeout = QUERY_TIMEOUT
+        cur = conn.cursor()
+
+        results: List[Dict[str, Any]] = []
+        written = set()
+        pending_writes = 0
+        failed = 0
+        aborted = None
+        for index, op in enumerate(operations):
+            kind = op.get("op")
+            if aborted is not None:
+                results.append({"index": index, "op": kind, "status": "skipped"})
+                continue
+            try:
+                sql, params, table = _statement(op)
+                metrics.note_sql(sql)
+                with metrics.span("execute"):
+                    if params:
+                        cur.execute(sql, params)
+                    else:
+                        cur.execute(sql)
+                writes = kind != "query" or not is_read_only(sql)
+                if cur.description:
+                    shape = _ResultShape(cur.description, fmt)
+                    with metrics.span("fetch"):
+                        rows, limit = _fetch_limited(cur, shape, QUERY_MAX_ROWS, QUERY_MAX_BYTES)
+                    metrics.note_rows(len(rows))
+                    results.append({"index": index, "op": kind, "status": "success", "row_count": len(rows),
+                                    **shape.build(rows)})
+                    if limit:
+                        _cancel_quietly(cur)
+                        results[-1]["truncated"] = True
+                        results[-1]["limit_hit"] = limit
+                else:
+                    results.append({"index": index, "op": kind, "status": "success", "rows_affected": cur.rowcount})
+                if writes:
+                    # DML (including OUTPUT / EXEC sent through a query op) stays pending until the commit
+                    results[-1]["pending"] = True
+                    pending_writes += 1
+                    written.add(table or sql)
+            except Exception as e:
+                failed += 1
+                logger.warning("Batch op %d (%s) failed: %s", index, kind, e)
+                results.append({"index": index, "op": kind, "status": "error", "reason": str(e)})
+                if mode == "atomic":
+                    aborted = f"Operation {index} failed; transaction rolled back"
+                    continue
+                try:
+                    state = _xact_state(cur)
+                except Exception:
+                    state = -1
+                if state == -1 or (state == 0 and pending_writes):
+                    aborted = f"Operation {index} failed and ended the transaction; it was rolled back"
+
+        if aborted is not None:
+            conn.rollback()
+            for r in results:
+                if r.pop("pending", False):
+                    r["status"] = "rolled_back"
+            return {"status": "error", "reason": aborted, "committed": False, "results": results}
+
+        with metrics.span("commit"):
+            conn.commit()
+        for r in results:
+            r.pop("pending", None)
+        if written:
+            invalidate_tables(db_name, *written)
+        return {
+            "status": "success" if not failed else "partial",
+            "committed": True,
+            "operations": len(operations),
+            "failed": failed,
+            "results": results,
+        }
+    except Exception as e:
+        logger.exception("Batch failed")
+        return {"status": "error", "reason": str(e), "committed": False}
+    finally:
+        try:
+            if cur:
+                cur.close()
+        except:
+            pass
+        try:
+            if conn:
+                release_conn(conn, discard=any(db_pool.changes_session(o.get("query")) for o in operations
+                                               if isinstance(o.get("query"), str)))
+        except:
+            pass
@@ -0,0 +1,249 @@
+import json
+import logging
+import os
+from typing import Dict, Any, List, Optional, Tuple, Union
+
+import metrics
+from result_cache import invalidate_tables
+from tools.mssql_insert import BULK_BATCH_SIZE, parse_bulk_rows, smart_parse_json
+
+logger = logging.getLogger(__name__)
+
+# Unmatched keys listed in a result (the count is always complete)
+BULK_UNMATCHED_LIMIT = int(os.getenv("MSSQL_BULK_UNMATCHED_LIMIT", "1000"))
+
+_STAGE = "#mcp_stage_{}"
+
+
+def _parse_pairs(rows) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """Accept [{"data": {...}, "condition": {...}}, ...] or [[data, condition], ...]."""
+    rows = smart_parse_json(rows)
+    if isinstance(rows, dict):
+        rows = [rows]
+    if not isinstance(rows, list):
+        raise ValueError("'updates' must be a JSON array")
+    pairs = []
+    for item in rows:
+        item = smart_parse_json(item)
+        if isinstance(item, dict):
+            data, condition = item.get("data"), item.get("condition")
+        elif isinstance(item, (list, tuple)) and len(item) == 2:
+            data, condition = item
+        else:
+            raise ValueError("Each update must be {\"data\": {...}, \"condition\": {...}} or [data, condition]")
+        if not isinstance(data, dict) or not data or not isinstance(condition, dict) or not condition:
+            raise ValueError("'data' and 'condition' must be non-empty JSON objects")
+        pairs.append((data, condition))
+    return pairs
+
+
+def _stage_sql(name: str, table: str, key_cols: List[str], data_cols: List[str]) -> str:
+    """
+    Empty temp table with the key/value columns typed like the target table.
+    The join keeps SELECT INTO from copying an IDENTITY property onto the stage.
+    """
+    cols = ["CAST(0 AS int) AS [row_no]"]
+    cols += [f"t.[{c}] AS [k{i}]" for i, c in enumerate(key_cols)]
+    cols += [f"t.[{c}] AS [v{i}]" for i, c in enumerate(data_cols)]
+    return (
+        f"SELECT TOP 0 {', '.join(cols)} INTO {name} "
+        f"FROM {table} AS t CROSS JOIN (SELECT 1 AS one) AS j"
+    )
+
+
+def _join(key_cols: List[str]) -> str:
+    return " AND ".join(f"t.[{c}] = s.[k{i}]" for i, c in enumerate(key_cols))
+
+
+def _apply_keyed(
+    kind: str,
+    table: str,
+    entries: List[Tuple[Dict[str, Any], Dict[str, Any]]],
+    db_name: str,
+    batch_size: Optional[int],
+    commit: str,
+) -> Dict[str, Any]:
+    """
+    Stage (condition, data) entries in temp tables and apply them with one
+    joined UPDATE/DELETE per chunk; keys with no matching row are reported.
+    """
+    from server import get_conn, release_conn
+
+    if commit not in ("batch", "call"):
+        return {"status": "error", "reason": "'commit' must be 'batch' or 'call'"}
+
+    # One stage per distinct column shape, keeping the input order inside each
+    groups: Dict[Tuple[tuple, tuple], List[int]] = {}
+    for index, (data, condition) in enumerate(entries):
+        groups.setdefault((tuple(condition), tuple(data)), []).append(index)
+    # A joined UPDATE applies an arbitrary one of several stage rows with the same key:
+    # keep only the last, as one update_row call after another would
+    duplicates = 0
+    for (key_cols, _), indexes in groups.items():
+        last = {json.dumps([entries[i][1][c] for c in key_cols], default=str): i for i in indexes}
+        if len(last) < len(indexes):
+            duplicates += len(indexes) - len(last)
+            indexes[:] = sorted(last.values())
+
+    size = max(1, int(batch_size or BULK_BATCH_SIZE))
+    conn = None
+    cur = None
+    stages: List[str] = []
+    discard = False
+    try:
+        conn = get_conn(db_name)
+        cur = conn.cursor()
+        cur.fast_executemany = True
+
+        plans = []
+        for n, ((key_cols, data_cols), indexes) in enumerate(groups.items()):
+            name = _STAGE.format(n)
+            cur.execute(f"IF OBJECT_ID('tempdb..{name}') IS NOT NULL DROP TABLE {name}")
+            cur.execute(_stage_sql(name, table, list(key_cols), list(data_cols)))
+            stages.append(name)
+            columns = ["[row_no]"] + [f"[k{i}]" for i in range(len(key_cols))] + [f"[v{i}]" for i in range(len(data_cols))]
+            insert_sql = f"INSERT INTO {name} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+            unmatched_sql = (
+                f"SELECT s.[row_no] FROM {name} AS s "
+                f"WHERE NOT EXISTS (SELECT 1 FROM {table} AS t WHERE {_join(list(key_cols))})"
+            )
+            if kind == "update":
+                set_clause = ", ".join(f"t.[{c}] = s.[v{i}]" for i, c in enumerate(data_cols))
+                apply_sql = f"UPDATE t SET {set_clause} FROM {table} AS t JOIN {name} AS s ON {_join(list(key_cols))}"
+            else:
+                apply_sql = f"DELETE t FROM {table} AS t JOIN {name} AS s ON {_join(list(key_cols))}"
+            plans.append((name, key_cols, data_cols, indexes, insert_sql, unmatched_sql, apply_sql))
+        # Stages must outlive a rolled-back chunk
+        conn.commit()
+
+        affected = 0
+        unmatched: List[int] = []
+        failed_batches = []
+        batch_no = 0
+        for name, key_cols, data_cols, indexes, insert_sql, unmatched_sql, apply_sql in plans:
+            metrics.note_sql(apply_sql)
+            for start in range(0, len(indexes), size):
+                chunk = indexes[start:start + size]
+                index = batch_no
+                batch_no += 1
+                try:
+                    values = [
+                        (i, *(entries[i][1][c] for c in key_cols), *(entries[i][0][c] for c in data_cols))
+                        for i in chunk
+                    ]
+                    with metrics.span("execute"):
+                        cur.execute(f"TRUNCATE TABLE {name}")
+                        cur.executemany(insert_sql, values)
+                        cur.execute(unmatched_sql)
+                        missing = [row[0] for row in cur.fetchall()]
+                        cur.execute(apply_sql)
+                        count = cur.rowcount
+                    if commit == "batch":
+                        with metrics.span("commit"):
+                            conn.commit()
+                    affected += max(count, 0)
+                    unmatched += missing
+                except Exception as e:
+                    conn.rollback()
+                    logger.warning("Bulk %s batch %d on %s failed: %s", kind, index, table, e)
+                    failed_batches.append({"batch": index, "first_row": chunk[0], "rows": len(chunk), "reason": str(e)})
+                    if commit == "call":
+                        return {
+                            "status": "error",
+                            "reason": f"Batch {index} failed; transaction rolled back",
+                            "rows_affected": 0,
+                            "failed_batches": failed_batches,
+                        }
+        if commit == "call":
+            with metrics.span("commit"):
+                conn.commit()
+        if affected:
+            invalidate_tables(db_name, table)
+
+        unmatched.sort()
+        if not failed_batches:
+            status = "success"
+        else:
+            status = "partial" if len(failed_batches) < batch_no else "error"
+        return {
+            "status": status,
+            "action": f"bulk_{kind}",
+            "table": table,
+            "rows_affected": affected,
+            "batches": batch_no,
+            "failed_batches": failed_batches,
+            "duplicate_keys": duplicates,
+            "unmatched_count": len(unmatched),
+            "unmatched": [entries[i][1] for i in unmatched[:BULK_UNMATCHED_LIMIT]],
+        }
+    except Exception as e:
+        logger.exception("Bulk %s failed", kind)
+        return {"status": "error", "reason": str(e)}
+    finally:
+        if conn and stages:
+            # Temp tables live as long as the pooled connection; drop them now
+            try:
+                conn.rollback()
+                for name in stages:
+                    cur.execute(f"IF OBJECT_ID('tempdb..{name}') IS NOT NULL DROP TABLE {name}")
+                conn.commit()
+            except Exception:
+                logger.warning("Could not drop bulk %s stage tables; closing the connection", kind)
+                discard = True
+        try:
+            if cur:
+                cur.close()
+        except:
+            pass
+        try:
+            if conn:
+                release_conn(conn, discard=discard)
+        except:
+            pass
+
+
+def bulk_update_rows(
+    table: str,
+    updates: Union[str, List[Any]],
+    db_name: str = "default",
+    batch_size: Optional[int] = None,
+    commit: str = "batch",
+) -> Dict[str, Any]:
+    """
+    Apply many (data, condition) updates with one joined UPDATE per batch_size rows.
+
+    commit="batch" commits after every batch and skips failed ones (reported in
+    failed_batches); commit="call" runs everything in one transaction. Conditions
+    that matched no row are returned in unmatched. Of several updates with the
+    same condition columns and values only the last is applied.
+    """
+    try:
+        entries = _parse_pairs(updates)
+    except Exception as e:
+        return {"status": "error", "reason": str(e)}
+    if not entries:
+        return {"status": "success", "message": "No rows to update", "rows_affected": 0, "unmatched": []}
+    return _apply_keyed("update", table, entries, db_name, batch_size, commit)
+
+
+def bulk_delete_rows(
+    table: str,
+    keys: Union[str, List[Dict[str, Any]]],
+    db_name: str = "default",
+    fmt: Optional[str] = None,
+    batch_size: Optional[int] = None,
+    commit: str = "batch",
+) -> Dict[str, Any]:
+    """
+    Delete the rows matching each key dict (JSON array, JSON-lines or CSV, see
+    parse_bulk_rows) with one joined DELETE per batch_size keys.
+    """
+    try:
+        records = parse_bulk_rows(keys, fmt)
+    except Exception as e:
+        return {"status": "error", "reason": str(e)}
+    if not records:
+        return {"status": "success", "message": "No rows to delete", "rows_affected": 0, "unmatched": []}
+    if not all(records):
+        return {"status": "error", "reason": "Every key must be a non-empty JSON object"}
+    return _apply_keyed("delete", table, [({}, k) for k in records], db_name, batch_size, commit)
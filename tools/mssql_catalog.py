@@ -0,0 +1,274 @@
+import fnmatch
+import logging
+import os
+import time
+from typing import Dict, Any, List, Optional, Tuple, Union
+
+import metrics
+from tools.mssql_schema import SCHEMA_PROBE_INTERVAL, _get_catalog
+
+logger = logging.getLogger(__name__)
+
+# Tables described per call; the rest are counted and reported as truncated
+CATALOG_MAX_TABLES = int(os.getenv("MSSQL_CATALOG_MAX_TABLES", "2000"))
+
+SECTIONS = ("columns", "keys", "indexes", "rows")
+# Order of the values in each entry of a table's "columns"
+COLUMN_FIELDS = ["name", "type", "nullable", "default"]
+
+# {filter} narrows by schema/table name (LIKE patterns, see _like)
+_INDEXES_SQL = """
+    SELECT i.object_id, i.name, i.type_desc, i.is_primary_key, i.is_unique,
+           c.name, ic.key_ordinal, ic.is_included_column, ic.is_descending_key
+    FROM sys.indexes i
+    JOIN sys.objects o ON o.object_id = i.object_id
+    JOIN sys.schemas s ON s.schema_id = o.schema_id
+    JOIN sys.index_columns ic ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+    JOIN sys.columns c ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+    WHERE o.type IN ('U', 'V') AND i.index_id > 0 AND i.is_hypothetical = 0{filter}
+    ORDER BY i.object_id, i.index_id, ic.is_included_column, ic.key_ordinal, ic.index_column_id
+"""
+
+_FOREIGN_KEYS_SQL = """
+    SELECT fk.parent_object_id, fk.name, rs.name, ro.name, pc.name, rc.name,
+           fk.delete_referential_action_desc, fk.update_referential_action_desc
+    FROM sys.foreign_keys fk
+    JOIN sys.objects o ON o.object_id = fk.parent_object_id
+    JOIN sys.schemas s ON s.schema_id = o.schema_id
+    JOIN sys.objects ro ON ro.object_id = fk.referenced_object_id
+    JOIN sys.schemas rs ON rs.schema_id = ro.schema_id
+    JOIN sys.foreign_key_columns fkc ON fkc.constraint_object_id = fk.object_id
+    JOIN sys.columns pc ON pc.object_id = fkc.parent_object_id AND pc.column_id = fkc.parent_column_id
+    JOIN sys.columns rc ON rc.object_id = fkc.referenced_object_id AND rc.column_id = fkc.referenced_column_id
+    WHERE 1 = 1{filter}
+    ORDER BY fk.parent_object_id, fk.object_id, fkc.constraint_column_id
+"""
+
+# Heap (0) or clustered index (1) rows only; reserved pages include every index and LOB
+_ROW_COUNTS_SQL = """
+    SELECT p.object_id,
+           SUM(CASE WHEN p.index_id IN (0, 1) THEN p.row_count ELSE 0 END),
+           SUM(p.reserved_page_count) * 8
+    FROM sys.dm_db_partition_stats p
+    JOIN sys.objects o ON o.object_id = p.object_id
+    JOIN sys.schemas s ON s.schema_id = o.schema_id
+    WHERE o.type IN ('U', 'V'){filter}
+    GROUP BY p.object_id
+"""
+
+# Without VIEW DATABASE STATE: row counts from sys.partitions, no sizes
+_ROW_COUNTS_FALLBACK_SQL = """
+    SELECT p.object_id, SUM(p.rows), NULL
+    FROM sys.partitions p
+    JOIN sys.objects o ON o.object_id = p.object_id
+    JOIN sys.schemas s ON s.schema_id = o.schema_id
+    WHERE o.type IN ('U', 'V') AND p.index_id IN (0, 1){filter}
+    GROUP BY p.object_id
+"""
+
+
+def _like(pattern: str) -> str:
+    """Glob ("Order*", "tmp_?") to a LIKE pattern, escaping LIKE's own wildcards."""
+    out = []
+    for ch in pattern:
+        if ch == "*":
+            out.append("%")
+        elif ch == "?":
+            out.append("_")
+        elif ch in "%_[":
+            out.append(f"[{ch}]")
+        else:
+            out.append(ch)
+    return "".join(out)
+
+
+def _filter(schema: Optional[str], name: Optional[str]) -> Tuple[str, List[str]]:
+    sql, params = "", []
+    if schema:
+        sql += " AND s.name LIKE ?"
+        params.append(_like(schema))
+    if name:
+        sql += " AND o.name LIKE ?"
+        params.append(_like(name))
+    return sql, params
+
+
+def _matches(table: Dict[str, Any], schema: Optional[str], name: Optional[str]) -> bool:
+    # Case-insensitive like the default SQL Server collations
+    if schema and not fnmatch.fnmatch(table["schema"].lower(), schema.lower()):
+        return False
+    if name and not fnmatch.fnmatch(table["name"].lower(), name.lower()):
+        return False
+    return True
+
+
+def _sections(include: Union[None, str, List[str]]) -> List[str]:
+    if include is None:
+        return list(SECTIONS)
+    parts = include.split(",") if isinstance(include, str) else list(include)
+    parts = [str(p).strip() for p in parts if str(p).strip()]
+    unknown = [p for p in parts if p not in SECTIONS]
+    if unknown:
+        raise ValueError(f"Unknown sections {unknown}. Use any of {list(SECTIONS)}")
+    return parts
+
+
+def _read_indexes(cur, where: str, params: List[str]) -> Dict[int, Dict[str, Any]]:
+    """object_id -> {"pk": [...], "indexes": [...]}; the primary key is not repeated in indexes."""
+    cur.execute(_INDEXES_SQL.format(filter=where), *params)
+    found: Dict[int, Dict[str, Any]] = {}
+    current = None
+    for oid, name, kind, is_pk, unique, col, _, included, desc in cur.fetchall():
+        entry = found.setdefault(oid, {"pk": None, "indexes": []})
+        if current is None or current[0] != (oid, name):
+            index = {"name": name, "type": kind.lower(), "unique": bool(unique), "columns": []}
+            current = ((oid, name), index)
+            if is_pk:
+                index["pk"] = True
+                entry["pk"] = index["columns"]
+            entry["indexes"].append(index)
+        index = current[1]
+        if included:
+            index.setdefault("include", []).append(col)
+        else:
+            index["columns"].append(f"{col} DESC" if desc else col)
+    for entry in found.values():
+        entry["indexes"] = [i for i in entry["indexes"] if not i.pop("pk", False)]
+    return found
+
+
+def _read_foreign_keys(cur, where: str, params: List[str]) -> Dict[int, List[Dict[str, Any]]]:
+    cur.execute(_FOREIGN_KEYS_SQL.format(filter=where), *params)
+    found: Dict[int, List[Dict[str, Any]]] = {}
+    for oid, name, ref_schema, ref_table, col, ref_col, on_delete, on_update in cur.fetchall():
+        fks = found.setdefault(oid, [])
+        if not fks or fks[-1]["name"] != name:
+            fk = {"name": name, "columns": [], "references": f"{ref_schema}.{ref_table}", "ref_columns": []}
+            # Only non-default actions are listed
+            if on_delete != "NO_ACTION":
+                fk["on_delete"] = on_delete.lower()
+            if on_update != "NO_ACTION":
+                fk["on_update"] = on_update.lower()
+            fks.append(fk)
+        fks[-1]["columns"].append(col)
+        fks[-1]["ref_columns"].append(ref_col)
+    return found
+
+
+def _read_row_counts(cur, where: str, params: List[str]) -> Tuple[Dict[int, Tuple[int, Optional[int]]], str]:
+    """object_id -> (rows, reserved KB) and the source used."""
+    try:
+        cur.execute(_ROW_COUNTS_SQL.format(filter=where), *params)
+        source = "sys.dm_db_partition_stats"
+    except Exception as e:
+        logger.info("dm_db_partition_stats unavailable (%s); falling back to sys.partitions", e)
+        cur.execute(_ROW_COUNTS_FALLBACK_SQL.format(filter=where), *params)
+        source = "sys.partitions"
+    return {oid: (int(rows or 0), size) for oid, rows, size in cur.fetchall()}, source
+
+
+def describe_database(
+    db_name: str = "default",
+    schema: Optional[str] = None,
+    name: Optional[str] = None,
+    include: Union[None, str, List[str]] = None,
+) -> Dict[str, Any]:
+    """
+    Describe every table and view of a database in one call: columns, primary
+    key, foreign keys, indexes and approximate row counts / reserved size.
+
+    Columns come from the cached schema catalog (see SchemaCatalog); keys,
+    indexes and row counts take one set-based query each. schema and name are
+    glob patterns ("sales", "Order*"). include limits the sections returned
+    (see SECTIONS). Column entries are [name, type, nullable, default] arrays
+    (see COLUMN_FIELDS); empty sections are left out of a table's entry.
+    """
+    from server import get_conn, release_conn
+
+    try:
+        sections = _sections(include)
+    except ValueError as e:
+        return {"status": "error", "reason": str(e)}
+
+    conn = None
+    cur = None
+    try:
+        catalog = _get_catalog(db_name)
+        conn = get_conn(db_name, read_only=True)
+        cur = conn.cursor()
+        with catalog.lock:
+            if not catalog.loaded_at or time.monotonic() - catalog.checked_at >= SCHEMA_PROBE_INTERVAL:
+                with metrics.span("catalog_refresh"):
+                    catalog.refresh(cur)
+            selected = sorted(
+                ((oid, t) for oid, t in catalog.tables.items() if _matches(t, schema, name)),
+                key=lambda item: (item[1]["schema"].lower(), item[1]["name"].lower()),
+            )
+        total = len(selected)
+        if CATALOG_MAX_TABLES and total > CATALOG_MAX_TABLES:
+            selected = selected[:CATALOG_MAX_TABLES]
+
+        where, params = _filter(schema, name)
+        indexes: Dict[int, Dict[str, Any]] = {}
+        foreign_keys: Dict[int, List[Dict[str, Any]]] = {}
+        counts: Dict[int, Tuple[int, Optional[int]]] = {}
+        source = None
+        with metrics.span("execute"):
+            if "keys" in sections or "indexes" in sections:
+                indexes = _read_indexes(cur, where, params)
+            if "keys" in sections:
+                foreign_keys = _read_foreign_keys(cur, where, params)
+            if "rows" in sections:
+                counts, source = _read_row_counts(cur, where, params)
+
+        tables = []
+        for oid, t in selected:
+            entry: Dict[str, Any] = {"name": f"{t['schema']}.{t['name']}"}
+            if "rows" in sections and oid in counts:
+                entry["rows"], size = counts[oid]
+                if size is not None:
+                    entry["reserved_kb"] = int(size)
+            if "columns" in sections:
+                entry["columns"] = [
+                    [c["COLUMN_NAME"], c["DATA_TYPE"], c["IS_NULLABLE"] == "YES", c["COLUMN_DEFAULT"]]
+                    for c in t["columns"]
+                ]
+            if "keys" in sections:
+                pk = indexes.get(oid, {}).get("pk")
+                if pk:
+                    entry["pk"] = pk
+                if foreign_keys.get(oid):
+                    entry["fks"] = foreign_keys[oid]
+            if "indexes" in sections and indexes.get(oid, {}).get("indexes"):
+                entry["indexes"] = indexes[oid]["indexes"]
+            tables.append(entry)
+        metrics.note_rows(len(tables))
+
+        result: Dict[str, Any] = {
+            "status": "success",
+            "db_name": db_name,
+            "table_count": total,
+            "tables": tables,
+        }
+        if "columns" in sections:
+            result["column_fields"] = COLUMN_FIELDS
+        if source:
+            result["row_count_source"] = source
+        if len(tables) < total:
+            result["truncated"] = True
+            result["limit"] = CATALOG_MAX_TABLES
+        return result
+    except Exception as e:
+        logger.exception("Catalog introspection failed")
+        return {"status": "error", "reason": str(e)}
+    finally:
+        try:
+            if cur:
+                cur.close()
+        except:
+            pass
+        try:
+            if conn:
+                release_conn(conn)
+        except:
+            pass
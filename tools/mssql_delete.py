@@ -2,6 +2,9 @@ import json
 import logging
 from typing import Dict, Any, Union
 
+import metrics
+from result_cache import invalidate_tables
+
 logger = logging.getLogger(__name__)
 
 def smart_parse_json(data):
@@ -23,7 +26,7 @@ def delete_row(
     """
     Delete row(s) from the specified table in the chosen database.
     """
-    from server import get_conn
+    from server import get_conn, release_conn
 
     db_conn = cursor = None
     try:
@@ -38,8 +41,12 @@ def delete_row(
         sql = f"DELETE FROM {table} WHERE {where_clause}"
         values = list(condition.values())
 
-        cursor.execute(sql, values)
-        db_conn.commit()
+        metrics.note_sql(sql)
+        with metrics.span("execute"):
+            cursor.execute(sql, values)
+        with metrics.span("commit"):
+            db_conn.commit()
+        invalidate_tables(db_name, table)
 
         return {"status": "success", "action": "delete", "table": table, "rows_affected": cursor.rowcount}
 
@@ -54,6 +61,6 @@ def delete_row(
             pass
         try:
             if db_conn:
-                db_conn.close()
+                release_conn(db_conn)
         except:
             pass
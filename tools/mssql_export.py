@@ -0,0 +1,387 @@
+import csv
+import datetime
+import decimal
+import gzip
+import json
+import logging
+import os
+import hashlib
+import re
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+import db_pool
+import metrics
+import state
+from result_cache import is_read_only
+from tools.mssql_query import PAGE_MAX_ROWS, QUERY_TIMEOUT, RESULT_FORMATS, _ResultShape, _track
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional; gzip CSV always works
+    pa = pq = None
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DIR = os.getenv("MSSQL_EXPORT_DIR", os.path.join(os.getcwd(), "exports"))
+EXPORT_BATCH_ROWS = int(os.getenv("MSSQL_EXPORT_BATCH_ROWS", "10000"))
+# The MSSQL_QUERY_TIMEOUT guardrail unless set explicitly (e.g. higher for long exports)
+EXPORT_TIMEOUT = int(os.getenv("MSSQL_EXPORT_TIMEOUT", str(QUERY_TIMEOUT)))
+EXPORT_PARQUET_COMPRESSION = os.getenv("MSSQL_EXPORT_PARQUET_COMPRESSION", "zstd")
+# Retention across every user's exports (0 = no limit)
+EXPORT_MAX_AGE = float(os.getenv("MSSQL_EXPORT_MAX_AGE", str(24 * 3600)))
+EXPORT_MAX_BYTES = int(os.getenv("MSSQL_EXPORT_MAX_BYTES", str(10 * 1024 ** 3)))
+EXPORT_PRUNE_INTERVAL = 60
+
+EXPORT_FORMATS = ("parquet", "csv")
+_EXTENSIONS = {"parquet": ".parquet", "csv": ".csv.gz"}
+_EXPORT_ID = re.compile(r"^[0-9a-f]{32}$")
+_last_prune = 0.0
+# Column types recorded in the export metadata, by name
+_TYPES = {t.__name__: t for t in (bool, int, float, str, decimal.Decimal, datetime.datetime, datetime.date,
+                                  datetime.time, bytes, bytearray, uuid.UUID)}
+
+
+def _user_dir() -> str:
+    """Exports are kept per user; a user only sees their own directory (named by a hash of the username)."""
+    user = state.current().username or "anonymous"
+    return os.path.join(EXPORT_DIR, hashlib.sha256(user.encode("utf-8")).hexdigest())
+
+
+def _meta_path(export_id: str) -> str:
+    return os.path.join(_user_dir(), f"{export_id}.json")
+
+
+def _load_meta(export_id: str) -> Optional[Dict[str, Any]]:
+    if not _EXPORT_ID.match(export_id or ""):
+        return None
+    try:
+        with open(_meta_path(export_id), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _remove_export(meta_path: str, meta: Dict[str, Any]):
+    for path in (meta.get("path"), meta_path):
+        try:
+            if path:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def prune_exports(force: bool = False) -> int:
+    """
+    Delete exports older than MSSQL_EXPORT_MAX_AGE, then the oldest ones until
+    all of EXPORT_DIR fits in MSSQL_EXPORT_MAX_BYTES. Runs at most once per
+    EXPORT_PRUNE_INTERVAL unless forced. Returns how many were deleted.
+    """
+    global _last_prune
+    now = time.time()
+    if not force and now - _last_prune < EXPORT_PRUNE_INTERVAL:
+        return 0
+    _last_prune = now
+    if not os.path.isdir(EXPORT_DIR):
+        return 0
+
+    found = []  # (created, bytes, meta path, meta)
+    for user in os.listdir(EXPORT_DIR):
+        directory = os.path.join(EXPORT_DIR, user)
+        if not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            if not name.endswith(".json"):
+                continue
+            meta_path = os.path.join(directory, name)
+            try:
+                with open(meta_path, encoding="utf-8") as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            found.append((meta.get("created", 0), meta.get("bytes", 0), meta_path, meta))
+    found.sort(key=lambda e: e[0])
+
+    deleted = 0
+    total = sum(e[1] for e in found)
+    for created, size, meta_path, meta in found:
+        expired = EXPORT_MAX_AGE and created < now - EXPORT_MAX_AGE
+        if not expired and not (EXPORT_MAX_BYTES and total > EXPORT_MAX_BYTES):
+            continue
+        _remove_export(meta_path, meta)
+        total -= size
+        deleted += 1
+    if deleted:
+        logger.info("Pruned %d exports from %s", deleted, EXPORT_DIR)
+    return deleted
+
+
+# -------------------- WRITERS ------------------------
+def _arrow_type(desc):
+    """Arrow type for one pyodbc description entry (name, type, display, internal, precision, scale, null_ok)."""
+    typ, precision, scale = desc[1], desc[4], desc[5]
+    if typ is bool:
+        return pa.bool_()
+    if typ is int:
+        return pa.int64()
+    if typ is float:
+        return pa.float64()
+    if typ is decimal.Decimal and precision and precision <= 38:
+        return pa.decimal128(precision, scale or 0)
+    if typ is datetime.datetime:
+        return pa.timestamp("us")
+    if typ is datetime.date:
+        return pa.date32()
+    if typ is datetime.time:
+        return pa.time64("us")
+    if typ in (bytes, bytearray):
+        return pa.binary()
+    return pa.string()
+
+
+class _ParquetWriter:
+    """One row group per fetchmany() batch."""
+
+    def __init__(self, path: str, description):
+        self.names = [d[0] for d in description]
+        self.types = [_arrow_type(d) for d in description]
+        self.schema = pa.schema([pa.field(n, t) for n, t in zip(self.names, self.types)])
+        self.writer = pq.ParquetWriter(path, self.schema, compression=EXPORT_PARQUET_COMPRESSION)
+
+    def write(self, rows):
+        arrays = []
+        for i, typ in enumerate(self.types):
+            values = [r[i] for r in rows]
+            if typ == pa.string():
+                values = [v if v is None or isinstance(v, str) else str(v) for v in values]
+            elif typ == pa.binary():
+                values = [bytes(v) if v is not None else None for v in values]
+            arrays.append(pa.array(values, type=typ))
+        self.writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class _CsvWriter:
+    """gzip CSV with a header row; values encoded as in the compact result formats, NULL as empty."""
+
+    def __init__(self, path: str, description):
+        self.shape = _ResultShape(description, "columnar")
+        self.file = gzip.open(path, "wt", encoding="utf-8", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(self.shape.cols)
+
+    def write(self, rows):
+        self.writer.writerows(self.shape.prepare(r) for r in rows)
+
+    def close(self):
+        self.file.close()
+
+
+def run_export(
+    query: str,
+    params: Optional[List[Any]] = None,
+    db_name: str = "default",
+    fmt: str = "csv",
+    batch_rows: Optional[int] = None,
+    query_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Stream a query result into a compressed file under MSSQL_EXPORT_DIR.
+
+    Rows are pulled with fetchmany(batch_rows) and written batch by batch, so
+    memory stays flat whatever the result size. The file is written under a
+    temporary name and renamed once complete. Like run_query, the call can be
+    cancelled through its query_id while it runs.
+
+    Parquet needs pyarrow; without it a Parquet request is written as gzip CSV
+    and the result carries "requested_format". Old exports are pruned first
+    (see prune_exports).
+    """
+    from server import get_conn, release_conn
+
+    fmt = fmt or "csv"
+    if fmt not in EXPORT_FORMATS:
+        return {"status": "error", "reason": f"Unknown format '{fmt}'. Use one of {list(EXPORT_FORMATS)}"}
+    requested = fmt
+    if fmt == "parquet" and pa is None:
+        fmt = "csv"
+    try:
+        prune_exports()
+    except Exception as e:
+        logger.warning("Export pruning failed: %s", e)
+    batch = max(1, int(batch_rows or EXPORT_BATCH_ROWS))
+    export_id = uuid.uuid4().hex
+    directory = _user_dir()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, export_id + _EXTENSIONS[fmt])
+    partial = path + ".part"
+
+    conn = None
+    cur = None
+    writer = None
+    started = time.monotonic()
+    try:
+        conn = get_conn(db_name, read_only=is_read_only(query))
+        conn.timeout = EXPORT_TIMEOUT
+        cur = conn.cursor()
+        with _track(query_id or export_id, cur, db_name, query):
+            metrics.note_sql(query)
+            with metrics.span("execute"):
+                if params:
+                    cur.execute(query, params)
+                else:
+                    cur.execute(query)
+            if not cur.description:
+                return {"status": "error", "reason": "Statement returned no result set to export"}
+
+            description = cur.description
+            writer = _ParquetWriter(partial, description) if fmt == "parquet" else _CsvWriter(partial, description)
+            rows_written = 0
+            while True:
+                with metrics.span("fetch"):
+                    rows = cur.fetchmany(batch)
+                if not rows:
+                    break
+                with metrics.span("write"):
+                    writer.write(rows)
+                rows_written += len(rows)
+            writer.close()
+            writer = None
+            metrics.note_rows(rows_written)
+
+        os.replace(partial, path)
+        meta = {
+            "export_id": export_id,
+            "path": path,
+            "format": fmt,
+            "db_name": db_name,
+            "query": query,
+            "row_count": rows_written,
+            "bytes": os.path.getsize(path),
+            "schema": [{"name": d[0], "type": getattr(d[1], "__name__", str(d[1]))} for d in description],
+            "created": int(time.time()),
+            "seconds": round(time.monotonic() - started, 3),
+        }
+        with open(_meta_path(export_id), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        logger.info("Exported %d rows from %s to %s (%d bytes)", rows_written, db_name, path, meta["bytes"])
+        result = {"status": "success", **meta}
+        if requested != fmt:
+            result["requested_format"] = requested
+        return result
+    except Exception as e:
+        logger.exception("Export failed")
+        return {"status": "error", "reason": str(e)}
+    finally:
+        if writer is not None:
+            try:
+                writer.close()
+            except Exception:
+                pass
+        if os.path.exists(partial):
+            os.remove(partial)
+        try:
+            if cur:
+                cur.close()
+        except:
+            pass
+        try:
+            if conn:
+                release_conn(conn, discard=db_pool.changes_session(query))
+        except:
+            pass
+
+
+# -------------------- READ BACK ------------------------
+def _parquet_slice(path: str, offset: int, limit: int):
+    """Read only the row groups that overlap [offset, offset + limit)."""
+    pf = pq.ParquetFile(path)
+    names = pf.schema_arrow.names
+    rows: List[tuple] = []
+    start = 0
+    for i in range(pf.num_row_groups):
+        count = pf.metadata.row_group(i).num_rows
+        if start + count > offset and len(rows) < limit:
+            table = pf.read_row_group(i)
+            lo = max(0, offset - start)
+            part = table.slice(lo, limit - len(rows)).to_pydict()
+            rows.extend(zip(*(part[n] for n in names)))
+        start += count
+        if len(rows) >= limit:
+            break
+    return names, rows
+
+
+def _csv_slice(path: str, offset: int, limit: int):
+    with gzip.open(path, "rt", encoding="utf-8", newline="") as f:
+        reader = csv.reader(f)
+        names = next(reader, [])
+        rows = []
+        for n, row in enumerate(reader):
+            if n < offset:
+                continue
+            if len(rows) >= limit:
+                break
+            rows.append(tuple(v if v != "" else None for v in row))
+    return names, rows
+
+
+def read_export(export_id: str, offset: int = 0, limit: Optional[int] = None, fmt: str = "rows") -> Dict[str, Any]:
+    """Return rows [offset, offset + limit) of one of the caller's exports (limit capped by MSSQL_PAGE_MAX_ROWS)."""
+    meta = _load_meta(export_id)
+    if meta is None or not os.path.exists(meta["path"]):
+        return {"status": "error", "reason": f"Unknown export '{export_id}'"}
+    fmt = fmt or "rows"
+    if fmt not in RESULT_FORMATS:
+        return {"status": "error", "reason": f"Unknown format '{fmt}'. Use one of {list(RESULT_FORMATS)}"}
+    offset = max(0, int(offset or 0))
+    limit = max(1, min(int(limit), PAGE_MAX_ROWS) if limit else PAGE_MAX_ROWS)
+    try:
+        if meta["format"] == "parquet":
+            if pq is None:
+                return {"status": "error", "reason": "Reading Parquet exports needs the pyarrow package"}
+            names, rows = _parquet_slice(meta["path"], offset, limit)
+        else:
+            names, rows = _csv_slice(meta["path"], offset, limit)
+    except Exception as e:
+        logger.exception("Export read failed")
+        return {"status": "error", "reason": str(e)}
+
+    # CSV cells are already encoded strings; Parquet gives back typed values
+    types = {c["name"]: c["type"] for c in meta["schema"]} if meta["format"] == "parquet" else {}
+    description = [(n, _TYPES.get(types.get(n), str)) for n in names]
+    shape = _ResultShape(description, fmt)
+    prepared = [shape.prepare(r) for r in rows]
+    return {
+        "status": "success",
+        "export_id": export_id,
+        "offset": offset,
+        "row_count": len(prepared),
+        "total_rows": meta["row_count"],
+        "has_more": offset + len(prepared) < meta["row_count"],
+        **shape.build(prepared),
+    }
+
+
+def list_exports() -> Dict[str, Any]:
+    directory = _user_dir()
+    exports = []
+    if os.path.isdir(directory):
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".json"):
+                meta = _load_meta(name[:-5])
+                if meta is not None:
+                    exports.append({k: meta[k] for k in ("export_id", "format", "db_name", "row_count", "bytes", "created")})
+    return {"status": "success", "exports": exports}
+
+
+def delete_export(export_id: str) -> Dict[str, Any]:
+    meta = _load_meta(export_id)
+    if meta is None:
+        return {"status": "error", "reason": f"Unknown export '{export_id}'"}
+    _remove_export(_meta_path(export_id), meta)
+    return {"status": "success", "message": f"Export '{export_id}' deleted"}
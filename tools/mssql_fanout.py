@@ -0,0 +1,371 @@
+import contextvars
+import decimal
+import fnmatch
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import db_pool
+import metrics
+import state
+from executor import db_slot
+from result_cache import invalidate_tables, is_read_only
+from tools.mssql_query import (
+    FETCH_BATCH,
+    QUERY_MAX_BYTES,
+    QUERY_MAX_ROWS,
+    QUERY_TIMEOUT,
+    RESULT_FORMATS,
+    _cancel_quietly,
+    _cap,
+    _query_error,
+    _ResultShape,
+    _track,
+)
+
+logger = logging.getLogger(__name__)
+
+# Databases queried at once by one fan-out call (per-call values can only lower it)
+FANOUT_CONCURRENCY = int(os.getenv("MSSQL_FANOUT_CONCURRENCY", "8"))
+# Shared by every fan-out call; bounds the connections all of them hold together
+FANOUT_WORKERS = int(os.getenv("MSSQL_FANOUT_WORKERS", "32"))
+# Extra seconds past the statement timeout before a database's cursor is cancelled
+# (covers pool waits and fetches the ODBC timeout does not)
+FANOUT_GRACE = 5
+
+# "concat": every row, tagged with its database; "sum": numeric columns summed across
+# databases, grouped by the other columns; "count": row counts only
+AGGREGATES = ("concat", "sum", "count")
+
+_NUMERIC = (int, float, decimal.Decimal)
+_POOL = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="mssql-fanout")
+
+
+def _select_databases(databases: Union[None, str, List[str]]) -> Tuple[List[str], List[str]]:
+    """
+    (matched, unknown) database names for a list or comma separated string of
+    names and glob patterns ("tenant_*"); None or "*" means every database.
+    """
+    available = [d for d in state.current().db_creds if d != "default"]
+    if databases is None:
+        return available, []
+    patterns = databases.split(",") if isinstance(databases, str) else list(databases)
+    patterns = [str(p).strip() for p in patterns if str(p).strip()]
+    matched: List[str] = []
+    unknown: List[str] = []
+    for pattern in patterns or ["*"]:
+        if any(ch in pattern for ch in "*?["):
+            hits = [d for d in available if fnmatch.fnmatchcase(d, pattern)]
+        else:
+            hits = [pattern] if pattern in available else []
+            if not hits:
+                unknown.append(pattern)
+        matched += [d for d in hits if d not in matched]
+    return matched, unknown
+
+
+class _Budget:
+    """Row / byte allowance shared by every database of one fan-out call (0 = unlimited)."""
+
+    def __init__(self, rows: int, size: int):
+        self.max_rows = rows
+        self.max_size = size
+        self.used_rows = 0
+        self.used_size = 0
+        self.hit: Optional[str] = None  # "rows" / "bytes" once a row did not fit
+        self._lock = threading.Lock()
+
+    def _fits(self, rows: int, size: int) -> bool:
+        return (not self.max_rows or self.used_rows + rows <= self.max_rows) and \
+            (not self.max_size or self.used_size + size <= self.max_size)
+
+    def take(self, shape: _ResultShape, batch: List[Any]) -> int:
+        """Reserve room for batch; returns how many of its rows fit (fewer once the budget is used up)."""
+        size = len(json.dumps(batch, default=str)) + shape.name_overhead * len(batch) if self.max_size else 0
+        with self._lock:
+            if self.hit:
+                return 0
+            if self._fits(len(batch), size):
+                self.used_rows += len(batch)
+                self.used_size += size
+                return len(batch)
+            # The batch crosses a limit: count it row by row
+            taken = 0
+            for row in batch:
+                row_size = shape.size(row) if self.max_size else 0
+                if not self._fits(1, 0):
+                    self.hit = "rows"
+                    break
+                if not self._fits(1, row_size):
+                    self.hit = "bytes"
+                    break
+                self.used_rows += 1
+                self.used_size += row_size
+                taken += 1
+            return taken
+
+
+class _Task:
+    """One database's share of a fan-out call."""
+
+    def __init__(self, db_name: str):
+        self.db_name = db_name
+        self.started = None
+        self.cur = None
+        self.timed_out = False
+        self.skipped = False  # not run (or stopped) because the shared budget ran out
+        self.description = None
+        self.rows: List[Any] = []
+        self.limit = None
+        self.rows_affected = None
+        self.error = None
+        self.ms = None
+
+
+def _fetch_budgeted(task: _Task, cur, budget: _Budget):
+    # Raw values: sums need the numbers, encoding happens once after merging
+    shape = _ResultShape(cur.description, "rows")
+    while True:
+        batch = cur.fetchmany(FETCH_BATCH)
+        if not batch:
+            return
+        taken = budget.take(shape, batch)
+        task.rows.extend(batch[:taken])
+        if taken < len(batch):
+            task.limit = budget.hit
+            _cancel_quietly(cur)
+            return
+
+
+def _run_one(task: _Task, query: str, params: List[Any], timeout: int, budget: _Budget, query_id: str,
+             read_only: bool):
+    from server import get_conn, release_conn
+
+    task.started = time.monotonic()
+    conn = None
+    cur = None
+    entry = None
+    try:
+        creds = state.current().db_creds[task.db_name]
+        # Shares the per-database limit of tool calls (see executor.db_slot)
+        with db_slot(db_pool.pool_key(creds), db_pool.pool_label(creds)):
+            if budget.hit:
+                task.skipped = True
+                return
+            conn = get_conn(task.db_name, read_only=read_only)
+            conn.timeout = timeout
+            cur = task.cur = conn.cursor()
+            with _track(f"{query_id}:{task.db_name}", cur, task.db_name, query) as entry:
+                with metrics.span("execute"):
+                    if params:
+                        cur.execute(query, params)
+                    else:
+                        cur.execute(query)
+                if not read_only:
+                    invalidate_tables(task.db_name, query)
+                if cur.description:
+                    task.description = cur.description
+                    with metrics.span("fetch"):
+                        _fetch_budgeted(task, cur, budget)
+                    metrics.note_rows(len(task.rows))
+                else:
+                    task.rows_affected = cur.rowcount
+    except Exception as e:
+        if budget.hit:
+            # Cancelled because the budget ran out in another database
+            if task.description is not None:
+                task.limit = budget.hit
+            else:
+                task.skipped = True
+            return
+        task.error = "Query exceeded the fan-out deadline" if task.timed_out else _query_error(e, entry, timeout)
+        logger.warning("Fan-out query on %s failed: %s", task.db_name, task.error)
+    finally:
+        task.cur = None
+        task.ms = round((time.monotonic() - task.started) * 1000.0, 1)
+        try:
+            if cur:
+                cur.close()
+        except Exception:
+            pass
+        try:
+            if conn:
+                release_conn(conn, discard=db_pool.changes_session(query))
+        except Exception:
+            pass
+
+
+def _sum_rows(tasks: List[_Task], description) -> List[Any]:
+    """Numeric columns summed per distinct combination of the other columns, in first-seen order."""
+    numeric = [desc[1] in _NUMERIC and desc[1] is not bool for desc in description]
+    groups: Dict[tuple, list] = {}
+    for task in tasks:
+        for row in task.rows:
+            key = tuple(bytes(v) if isinstance(v, bytearray) else v for v, num in zip(row, numeric) if not num)
+            acc = groups.get(key)
+            if acc is None:
+                groups[key] = list(row)
+                continue
+            for i, num in enumerate(numeric):
+                if num and row[i] is not None:
+                    acc[i] = row[i] if acc[i] is None else acc[i] + row[i]
+    return list(groups.values())
+
+
+def run_fanout(
+    query: str,
+    params: Optional[List[Any]] = None,
+    databases: Union[None, str, List[str]] = None,
+    concurrency: Optional[int] = None,
+    timeout: Optional[int] = None,
+    aggregate: str = "concat",
+    fmt: str = "rows",
+    max_rows: Optional[int] = None,
+    query_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Run one parameterized query against many of the caller's databases in parallel.
+
+    databases is a list (or comma separated string) of names and glob patterns,
+    default every database. At most concurrency databases (capped by
+    MSSQL_FANOUT_CONCURRENCY) run at once; each gets timeout seconds (capped by
+    MSSQL_QUERY_TIMEOUT) and a failure or timeout in one does not stop the
+    others. Results are merged as selected by aggregate (see AGGREGATES), with
+    a per-database status list. While running, one database's statement can be
+    cancelled with cancel_query("<query_id>:<db_name>").
+
+    max_rows (capped by MSSQL_QUERY_MAX_ROWS) and MSSQL_QUERY_MAX_BYTES bound
+    the rows fetched from all databases together: once used up, running
+    statements are cancelled and databases not started yet are skipped.
+    """
+    fmt = fmt or "rows"
+    if fmt not in RESULT_FORMATS:
+        return {"status": "error", "reason": f"Unknown format '{fmt}'. Use one of {list(RESULT_FORMATS)}"}
+    aggregate = aggregate or "concat"
+    if aggregate not in AGGREGATES:
+        return {"status": "error", "reason": f"Unknown aggregate '{aggregate}'. Use one of {list(AGGREGATES)}"}
+    names, unknown = _select_databases(databases)
+    if unknown:
+        return {"status": "error", "reason": f"Unknown databases {unknown}. Available: "
+                                             f"{[d for d in state.current().db_creds if d != 'default']}"}
+    if not names:
+        return {"status": "error", "reason": f"No database matches {databases!r}"}
+
+    metrics.note_sql(query)
+    params = params or []
+    width = max(1, min(_cap(concurrency, FANOUT_CONCURRENCY) or len(names), len(names)))
+    timeout = _cap(timeout, QUERY_TIMEOUT)
+    row_limit = _cap(max_rows, QUERY_MAX_ROWS)
+    budget = _Budget(row_limit, QUERY_MAX_BYTES)
+    query_id = str(query_id) if query_id else uuid.uuid4().hex
+    deadline = timeout + FANOUT_GRACE if timeout else None
+    read_only = is_read_only(query)
+
+    tasks = [_Task(name) for name in names]
+    queue = list(reversed(tasks))
+    running: Dict[Any, _Task] = {}
+    started = time.monotonic()
+    while queue or running:
+        if budget.hit:
+            for task in queue:
+                task.skipped = True
+            queue = []
+        while queue and len(running) < width:
+            task = queue.pop()
+            # A context copy per task: each worker thread enters its own
+            ctx = contextvars.copy_context()
+            running[_POOL.submit(ctx.run, _run_one, task, query, params, timeout, budget, query_id,
+                                 read_only)] = task
+        if not running:
+            break
+        done, _ = wait(list(running), timeout=1.0 if deadline else None, return_when=FIRST_COMPLETED)
+        for future in done:
+            running.pop(future)
+        if budget.hit:
+            # Rows past the budget would be thrown away: stop the statements still running
+            for task in running.values():
+                if task.cur is not None and not task.limit:
+                    _cancel_quietly(task.cur)
+        if deadline:
+            now = time.monotonic()
+            for task in running.values():
+                if task.started and not task.timed_out and now - task.started > deadline and task.cur is not None:
+                    task.timed_out = True
+                    _cancel_quietly(task.cur)
+
+    ok = [t for t in tasks if t.error is None and not t.skipped]
+    failed = [t for t in tasks if t.error is not None]
+    skipped = [t for t in tasks if t.skipped and t.error is None]
+    per_database = []
+    for t in tasks:
+        item = {"db_name": t.db_name, "status": "error" if t.error else "skipped" if t.skipped else "success",
+                "ms": t.ms}
+        if t.error:
+            item["reason"] = t.error
+        elif t.skipped:
+            item["reason"] = f"Fan-out {budget.hit} limit reached"
+        elif t.description is None:
+            item["rows_affected"] = t.rows_affected
+        else:
+            item["row_count"] = len(t.rows)
+            if t.limit:
+                item["truncated"] = True
+                item["limit_hit"] = t.limit
+        per_database.append(item)
+
+    result: Dict[str, Any] = {
+        "status": "success" if not failed else ("partial" if ok else "error"),
+        "query_id": query_id,
+        "aggregate": aggregate,
+        "databases": len(tasks),
+        "succeeded": len(ok),
+        "failed": len(failed),
+        "skipped": len(skipped),
+        "seconds": round(time.monotonic() - started, 3),
+        "per_database": per_database,
+    }
+    if budget.hit:
+        result["truncated"] = True
+        result["limit"] = {"rows": row_limit, "bytes": QUERY_MAX_BYTES}[budget.hit]
+        result["limit_hit"] = budget.hit
+    if not ok:
+        result["reason"] = "Query failed on every database"
+        return result
+
+    with_rows = [t for t in ok if t.description is not None]
+    if aggregate == "count" or not with_rows:
+        result["row_count"] = sum(len(t.rows) for t in with_rows)
+        return result
+
+    # Databases must agree on the result columns to be merged
+    description = with_rows[0].description
+    columns = [d[0] for d in description]
+    merged = []
+    for t in with_rows:
+        if [d[0] for d in t.description] != columns:
+            t.error = f"Result columns {[d[0] for d in t.description]} differ from {columns}"
+            for item in per_database:
+                if item["db_name"] == t.db_name:
+                    item.update(status="error", reason=t.error)
+            result["status"] = "partial"
+            result["succeeded"] -= 1
+            result["failed"] += 1
+            continue
+        merged.append(t)
+
+    with metrics.span("merge"):
+        if aggregate == "sum":
+            shape = _ResultShape(description, fmt)
+            rows = [shape.prepare(r) for r in _sum_rows(merged, description)]
+        else:
+            tag = "db_name" if "db_name" not in columns else "_db_name"
+            shape = _ResultShape(((tag, str, None, None, None, None, False),) + tuple(description), fmt)
+            rows = [shape.prepare((t.db_name, *r)) for t in merged for r in t.rows]
+    result["row_count"] = len(rows)
+    result.update(shape.build(rows))
+    return result
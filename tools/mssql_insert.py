@@ -1,9 +1,17 @@
+import csv
+import io
 import json
 import logging
-from typing import Dict, Any
+import os
+from typing import Dict, Any, List, Optional, Union
+
+import metrics
+from result_cache import invalidate_tables
 
 logger = logging.getLogger(__name__)
 
+BULK_BATCH_SIZE = int(os.getenv("MSSQL_BULK_BATCH_SIZE", "1000"))
+
 def smart_parse_json(data):
     for _ in range(5):
         if isinstance(data, str):
@@ -23,7 +31,7 @@ def insert_row(
     """
     Insert a row into the given table on the specified database (db_name).
     """
-    from server import get_conn
+    from server import get_conn, release_conn
 
     conn = None
     cur = None
@@ -33,8 +41,12 @@ def insert_row(
         placeholders = ", ".join(["?" for _ in data])
         sql = f"INSERT INTO {table} ({columns}) VALUES ({placeholders})"
         cur = conn.cursor()
-        cur.execute(sql, tuple(data.values()))
-        conn.commit()
+        metrics.note_sql(sql)
+        with metrics.span("execute"):
+            cur.execute(sql, tuple(data.values()))
+        with metrics.span("commit"):
+            conn.commit()
+        invalidate_tables(db_name, table)
         return {"status": "success", "message": f"Inserted into {table}", "rows_affected": cur.rowcount}
     except Exception as e:
         logger.exception("Insert failed")
@@ -47,6 +59,118 @@ def insert_row(
             pass
         try:
             if conn:
-                conn.close()
+                release_conn(conn)
+        except:
+            pass
+
+
+def parse_bulk_rows(rows: Union[str, List[Dict[str, Any]]], fmt: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Accept a list of dicts, a JSON array, JSON-lines (fmt="jsonl") or CSV with a header row (fmt="csv").
+    Empty CSV fields are NULL.
+    """
+    if isinstance(rows, str) and fmt == "csv":
+        return [{k: (v if v != "" else None) for k, v in r.items()} for r in csv.DictReader(io.StringIO(rows))]
+    if isinstance(rows, str) and fmt == "jsonl":
+        return [json.loads(line) for line in rows.splitlines() if line.strip()]
+    rows = smart_parse_json(rows)
+    if isinstance(rows, dict):
+        rows = [rows]
+    if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+        raise ValueError("'rows' must be a list of JSON objects, JSON-lines or CSV")
+    return rows
+
+
+def bulk_insert_rows(
+    table: str,
+    rows: Union[str, List[Dict[str, Any]]],
+    db_name: str = "default",
+    fmt: Optional[str] = None,
+    batch_size: Optional[int] = None,
+    commit: str = "batch",
+) -> Dict[str, Any]:
+    """
+    Insert many rows with pyodbc fast_executemany, batch_size rows per round trip.
+
+    commit="batch" commits after every batch and skips failed ones (reported in
+    failed_batches); commit="call" runs everything in one transaction and rolls
+    back on the first failure.
+    """
+    from server import get_conn, release_conn
+
+    if commit not in ("batch", "call"):
+        return {"status": "error", "reason": "'commit' must be 'batch' or 'call'"}
+
+    conn = None
+    cur = None
+    try:
+        records = parse_bulk_rows(rows, fmt)
+        if not records:
+            return {"status": "success", "message": "No rows to insert", "rows_inserted": 0, "failed_batches": []}
+
+        # Column list built once: union of keys in first-seen order, missing values become NULL
+        columns = list(dict.fromkeys(k for r in records for k in r.keys()))
+        col_sql = ", ".join([f"[{k}]" for k in columns])
+        placeholders = ", ".join(["?" for _ in columns])
+        sql = f"INSERT INTO {table} ({col_sql}) VALUES ({placeholders})"
+        values = [tuple(r.get(k) for k in columns) for r in records]
+
+        size = max(1, int(batch_size or BULK_BATCH_SIZE))
+        metrics.note_sql(sql)
+        conn = get_conn(db_name)
+        cur = conn.cursor()
+        cur.fast_executemany = True
+
+        inserted = 0
+        failed_batches = []
+        for index, start in enumerate(range(0, len(values), size)):
+            chunk = values[start:start + size]
+            try:
+                with metrics.span("execute"):
+                    cur.executemany(sql, chunk)
+                if commit == "batch":
+                    with metrics.span("commit"):
+                        conn.commit()
+                inserted += len(chunk)
+            except Exception as e:
+                conn.rollback()
+                logger.warning("Bulk insert batch %d into %s failed: %s", index, table, e)
+                failed_batches.append({"batch": index, "first_row": start, "rows": len(chunk), "reason": str(e)})
+                if commit == "call":
+                    return {
+                        "status": "error",
+                        "reason": f"Batch {index} failed; transaction rolled back",
+                        "rows_inserted": 0,
+                        "failed_batches": failed_batches,
+                    }
+        if commit == "call":
+            with metrics.span("commit"):
+                conn.commit()
+        if inserted:
+            invalidate_tables(db_name, table)
+
+        if not failed_batches:
+            status = "success"
+        else:
+            status = "partial" if inserted else "error"
+        return {
+            "status": status,
+            "message": f"Inserted into {table}",
+            "rows_inserted": inserted,
+            "batches": (len(values) + size - 1) // size,
+            "failed_batches": failed_batches,
+        }
+    except Exception as e:
+        logger.exception("Bulk insert failed")
+        return {"status": "error", "reason": str(e)}
+    finally:
+        try:
+            if cur:
+                cur.close()
+        except:
+            pass
+        try:
+            if conn:
+                release_conn(conn)
         except:
             pass
@@ -0,0 +1,328 @@
+import contextvars
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import state
+
+logger = logging.getLogger(__name__)
+
+# Calls slower than this (ms) get their estimated plan captured in the background (0 = off)
+PROFILE_SLOW_MS = float(os.getenv("MSSQL_PROFILE_SLOW_MS", os.getenv("MSSQL_SLOW_CALL_MS", "1000")))
+# The same statement is auto-profiled at most once per this many seconds
+PROFILE_COOLDOWN = float(os.getenv("MSSQL_PROFILE_COOLDOWN", "300"))
+PROFILES_KEPT = int(os.getenv("MSSQL_PROFILES_KEPT", "50"))
+# Plan XML kept per profile for mssql_profiles_tool (summaries are always kept)
+PROFILE_PLAN_CHARS = int(os.getenv("MSSQL_PROFILE_PLAN_CHARS", str(256 * 1024)))
+TOP_OPERATORS = 5
+
+PROFILE_ON = "SET STATISTICS IO ON; SET STATISTICS TIME ON; SET STATISTICS XML ON"
+PROFILE_OFF = "SET STATISTICS IO OFF; SET STATISTICS TIME OFF; SET STATISTICS XML OFF"
+
+_NS = {"p": "http://schemas.microsoft.com/sqlserver/2004/07/showplan"}
+_SHOWPLAN_COLUMN = "Microsoft SQL Server 2005 XML Showplan"
+
+# "Table 'Orders'. Scan count 1, logical reads 42, physical reads 0, ..."
+_IO_LINE = re.compile(r"Table '([^']+)'\. Scan count (\d+), logical reads (\d+), physical reads (\d+)", re.I)
+# "SQL Server Execution Times: CPU time = 15 ms,  elapsed time = 20 ms."
+_TIME_LINE = re.compile(r"Execution Times:\s*CPU time = (\d+) ms,\s*elapsed time = (\d+) ms", re.I)
+
+_PROFILES = deque(maxlen=PROFILES_KEPT)
+_PROFILES_LOCK = threading.Lock()
+_AUTO_SEEN: Dict[Tuple[str, str], float] = {}
+# Background estimated-plan captures; small on purpose, they only run for slow calls
+_AUTO_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="mssql-profile")
+
+
+# -------------------- COLLECTION ------------------------
+def collect_messages(cur, into: List[str]):
+    """Append the informational messages of the cursor's current result set (pyodbc >= 4.0.31)."""
+    for message in getattr(cur, "messages", None) or ():
+        into.append(message[1] if isinstance(message, (tuple, list)) and len(message) > 1 else str(message))
+
+
+def is_plan(cur) -> bool:
+    return bool(cur.description) and cur.description[0][0] == _SHOWPLAN_COLUMN
+
+
+def skip_plans(cur, messages: List[str]) -> List[str]:
+    """
+    Consume showplan result sets at the cursor's current position. Statements
+    without a rowset of their own (DML under SET NOCOUNT ON, procedures) put
+    their plan first; call right after execute so it is not taken for data.
+    """
+    plans: List[str] = []
+    while is_plan(cur):
+        plans += [row[0] for row in cur.fetchall() if row and row[0]]
+        if not cur.nextset():
+            break
+        collect_messages(cur, messages)
+    return plans
+
+
+def drain_plans(cur, messages: List[str]) -> List[str]:
+    """Read the remaining result sets, keeping the showplan XML ones; call after the data was fetched."""
+    plans: List[str] = []
+    while cur.nextset():
+        collect_messages(cur, messages)
+        if is_plan(cur):
+            plans += [row[0] for row in cur.fetchall() if row and row[0]]
+        elif cur.description:
+            cur.fetchall()
+    return plans
+
+
+# -------------------- SUMMARIES ------------------------
+def _io_stats(messages: List[str]) -> Dict[str, Any]:
+    tables: Dict[str, Dict[str, int]] = {}
+    cpu = elapsed = 0
+    for text in messages:
+        for table, scans, logical, physical in _IO_LINE.findall(text):
+            t = tables.setdefault(table, {"scans": 0, "logical_reads": 0, "physical_reads": 0})
+            t["scans"] += int(scans)
+            t["logical_reads"] += int(logical)
+            t["physical_reads"] += int(physical)
+        for c, e in _TIME_LINE.findall(text):
+            cpu += int(c)
+            elapsed += int(e)
+    stats: Dict[str, Any] = {}
+    if tables:
+        stats["logical_reads"] = sum(t["logical_reads"] for t in tables.values())
+        stats["physical_reads"] = sum(t["physical_reads"] for t in tables.values())
+        stats["tables"] = dict(sorted(tables.items(), key=lambda kv: -kv[1]["logical_reads"]))
+    if cpu or elapsed:
+        stats["cpu_ms"] = cpu
+        stats["elapsed_ms"] = elapsed
+    return stats
+
+
+def _float(value: Optional[str]) -> float:
+    try:
+        return float(value) if value is not None else 0.0
+    except ValueError:
+        return 0.0
+
+
+_RELOP = f"{{{_NS['p']}}}RelOp"
+
+
+def _child_ops(op) -> List[Any]:
+    """RelOps directly under op (nested inside its operator element, not inside another RelOp)."""
+    found, stack = [], list(op)
+    while stack:
+        el = stack.pop()
+        if el.tag == _RELOP:
+            found.append(el)
+        else:
+            stack.extend(el)
+    return found
+
+
+def _operators(root) -> List[Dict[str, Any]]:
+    """Every RelOp with its own cost (subtree cost minus its children's) and actual counters if present."""
+    found = []
+    for op in root.iter(_RELOP):
+        subtree = _float(op.get("EstimatedTotalSubtreeCost"))
+        own = max(subtree - sum(_float(c.get("EstimatedTotalSubtreeCost")) for c in _child_ops(op)), 0.0)
+        entry: Dict[str, Any] = {
+            "node": int(op.get("NodeId", -1)),
+            "op": op.get("PhysicalOp"),
+            "logical_op": op.get("LogicalOp"),
+            "cost": round(own, 6),
+            "est_rows": _float(op.get("EstimateRows")),
+        }
+        obj = op.find("./*/p:Object", _NS)
+        if obj is not None:
+            entry["object"] = ".".join(
+                v.strip("[]") for v in (obj.get("Schema"), obj.get("Table"), obj.get("Index")) if v
+            )
+        counters = op.findall("./p:RunTimeInformation/p:RunTimeCountersPerThread", _NS)
+        if counters:
+            entry["actual_rows"] = sum(int(c.get("ActualRows", 0)) for c in counters)
+            reads = [int(c.get("ActualLogicalReads")) for c in counters if c.get("ActualLogicalReads")]
+            if reads:
+                entry["logical_reads"] = sum(reads)
+            elapsed = [int(c.get("ActualElapsedms")) for c in counters if c.get("ActualElapsedms")]
+            if elapsed:
+                entry["elapsed_ms"] = max(elapsed)
+        found.append(entry)
+    return found
+
+
+def _missing_indexes(root) -> List[Dict[str, Any]]:
+    hints = []
+    for group in root.iterfind(".//p:MissingIndexes/p:MissingIndexGroup", _NS):
+        for index in group.iterfind("p:MissingIndex", _NS):
+            cols: Dict[str, List[str]] = {}
+            for cg in index.iterfind("p:ColumnGroup", _NS):
+                cols.setdefault(cg.get("Usage"), []).extend(c.get("Name") for c in cg.iterfind("p:Column", _NS))
+            table = ".".join(v for v in (index.get("Schema"), index.get("Table")) if v)
+            keys = cols.get("EQUALITY", []) + cols.get("INEQUALITY", [])
+            sql = f"CREATE INDEX [IX_mcp_hint] ON {table} ({', '.join(keys)})"
+            if cols.get("INCLUDE"):
+                sql += f" INCLUDE ({', '.join(cols['INCLUDE'])})"
+            hints.append({"impact": _float(group.get("Impact")), "table": table, "equality": cols.get("EQUALITY", []),
+                          "inequality": cols.get("INEQUALITY", []), "include": cols.get("INCLUDE", []), "sql": sql})
+    return hints
+
+
+def _plan_stats(plans: List[str]) -> Dict[str, Any]:
+    operators: List[Dict[str, Any]] = []
+    missing: List[Dict[str, Any]] = []
+    stats: Dict[str, Any] = {"estimated_cost": 0.0}
+    warnings = set()
+    for xml in plans:
+        try:
+            root = ET.fromstring(xml)
+        except ET.ParseError as e:
+            logger.warning("Unparseable showplan: %s", e)
+            continue
+        for stmt in root.iterfind(".//p:StmtSimple", _NS):
+            stats["estimated_cost"] += _float(stmt.get("StatementSubTreeCost"))
+        for qts in root.iterfind(".//p:QueryTimeStats", _NS):
+            stats["plan_cpu_ms"] = stats.get("plan_cpu_ms", 0) + int(qts.get("CpuTime", 0))
+            stats["plan_elapsed_ms"] = stats.get("plan_elapsed_ms", 0) + int(qts.get("ElapsedTime", 0))
+        for w in root.iterfind(".//p:Warnings/*", _NS):
+            warnings.add(w.tag.split("}")[-1])
+        operators += _operators(root)
+        missing += _missing_indexes(root)
+    stats["estimated_cost"] = round(stats["estimated_cost"], 6)
+    stats["top_operators"] = sorted(operators, key=lambda o: -o["cost"])[:TOP_OPERATORS]
+    if missing:
+        # Several statements can ask for the same index; keep its highest impact
+        unique = {m["sql"]: m for m in sorted(missing, key=lambda m: m["impact"])}
+        stats["missing_indexes"] = sorted(unique.values(), key=lambda m: -m["impact"])
+    if warnings:
+        stats["warnings"] = sorted(warnings)
+    return stats
+
+
+def summarize(messages: List[str], plans: List[str]) -> Dict[str, Any]:
+    """Logical reads, CPU/elapsed ms, top operators and missing-index hints of one execution."""
+    summary = _io_stats(messages)
+    if plans:
+        summary.update(_plan_stats(plans))
+    return summary
+
+
+# -------------------- RING BUFFER ------------------------
+def record(db_name: str, sql: str, trigger: str, elapsed_ms: float, summary: Dict[str, Any],
+           plans: List[str]) -> str:
+    """Keep a profile in the ring buffer; returns its id."""
+    plan_xml = "\n".join(plans)
+    entry = {
+        "profile_id": uuid.uuid4().hex[:16],
+        "at": int(time.time()),
+        "user": state.current().username,
+        "db_name": db_name,
+        "trigger": trigger,
+        "call_ms": round(elapsed_ms, 1),
+        "sql": sql[:2000],
+        "summary": summary,
+        "plan_xml": plan_xml[:PROFILE_PLAN_CHARS] if plan_xml else None,
+        "plan_truncated": len(plan_xml) > PROFILE_PLAN_CHARS,
+    }
+    with _PROFILES_LOCK:
+        _PROFILES.append(entry)
+    return entry["profile_id"]
+
+
+def _visible(entry: Dict[str, Any]) -> bool:
+    from tools.mssql_query import ADMIN_USERS
+
+    user = state.current().username
+    return user in ADMIN_USERS or entry["user"] == user
+
+
+def list_profiles(profile_id: Optional[str] = None, limit: int = 20) -> Dict[str, Any]:
+    """Recent profiles (newest first, without plan XML), or one profile with its plan XML."""
+    with _PROFILES_LOCK:
+        entries = [e for e in _PROFILES if _visible(e)]
+    if profile_id:
+        for e in entries:
+            if e["profile_id"] == profile_id:
+                return {"status": "success", **e}
+        return {"status": "error", "reason": f"Unknown profile '{profile_id}'"}
+    limit = max(1, int(limit or 20))
+    return {
+        "status": "success",
+        "profiles": [{k: v for k, v in e.items() if k != "plan_xml"} for e in reversed(entries[-limit:])],
+    }
+
+
+# -------------------- AUTOMATIC CAPTURE ------------------------
+def _estimated_plan(db_name: str, query: str, params: Optional[List[Any]], elapsed_ms: float, read_only: bool):
+    """
+    Capture the estimated plan with SHOWPLAN_XML: the statement is compiled, not
+    run again, so this is safe for writes and costs no second execution.
+    """
+    from server import get_conn, release_conn
+
+    conn = None
+    cur = None
+    discard = False
+    try:
+        # Compiled where the statement itself ran
+        conn = get_conn(db_name, read_only=read_only)
+        cur = conn.cursor()
+        cur.execute("SET SHOWPLAN_XML ON")
+        try:
+            if params:
+                cur.execute(query, params)
+            else:
+                cur.execute(query)
+            plans = []
+            while True:
+                if cur.description:
+                    plans += [row[0] for row in cur.fetchall() if row and row[0]]
+                if not cur.nextset():
+                    break
+        finally:
+            try:
+                cur.execute("SET SHOWPLAN_XML OFF")
+            except Exception:
+                # a connection left in SHOWPLAN mode would not run anything
+                discard = True
+                raise
+        profile_id = record(db_name, query, "slow", elapsed_ms, _plan_stats(plans) if plans else {}, plans)
+        logger.info("Captured the estimated plan of a slow query on %s (profile %s)", db_name, profile_id)
+    except Exception as e:
+        logger.warning("Could not capture the plan of a slow query on %s: %s", db_name, e)
+    finally:
+        try:
+            if cur:
+                cur.close()
+        except Exception:
+            pass
+        try:
+            if conn:
+                release_conn(conn, discard=discard)
+        except Exception:
+            pass
+
+
+def maybe_profile_slow(db_name: str, query: str, params: Optional[List[Any]], elapsed_ms: float,
+                       read_only: bool = False) -> bool:
+    """Queue an estimated-plan capture when a call crossed PROFILE_SLOW_MS (once per statement per cooldown)."""
+    if not PROFILE_SLOW_MS or elapsed_ms < PROFILE_SLOW_MS:
+        return False
+    now = time.monotonic()
+    key = (db_name, query)
+    with _PROFILES_LOCK:
+        if now - _AUTO_SEEN.get(key, -PROFILE_COOLDOWN) < PROFILE_COOLDOWN:
+            return False
+        _AUTO_SEEN[key] = now
+        if len(_AUTO_SEEN) > 4 * PROFILES_KEPT:
+            for k in [k for k, t in _AUTO_SEEN.items() if now - t >= PROFILE_COOLDOWN]:
+                del _AUTO_SEEN[k]
+    # contextvars carry the caller's session into the background capture
+    _AUTO_POOL.submit(contextvars.copy_context().run, _estimated_plan, db_name, query, params, elapsed_ms,
+                     read_only)
+    return True
@@ -1,35 +1,514 @@
+import base64
+import datetime
+import decimal
+import json
 import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
 from typing import Any, List, Optional, Dict
 
+import db_pool
+import metrics
+import state
+from result_cache import RESULT_CACHE, RESULT_CACHE_DEFAULT, invalidate_tables, is_cacheable, is_read_only, \
+    referenced_tables
+from tools.mssql_profile import PROFILE_OFF, PROFILE_ON, collect_messages, drain_plans, maybe_profile_slow, \
+    record, skip_plans, summarize
+
 logger = logging.getLogger(__name__)
 
-def run_query(query: str, params: Optional[List[Any]] = None, db_name: str = "default") -> Dict[str, Any]:
+# Paged (cursor-handle) mode
+CURSOR_IDLE_TIMEOUT = float(os.getenv("MSSQL_CURSOR_IDLE_TIMEOUT", "120"))
+PAGE_MAX_ROWS = int(os.getenv("MSSQL_PAGE_MAX_ROWS", "1000"))
+PAGE_MAX_BYTES = int(os.getenv("MSSQL_PAGE_MAX_BYTES", str(1024 * 1024)))
+MAX_OPEN_CURSORS = int(os.getenv("MSSQL_MAX_OPEN_CURSORS", "64"))
+# Each open cursor holds a pooled connection: keep most of every pool for other calls
+MAX_CURSORS_PER_POOL = int(os.getenv("MSSQL_MAX_CURSORS_PER_POOL", "0"))  # 0 = a quarter of the pool's max_size
+MAX_SESSION_CURSORS = int(os.getenv("MSSQL_MAX_SESSION_CURSORS", "8"))
+FETCH_BATCH = 200
+
+# Guardrails (0 = no limit); per-call values can only lower them
+QUERY_TIMEOUT = int(os.getenv("MSSQL_QUERY_TIMEOUT", "120"))
+QUERY_MAX_ROWS = int(os.getenv("MSSQL_QUERY_MAX_ROWS", "100000"))
+QUERY_MAX_BYTES = int(os.getenv("MSSQL_QUERY_MAX_BYTES", str(64 * 1024 * 1024)))
+# Users allowed to list and cancel everyone's queries (others only see their own)
+ADMIN_USERS = {u.strip() for u in os.getenv("MSSQL_ADMIN_USERS", "").split(",") if u.strip()}
+
+# Result encodings: "rows" = list of dicts (default), "columnar" = {columns, types, rows: [[...]]},
+# "arrays" = {columns, types, data: {column: [...]}}
+RESULT_FORMATS = ("rows", "columnar", "arrays")
+
+
+def _encode_binary(v) -> str:
+    return base64.b64encode(bytes(v)).decode("ascii")
+
+
+# Compact formats encode by column type: Decimal as exact string, temporal as ISO-8601, binary as base64
+_ENCODERS = {
+    decimal.Decimal: str,
+    datetime.datetime: datetime.datetime.isoformat,
+    datetime.date: datetime.date.isoformat,
+    datetime.time: datetime.time.isoformat,
+    bytes: _encode_binary,
+    bytearray: _encode_binary,
+    uuid.UUID: str,
+}
+
+
+class _ResultShape:
+    """Column metadata plus the per-column encoders for one result set."""
+
+    def __init__(self, description, fmt: str = "rows"):
+        self.cols = [desc[0] for desc in description]
+        self.types = [getattr(desc[1], "__name__", str(desc[1])) for desc in description]
+        self.fmt = fmt
+        self.encoders = [_ENCODERS.get(desc[1]) for desc in description]
+        self.compact = fmt != "rows" and any(self.encoders)
+        # dict rows repeat every column name
+        self.name_overhead = sum(len(c) + 4 for c in self.cols) if fmt == "rows" else 0
+
+    def prepare(self, row):
+        if not self.compact:
+            return row
+        return [enc(v) if enc is not None and v is not None else v for enc, v in zip(self.encoders, row)]
+
+    def size(self, prepared) -> int:
+        return len(json.dumps(list(prepared), default=str)) + self.name_overhead
+
+    def build(self, prepared_rows: List[Any]) -> Dict[str, Any]:
+        if self.fmt == "columnar":
+            return {"format": "columnar", "columns": self.cols, "types": self.types,
+                    "rows": [list(r) for r in prepared_rows]}
+        if self.fmt == "arrays":
+            columns = list(zip(*prepared_rows)) if prepared_rows else [() for _ in self.cols]
+            return {"format": "arrays", "columns": self.cols, "types": self.types,
+                    "data": {c: list(values) for c, values in zip(self.cols, columns)}}
+        return {"data": [dict(zip(self.cols, row)) for row in prepared_rows]}
+
+
+class _CursorHandle:
+    def __init__(self, conn, cur, db_name: str, sql: str, fmt: str = "rows", discard: bool = False):
+        self.conn = conn
+        self.cur = cur
+        self.db_name = db_name
+        self.sql = sql
+        self.discard = discard  # the query left session state on the connection
+        self.owner = state.current().key
+        self.pool = db_pool.pool_of(conn)
+        self.shape = _ResultShape(cur.description, fmt)
+        self.pending = deque()
+        self.exhausted = False
+        self.rows_sent = 0
+        self.row_limit = 0
+        self.timeout = 0
+        self.truncated = False
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+
+
+_HANDLES: Dict[str, _CursorHandle] = {}
+# cursor_id -> (session key, pool) of paged queries still running their first page
+_RESERVED: Dict[str, tuple] = {}
+_HANDLES_LOCK = threading.Lock()
+_sweeper = None
+
+
+def _close_handle(handle: _CursorHandle):
+    from server import release_conn
+
+    try:
+        handle.cur.close()
+    except Exception:
+        pass
+    try:
+        release_conn(handle.conn, discard=handle.discard)
+    except Exception:
+        pass
+
+
+def _expire_idle_handles():
+    cutoff = time.monotonic() - CURSOR_IDLE_TIMEOUT
+    with _HANDLES_LOCK:
+        expired = [cid for cid, h in _HANDLES.items() if h.last_used < cutoff and not h.lock.locked()]
+        handles = [_HANDLES.pop(cid) for cid in expired]
+    for h in handles:
+        logger.info("Expired idle cursor on %s after %d rows", h.db_name, h.rows_sent)
+        _close_handle(h)
+
+
+def _sweep_loop():
+    while True:
+        time.sleep(max(1.0, CURSOR_IDLE_TIMEOUT / 4))
+        try:
+            _expire_idle_handles()
+        except Exception:
+            logger.exception("Cursor sweep failed")
+
+
+def _start_sweeper():
+    global _sweeper
+    if _sweeper is None:
+        _sweeper = threading.Thread(target=_sweep_loop, name="cursor-sweeper", daemon=True)
+        _sweeper.start()
+
+
+def _pool_cursor_limit(pool: db_pool.ConnectionPool) -> int:
+    limit = MAX_CURSORS_PER_POOL or max(1, pool.max_size // 4)
+    return max(1, min(limit, pool.max_size - 1))
+
+
+def _reserve_cursor(conn, db_name: str) -> str:
+    """
+    Take a cursor slot before a paged query runs, so a full cursor table fails
+    the call up front instead of throwing away its first page.
+    """
+    owner = state.current().key
+    pool = db_pool.pool_of(conn)
+    cursor_id = uuid.uuid4().hex
+    with _HANDLES_LOCK:
+        slots = [(h.owner, h.pool) for h in _HANDLES.values()] + list(_RESERVED.values())
+        if len(slots) >= MAX_OPEN_CURSORS:
+            raise Exception(f"Too many open cursors ({MAX_OPEN_CURSORS}); close or drain one first")
+        if sum(1 for o, _ in slots if o == owner) >= MAX_SESSION_CURSORS:
+            raise Exception(f"Too many open cursors for this session ({MAX_SESSION_CURSORS}); close or drain one first")
+        if pool is not None:
+            limit = _pool_cursor_limit(pool)
+            if sum(1 for _, p in slots if p is pool) >= limit:
+                raise Exception(f"Too many open cursors on {db_name} ({limit}); close or drain one first")
+        _RESERVED[cursor_id] = (owner, pool)
+    return cursor_id
+
+
+def _register_handle(cursor_id: str, handle: _CursorHandle):
+    """Turn the reservation into an open cursor (see _reserve_cursor)."""
+    with _HANDLES_LOCK:
+        _RESERVED.pop(cursor_id, None)
+        _HANDLES[cursor_id] = handle
+        _start_sweeper()
+
+
+def _unreserve(cursor_id: str):
+    with _HANDLES_LOCK:
+        _RESERVED.pop(cursor_id, None)
+
+
+def _read_page(handle: _CursorHandle, max_rows: int, max_bytes: int) -> Dict[str, Any]:
+    """Pull up to max_rows / ~max_bytes rows; rows past the byte budget stay pending for the next page."""
+    shape = handle.shape
+    if handle.row_limit:
+        max_rows = max(0, min(max_rows, handle.row_limit - handle.rows_sent))
+    rows = []
+    size = 0
+    while len(rows) < max_rows:
+        if not handle.pending:
+            if handle.exhausted:
+                break
+            with metrics.span("fetch"):
+                batch = handle.cur.fetchmany(min(FETCH_BATCH, max_rows - len(rows)))
+            if not batch:
+                handle.exhausted = True
+                break
+            handle.pending.extend(shape.prepare(r) for r in batch)
+        row_size = shape.size(handle.pending[0])
+        if rows and size + row_size > max_bytes:
+            break
+        rows.append(handle.pending.popleft())
+        size += row_size
+    handle.rows_sent += len(rows)
+    handle.last_used = time.monotonic()
+    metrics.note_rows(len(rows))
+    page = {"row_count": len(rows), **shape.build(rows)}
+    if handle.row_limit and handle.rows_sent >= handle.row_limit and not handle.exhausted:
+        # Row ceiling reached: stop the server from streaming the rest
+        handle.truncated = bool(handle.pending) or handle.cur.fetchone() is not None
+        handle.pending.clear()
+        handle.exhausted = True
+        _cancel_quietly(handle.cur)
+    if handle.truncated:
+        page["truncated"] = True
+    return page
+
+
+def _cancel_quietly(cur):
+    try:
+        cur.cancel()
+    except Exception:
+        pass
+
+
+def _cap(value: Optional[int], ceiling: int) -> int:
+    """Per-call limit, never above the configured ceiling (0 = unlimited)."""
+    if value is None or int(value) <= 0:
+        return ceiling
+    return min(int(value), ceiling) if ceiling else int(value)
+
+
+def _fetch_limited(cur, shape: _ResultShape, max_rows: int, max_bytes: int):
+    """
+    fetchmany() until the result ends or a ceiling is hit; returns (rows, limit hit or None).
+    Bytes are measured per batch and only row by row for the batch that crosses the limit.
+    """
+    rows: List[Any] = []
+    size = 0
+    while True:
+        if max_rows and len(rows) >= max_rows:
+            return rows, ("rows" if cur.fetchone() is not None else None)
+        batch = cur.fetchmany(min(FETCH_BATCH, max_rows - len(rows)) if max_rows else FETCH_BATCH)
+        if not batch:
+            return rows, None
+        prepared = [shape.prepare(r) for r in batch]
+        if max_bytes:
+            batch_size = len(json.dumps(prepared, default=str)) + shape.name_overhead * len(prepared)
+            if size + batch_size > max_bytes:
+                for row in prepared:
+                    size += shape.size(row)
+                    if size > max_bytes:
+                        return rows, "bytes"
+                    rows.append(row)
+                continue
+            size += batch_size
+        rows.extend(prepared)
+
+
+# -------------------- IN-FLIGHT QUERIES ------------------------
+class _InFlight:
+    def __init__(self, query_id: str, cur, db_name: str, sql: str):
+        session = state.current()
+        self.query_id = query_id
+        self.cur = cur
+        self.db_name = db_name
+        self.sql = sql[:200]
+        self.owner = session.username
+        self.started = time.monotonic()
+        self.cancelled = False
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "query_id": self.query_id,
+            "db_name": self.db_name,
+            "user": self.owner,
+            "running_seconds": round(time.monotonic() - self.started, 3),
+            "sql": self.sql,
+        }
+
+
+_INFLIGHT: Dict[str, _InFlight] = {}
+_INFLIGHT_LOCK = threading.Lock()
+
+
+@contextmanager
+def _track(query_id: str, cur, db_name: str, sql: str):
+    entry = _InFlight(query_id, cur, db_name, sql)
+    with _INFLIGHT_LOCK:
+        if query_id in _INFLIGHT:
+            raise Exception(f"Query id '{query_id}' is already running")
+        _INFLIGHT[query_id] = entry
+    try:
+        yield entry
+    finally:
+        with _INFLIGHT_LOCK:
+            _INFLIGHT.pop(query_id, None)
+
+
+def _visible(entry: _InFlight) -> bool:
+    user = state.current().username
+    return user in ADMIN_USERS or entry.owner == user
+
+
+def list_queries() -> Dict[str, Any]:
+    """Queries currently executing or fetching: the caller's own, or all of them for MSSQL_ADMIN_USERS."""
+    with _INFLIGHT_LOCK:
+        entries = [e for e in _INFLIGHT.values() if _visible(e)]
+    return {"status": "success", "queries": [e.describe() for e in sorted(entries, key=lambda e: e.started)]}
+
+
+def cancel_query(query_id: str) -> Dict[str, Any]:
+    """Cancel an in-flight run_query call (SQLCancel on its statement)."""
+    with _INFLIGHT_LOCK:
+        entry = _INFLIGHT.get(query_id)
+    if entry is None or not _visible(entry):
+        return {"status": "error", "reason": f"No running query '{query_id}'"}
+    entry.cancelled = True
+    entry.cur.cancel()
+    logger.info("Cancelled query %s on %s for %s", query_id, entry.db_name, state.current().username)
+    return {"status": "success", "message": f"Cancel sent to query '{query_id}'", **entry.describe()}
+
+
+def _query_error(e: Exception, entry: Optional[_InFlight], timeout: int) -> str:
+    if entry is not None and entry.cancelled:
+        return "Query cancelled"
+    if "HYT00" in str(e):
+        return f"Query exceeded the {timeout}s timeout"
+    return str(e)
+
+
+def _page_limits(page_size: Optional[int], max_bytes: Optional[int]):
+    rows = min(int(page_size), PAGE_MAX_ROWS) if page_size else PAGE_MAX_ROWS
+    size = min(int(max_bytes), PAGE_MAX_BYTES) if max_bytes else PAGE_MAX_BYTES
+    return max(1, rows), max(1, size)
+
+
+def run_query(
+    query: str,
+    params: Optional[List[Any]] = None,
+    db_name: str = "default",
+    page_size: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    cache: Optional[bool] = None,
+    fmt: str = "rows",
+    timeout: Optional[int] = None,
+    max_rows: Optional[int] = None,
+    max_result_bytes: Optional[int] = None,
+    query_id: Optional[str] = None,
+    profile: Optional[bool] = None,
+    primary: Optional[bool] = None,
+) -> Dict[str, Any]:
     """
     Execute a SELECT or arbitrary query against the connection for db_name.
+
+    With page_size (or max_bytes) set, only the first page is returned together
+    with a cursor_id; the rest is pulled with fetch_page() while the cursor
+    stays open on its connection.
+
+    With cache=True (default: MSSQL_RESULT_CACHE) read-only SELECTs are served
+    from the result cache when an identical call was made recently.
+
+    fmt selects the encoding (see RESULT_FORMATS); "columnar" and "arrays" send
+    column names once and encode Decimal/datetime/binary values compactly.
+
+    timeout (seconds), max_rows and max_result_bytes lower the MSSQL_QUERY_*
+    ceilings for this call. A result cut at a ceiling has "truncated" set and
+    the rest of it is cancelled server-side. While it runs, the call can be
+    cancelled through cancel_query(query_id) (an id is generated if not given).
+
+    With profile=True the statement runs with STATISTICS IO/TIME/XML on and the
+    result carries a "profile" summary (logical reads, CPU/elapsed ms, costliest
+    operators, missing-index hints), also kept in the profile ring buffer.
+    Calls slower than MSSQL_PROFILE_SLOW_MS get their estimated plan captured
+    in the background (see tools/mssql_profile.py).
+
+    Read-only statements go to a readable secondary when the login has any
+    (see replicas.py); primary=True keeps them on the primary, e.g. to read
+    back a write that may not have reached the secondaries yet.
     """
-    from server import get_conn
+    from server import get_conn, release_conn
+
+    _expire_idle_handles()
+    metrics.note_sql(query)
+    fmt = fmt or "rows"
+    if fmt not in RESULT_FORMATS:
+        return {"status": "error", "reason": f"Unknown format '{fmt}'. Use one of {list(RESULT_FORMATS)}"}
+    timeout = _cap(timeout, QUERY_TIMEOUT)
+    row_limit = _cap(max_rows, QUERY_MAX_ROWS)
+    byte_limit = _cap(max_result_bytes, QUERY_MAX_BYTES)
+    query_id = str(query_id) if query_id else uuid.uuid4().hex
+    paged = bool(page_size or max_bytes)
+    if profile and paged:
+        return {"status": "error", "reason": "profile cannot be combined with page_size/max_bytes"}
+    use_cache = (RESULT_CACHE_DEFAULT if cache is None else bool(cache)) and not paged and not profile \
+        and is_cacheable(query)
+    cache_key = None
+    if use_cache:
+        cache_key = RESULT_CACHE.make_key(db_name, query, params, extra=f"{fmt}:{row_limit}:{byte_limit}")
+        cached = RESULT_CACHE.get(cache_key)
+        if cached is not None:
+            metrics.note_rows(cached.get("row_count") or 0)
+            return {**cached, "cached": True}
 
     conn = None
     cur = None
+    entry = None
+    cursor_id = None
+    profiling = False
+    # SET options / temp tables from the query must not reach the next borrower
+    discard = db_pool.changes_session(query)
+    messages: List[str] = []
+    plans: List[str] = []
     try:
-        conn = get_conn(db_name)
+        read_only = not primary and is_read_only(query)
+        conn = get_conn(db_name, read_only=read_only)
+        # Statement timeout (SQL_ATTR_QUERY_TIMEOUT) for cursors of this borrow; reset on release
+        conn.timeout = timeout
+        if paged:
+            cursor_id = _reserve_cursor(conn, db_name)
         cur = conn.cursor()
-        if params:
-            cur.execute(query, params)
-        else:
-            cur.execute(query)
+        if profile:
+            cur.execute(PROFILE_ON)
+            profiling = True
+        started = time.perf_counter()
+        with _track(query_id, cur, db_name, query) as entry:
+            with metrics.span("execute"):
+                if params:
+                    cur.execute(query, params)
+                else:
+                    cur.execute(query)
+            if not is_read_only(query):
+                # Whatever comes back (OUTPUT rows, a trailing SELECT, procedure results)
+                invalidate_tables(db_name, query)
+            if profiling:
+                collect_messages(cur, messages)
+                plans = skip_plans(cur, messages)
 
-        if cur.description:
-            cols = [desc[0] for desc in cur.description]
-            rows = cur.fetchall()
-            data = [dict(zip(cols, row)) for row in rows]
-            return {"status": "success", "row_count": len(data), "data": data}
-        else:
-            return {"status": "success", "message": "Command executed"}
+            if cur.description and paged:
+                handle = _CursorHandle(conn, cur, db_name, query, fmt, discard=discard)
+                handle.row_limit = row_limit
+                handle.timeout = timeout
+                result = {"status": "success", **_read_page(handle, *_page_limits(page_size, max_bytes))}
+                maybe_profile_slow(db_name, query, params, (time.perf_counter() - started) * 1000.0, read_only)
+                if handle.exhausted and not handle.pending:
+                    return result
+                _register_handle(cursor_id, handle)
+                result["cursor_id"] = cursor_id
+                result["has_more"] = True
+                # ownership moved to the handle
+                conn = cur = None
+                return result
+            if cur.description:
+                shape = _ResultShape(cur.description, fmt)
+                with metrics.span("fetch"):
+                    rows, limit = _fetch_limited(cur, shape, row_limit, byte_limit)
+                metrics.note_rows(len(rows))
+                result = {"status": "success", "row_count": len(rows), **shape.build(rows)}
+                if limit:
+                    _cancel_quietly(cur)
+                    result["truncated"] = True
+                    result["limit"] = {"rows": row_limit, "bytes": byte_limit}[limit]
+                    result["limit_hit"] = limit
+                elif use_cache and not db_pool.from_replica(conn):
+                    # A lagging replica could hand back rows a write on the primary just invalidated
+                    RESULT_CACHE.put(cache_key, result, referenced_tables(query))
+            else:
+                result = {"status": "success", "message": "Command executed"}
+            elapsed_ms = (time.perf_counter() - started) * 1000.0
+            if profiling:
+                # The actual plan follows the data (or came first, see skip_plans); a cancelled
+                # (truncated) result has none after it
+                if not result.get("truncated"):
+                    plans += drain_plans(cur, messages)
+                summary = summarize(messages, plans)
+                result["profile"] = {"profile_id": record(db_name, query, "requested", elapsed_ms, summary, plans),
+                                     **summary}
+            else:
+                maybe_profile_slow(db_name, query, params, elapsed_ms, read_only)
+            return result
     except Exception as e:
         logger.exception("Query execution failed")
-        return {"status": "error", "reason": str(e)}
+        return {"status": "error", "reason": _query_error(e, entry, timeout), "query_id": query_id}
     finally:
+        if cursor_id is not None:
+            # no-op once the cursor was registered
+            _unreserve(cursor_id)
+        if profiling and cur:
+            try:
+                # Same cursor: a second one would find the connection busy with pending results
+                cur.execute(PROFILE_OFF)
+            except Exception:
+                # SET options outlive the borrow; never hand out a connection still profiling
+                discard = True
         try:
             if cur:
                 cur.close()
@@ -37,6 +516,50 @@ def run_query(query: str, params: Optional[List[Any]] = None, db_name: str = "de
             pass
         try:
             if conn:
-                conn.close()
+                release_conn(conn, discard=discard)
         except Exception:
             pass
+
+
+def fetch_page(cursor_id: str, page_size: Optional[int] = None, max_bytes: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Return the next page of an open cursor; the cursor is closed once drained.
+    While a page is fetched it can be stopped with cancel_query(cursor_id).
+    """
+    _expire_idle_handles()
+    with _HANDLES_LOCK:
+        handle = _HANDLES.get(cursor_id)
+    if handle is None or handle.owner != state.current().key:
+        return {"status": "error", "reason": f"Unknown or expired cursor '{cursor_id}'"}
+
+    entry = None
+    try:
+        with handle.lock:
+            with _track(cursor_id, handle.cur, handle.db_name, handle.sql) as entry:
+                page = _read_page(handle, *_page_limits(page_size, max_bytes))
+            done = handle.exhausted and not handle.pending
+    except Exception as e:
+        logger.exception("Cursor fetch failed")
+        close_cursor(cursor_id)
+        return {"status": "error", "reason": _query_error(e, entry, handle.timeout)}
+
+    result = {"status": "success", **page, "rows_sent": handle.rows_sent}
+    if done:
+        close_cursor(cursor_id)
+    else:
+        result["cursor_id"] = cursor_id
+        result["has_more"] = True
+    return result
+
+
+def close_cursor(cursor_id: str) -> Dict[str, Any]:
+    with _HANDLES_LOCK:
+        handle = _HANDLES.get(cursor_id)
+        if handle is None or handle.owner != state.current().key:
+            handle = None
+        else:
+            del _HANDLES[cursor_id]
+    if handle is None:
+        return {"status": "error", "reason": f"Unknown or expired cursor '{cursor_id}'"}
+    _close_handle(handle)
+    return {"status": "success", "message": "Cursor closed", "rows_sent": handle.rows_sent}
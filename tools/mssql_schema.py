@@ -1,29 +1,222 @@
 import logging
-from typing import Dict, Any
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+import metrics
+import snapshot
+import state
 
 logger = logging.getLogger(__name__)
 
+SCHEMA_CACHE_MAX_DBS = int(os.getenv("MSSQL_SCHEMA_CACHE_MAX_DBS", "32"))
+SCHEMA_PROBE_INTERVAL = float(os.getenv("MSSQL_SCHEMA_PROBE_INTERVAL", "30"))
+# Above this many changed tables a full reload is cheaper than a filtered one
+SCHEMA_PARTIAL_RELOAD_LIMIT = 500
+
+_VERSION_SQL = """
+    SELECT MAX(modify_date), COUNT(*)
+    FROM sys.objects
+    WHERE type IN ('U', 'V')
+"""
+
+_OBJECTS_SQL = """
+    SELECT object_id, modify_date
+    FROM sys.objects
+    WHERE type IN ('U', 'V')
+"""
+
+_COLUMNS_SQL = """
+    SELECT o.object_id, s.name, o.name, o.modify_date,
+           c.name AS COLUMN_NAME,
+           t.name AS DATA_TYPE,
+           CASE WHEN c.is_nullable = 1 THEN 'YES' ELSE 'NO' END AS IS_NULLABLE,
+           OBJECT_DEFINITION(c.default_object_id) AS COLUMN_DEFAULT
+    FROM sys.objects o
+    JOIN sys.schemas s ON s.schema_id = o.schema_id
+    JOIN sys.columns c ON c.object_id = o.object_id
+    JOIN sys.types t ON t.user_type_id = c.user_type_id
+    WHERE o.type IN ('U', 'V'){extra}
+    ORDER BY o.object_id, c.column_id
+"""
+
+
+class SchemaCatalog:
+    """
+    In-memory column catalog of one database.
+
+    Loaded in one set-based query; afterwards a cheap MAX(modify_date)/COUNT(*)
+    probe on sys.objects (at most every SCHEMA_PROBE_INTERVAL seconds) decides
+    whether tables changed, and only those are reloaded.
+
+    With a snapshot attached the catalog starts from the on-disk copy (the
+    first probe reconciles it) and is written back after every reload.
+    """
+
+    def __init__(self):
+        self.tables: Dict[int, Dict[str, Any]] = {}  # object_id -> {schema, name, modify_date, columns}
+        self.by_name: Dict[str, List[int]] = {}      # lower(name) and lower(schema.name) -> object_ids
+        self.version = None
+        self.checked_at = 0.0
+        self.loaded_at = 0.0
+        self.lock = threading.Lock()
+        self.snapshot: Optional[snapshot.Snapshot] = None
+        self.database: Optional[str] = None
+
+    def attach(self, snap: Optional[snapshot.Snapshot], database: str):
+        """Persist to snap, starting from its saved copy of database when fresh enough."""
+        self.snapshot, self.database = snap, database
+        if snap is None or snapshot.SNAPSHOT_FORCE_REFRESH:
+            return
+        try:
+            saved = snap.load_catalog(database)
+        except Exception as e:
+            logger.warning("Could not read the schema snapshot of %s: %s", database, e)
+            return
+        if saved is not None:
+            self.version, self.tables = saved
+            self.loaded_at = time.monotonic()
+            self.checked_at = 0.0  # probe on first use
+            self._reindex()
+
+    def _persist(self):
+        if self.snapshot is None:
+            return
+        try:
+            self.snapshot.save_catalog(self.database, self.version, self.tables)
+        except Exception as e:
+            logger.warning("Could not write the schema snapshot of %s: %s", self.database, e)
+
+    def _reindex(self):
+        index: Dict[str, List[int]] = {}
+        for oid, t in self.tables.items():
+            index.setdefault(t["name"].lower(), []).append(oid)
+            index.setdefault(f"{t['schema']}.{t['name']}".lower(), []).append(oid)
+        self.by_name = index
+
+    def _load(self, cur, object_ids: Optional[List[int]] = None):
+        if object_ids is None:
+            cur.execute(_COLUMNS_SQL.format(extra=""))
+            self.tables = {}
+        else:
+            marks = ", ".join(["?" for _ in object_ids])
+            cur.execute(_COLUMNS_SQL.format(extra=f" AND o.object_id IN ({marks})"), object_ids)
+            for oid in object_ids:
+                self.tables.pop(oid, None)
+        for oid, schema, name, modified, col, dtype, nullable, default in cur.fetchall():
+            entry = self.tables.get(oid)
+            if entry is None:
+                entry = self.tables[oid] = {"schema": schema, "name": name, "modify_date": modified, "columns": []}
+            entry["columns"].append(
+                {"COLUMN_NAME": col, "DATA_TYPE": dtype, "IS_NULLABLE": nullable, "COLUMN_DEFAULT": default}
+            )
+
+    def refresh(self, cur, force: bool = False) -> bool:
+        """Bring the catalog up to date. Returns True if anything was reloaded. Caller holds self.lock."""
+        cur.execute(_VERSION_SQL)
+        version = tuple(cur.fetchone())
+        self.checked_at = time.monotonic()
+        if not force and self.loaded_at and version == self.version:
+            return False
+
+        if force or not self.loaded_at:
+            self._load(cur)
+        else:
+            cur.execute(_OBJECTS_SQL)
+            current = {oid: modified for oid, modified in cur.fetchall()}
+            for oid in [oid for oid in self.tables if oid not in current]:
+                del self.tables[oid]
+            changed = [oid for oid, m in current.items() if oid not in self.tables or self.tables[oid]["modify_date"] != m]
+            if len(changed) > SCHEMA_PARTIAL_RELOAD_LIMIT:
+                self._load(cur)
+            elif changed:
+                self._load(cur, changed)
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self._reindex()
+        self._persist()
+        return True
+
+    def lookup(self, table_name: str) -> List[Dict[str, Any]]:
+        oids = self.by_name.get(table_name.strip("[]").lower(), [])
+        return [col for oid in oids for col in self.tables[oid]["columns"]]
+
+
+_CATALOGS: "OrderedDict[tuple, SchemaCatalog]" = OrderedDict()
+_CATALOGS_LOCK = threading.Lock()
+# Guarded by _CATALOGS_LOCK
+_hits = 0
+_misses = 0
+
+
+def _creds_key(creds: Dict[str, Any]) -> tuple:
+    # per login: sys.objects only lists what the login may see
+    return (creds.get("db_server"), str(creds.get("db_port")), creds.get("db_user"), creds.get("db_database"))
+
+
+def _session_keys() -> set:
+    """Catalog keys of every database the calling session can reach."""
+    return {_creds_key(c) for c in state.current().db_creds.values()}
+
+
+def _catalog_key(db_name: str) -> tuple:
+    db_creds = state.current().db_creds
+    creds = db_creds.get(db_name)
+    if creds is None:
+        raise Exception(f"Invalid database name '{db_name}'. Available: {list(db_creds.keys())}")
+    return _creds_key(creds)
+
+
+def _get_catalog(db_name: str) -> SchemaCatalog:
+    key = _catalog_key(db_name)
+    with _CATALOGS_LOCK:
+        catalog = _CATALOGS.get(key)
+        created = catalog is None
+        if created:
+            catalog = _CATALOGS[key] = SchemaCatalog()
+            # Lookups of this database wait on the catalog lock while the snapshot is read
+            catalog.lock.acquire()
+        _CATALOGS.move_to_end(key)
+        while len(_CATALOGS) > SCHEMA_CACHE_MAX_DBS:
+            _CATALOGS.popitem(last=False)
+    if created:
+        try:
+            catalog.attach(snapshot.for_login(key[0], key[1], key[2]), key[3])
+        finally:
+            catalog.lock.release()
+    return catalog
+
+
+def _count(hit: bool):
+    global _hits, _misses
+    with _CATALOGS_LOCK:
+        if hit:
+            _hits += 1
+        else:
+            _misses += 1
+
+
 def get_table_schema(table_name: str, db_name: str = "default") -> Dict[str, Any]:
     """
     Get schema information for a table in the selected database.
     """
-    from server import get_conn
+    from server import get_conn, release_conn
 
     conn = None
     cur = None
     try:
-        conn = get_conn(db_name)
-        query = """
-            SELECT COLUMN_NAME, DATA_TYPE, IS_NULLABLE, COLUMN_DEFAULT
-            FROM INFORMATION_SCHEMA.COLUMNS
-            WHERE TABLE_NAME = ?
-            ORDER BY ORDINAL_POSITION
-        """
-        cur = conn.cursor()
-        cur.execute(query, (table_name,))
-        cols = [desc[0] for desc in cur.description]
-        rows = cur.fetchall()
-        schema = [dict(zip(cols, row)) for row in rows]
+        catalog = _get_catalog(db_name)
+        with catalog.lock:
+            refreshed = False
+            if not catalog.loaded_at or time.monotonic() - catalog.checked_at >= SCHEMA_PROBE_INTERVAL:
+                conn = get_conn(db_name, read_only=True)
+                cur = conn.cursor()
+                with metrics.span("catalog_refresh"):
+                    refreshed = catalog.refresh(cur)
+            schema = catalog.lookup(table_name)
+        _count(hit=not refreshed)
         return {"status": "success", "table": table_name, "schema": schema}
     except Exception as e:
         logger.exception("Schema retrieval failed")
@@ -36,6 +229,71 @@ def get_table_schema(table_name: str, db_name: str = "default") -> Dict[str, Any
             pass
         try:
             if conn:
-                conn.close()
+                release_conn(conn)
         except:
             pass
+
+
+def refresh_schema_cache(db_name: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Drop the cached catalog of db_name (or of every database of the caller) and reload
+    db_name right away. Without db_name the on-disk snapshots of the caller's logins
+    are cleared too.
+    """
+    from server import get_conn, release_conn
+
+    if db_name is None:
+        keys = _session_keys()
+        with _CATALOGS_LOCK:
+            mine = [k for k in _CATALOGS if k in keys]
+            for k in mine:
+                del _CATALOGS[k]
+        dropped = len(mine)
+        logins = {(c["db_server"], c["db_port"], c["db_user"]) for c in state.current().db_creds.values()}
+        for login in logins:
+            snap = snapshot.for_login(*login)
+            if snap is not None:
+                snap.drop_catalogs()
+        return {"status": "success", "message": f"Dropped {dropped} cached catalogs"}
+
+    conn = None
+    cur = None
+    try:
+        catalog = _get_catalog(db_name)
+        conn = get_conn(db_name)
+        cur = conn.cursor()
+        with catalog.lock:
+            with metrics.span("catalog_refresh"):
+                catalog.refresh(cur, force=True)
+            tables = len(catalog.tables)
+        return {"status": "success", "message": f"Schema catalog for '{db_name}' reloaded", "tables": tables}
+    except Exception as e:
+        logger.exception("Schema refresh failed")
+        return {"status": "error", "reason": str(e)}
+    finally:
+        try:
+            if cur:
+                cur.close()
+        except:
+            pass
+        try:
+            if conn:
+                release_conn(conn)
+        except:
+            pass
+
+
+def schema_cache_stats() -> Dict[str, Any]:
+    """Hit/miss counters plus the cached catalogs and snapshot of the caller's logins."""
+    keys = _session_keys()
+    with _CATALOGS_LOCK:
+        catalogs = [(k, c) for k, c in _CATALOGS.items() if k in keys]
+        hits, misses = _hits, _misses
+    default = state.current().db_creds.get("default")
+    snap = snapshot.for_login(default["db_server"], default["db_port"], default["db_user"]) if default else None
+    return {
+        "hits": hits,
+        "misses": misses,
+        "databases": [{"database": key[3], "tables": len(c.tables)} for key, c in catalogs],
+        "snapshot": snap.stats() if snap is not None else None,
+    }
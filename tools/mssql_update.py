@@ -2,6 +2,9 @@ import json
 import logging
 from typing import Dict, Any, Union
 
+import metrics
+from result_cache import invalidate_tables
+
 logger = logging.getLogger(__name__)
 
 def smart_parse_json(data):
@@ -24,7 +27,7 @@ def update_row(
     """
     Update row(s) in the specified database and table.
     """
-    from server import get_conn
+    from server import get_conn, release_conn
 
     db_conn = cursor = None
     try:
@@ -42,8 +45,12 @@ def update_row(
         sql = f"UPDATE {table} SET {set_clause} WHERE {where_clause}"
         values = list(data.values()) + list(condition.values())
 
-        cursor.execute(sql, values)
-        db_conn.commit()
+        metrics.note_sql(sql)
+        with metrics.span("execute"):
+            cursor.execute(sql, values)
+        with metrics.span("commit"):
+            db_conn.commit()
+        invalidate_tables(db_name, table)
 
         return {"status": "success", "action": "update", "table": table, "rows_affected": cursor.rowcount}
 
@@ -58,6 +65,6 @@ def update_row(
             pass
         try:
             if db_conn:
-                db_conn.close()
+                release_conn(db_conn)
         except:
             pass